@@ -0,0 +1,27 @@
+"""
+Asynchronous WSGI config for toolset project.
+
+Python 2 has no asyncio and Django 1.11 has no ASGI support, so non-blocking execution is provided
+by gevent: sockets, DNS (dnspython), HTTP (httplib) and WHOIS (ipwhois) become cooperative and
+one process holds thousands of in-flight lookups. Worker pools of modules.tools run greenlets here.
+
+Run it with configs/uwsgi/app-async.ini.example (copy it next to app.ini to enable it) or standalone: python -m configs.wsgi_async
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "configs.settings")
+
+application = get_wsgi_application()
+
+
+if __name__ == "__main__":
+    from gevent.pywsgi import WSGIServer
+
+    WSGIServer(('127.0.0.1', 9011), application).serve_forever()
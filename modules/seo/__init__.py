@@ -0,0 +1 @@
+default_app_config = 'modules.seo.apps.SeoConfig'
@@ -0,0 +1,18 @@
+#coding:utf-8
+from django.apps import AppConfig
+
+
+class SeoConfig(AppConfig):
+    name = 'modules.seo'
+    label = 'seo'
+
+    def ready(self):
+        from django.core.checks import register
+        from django.db.models.signals import post_delete, post_save
+
+        from .cache import check_seo_cache, invalidate_seo_data
+        from .models import SeoData
+
+        register(check_seo_cache, deploy=True)
+        post_save.connect(invalidate_seo_data, sender=SeoData, dispatch_uid='seo_data_saved')
+        post_delete.connect(invalidate_seo_data, sender=SeoData, dispatch_uid='seo_data_deleted')
@@ -0,0 +1,106 @@
+#coding:utf-8
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core import checks
+
+from .models import SeoData
+
+VERSION_KEY = 'seo:version'
+
+
+def _get_cache():
+    return caches[getattr(settings, 'SEO_CACHE_ALIAS', 'default')]
+
+
+class SeoDataCache(object):
+    """
+    Per-process copy of the whole SeoData table keyed by url.
+    Paths missing in the copy are unknown, so negative lookups are free too.
+    Edits bump a version key in the shared cache, every process checks it at most once
+    per settings.SEO_CACHE_CHECK_INTERVAL seconds and reloads the table when it changes.
+    Other processes only see the version if settings.SEO_CACHE_ALIAS is shared by them, like memcached,
+    see check_seo_cache.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _get_version(self):
+        cache = _get_cache()
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, int(time.time()), None)
+            version = cache.get(VERSION_KEY)
+        return version
+
+    def _load(self):
+        return dict((seo.url, seo) for seo in SeoData.objects.all())
+
+    def get(self, path):
+        """
+        Returns SeoData of the path or None.
+        """
+        now = time.time()
+        interval = getattr(settings, 'SEO_CACHE_CHECK_INTERVAL', 5)
+        # the copy is read once, clear() could reset it meanwhile
+        data = self._data
+        if data is None or now - self._checked_at > interval:
+            with self._lock:
+                data = self._data
+                if data is None or now - self._checked_at > interval:
+                    # version is read before the table, so an edit made during the load causes one more reload
+                    version = self._get_version()
+                    if data is None or version != self._version:
+                        data = self._data = self._load()
+                        self._version = version
+                    self._checked_at = now
+        return data.get(path)
+
+    def clear(self):
+        with self._lock:
+            self._data = None
+
+
+seo_data = SeoDataCache()
+
+
+def get_seo_data(path):
+    """
+    Returns SeoData of the path from per-process cache or None.
+    """
+    return seo_data.get(path)
+
+
+def invalidate_seo_data(**kwargs):
+    """
+    Signal receiver which makes all processes reload SeoData.
+    """
+    cache = _get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time()), None)
+    seo_data.clear()
+
+
+def check_seo_cache(app_configs, **kwargs):
+    """
+    Deployment check (manage.py check --deploy) which warns that edits of SeoData are not seen
+    by other processes with a local memory cache.
+    """
+    if isinstance(_get_cache(), LocMemCache):
+        return [checks.Warning(
+            'SEO_CACHE_ALIAS is a local memory cache, other processes will not reload SeoData after edits.',
+            hint='Use a cache shared by all processes, like memcached.',
+            id='seo.W001',
+        )]
+    return []
@@ -1,29 +1,108 @@
 #coding:utf-8
 from __future__ import unicode_literals
 import re
-# from django.http import HttpResponseRedirect
-# from ..views import logout_view
 
-# Set up a rendered TemplateResponse
-# from django.template.response import TemplateResponse
-from .models import SeoData
+from .cache import get_seo_data
 
 
-# array(
-#     '/<h1>(.*)<\/h1>/i',
-#     '/<title>(.*)<\/title>/i',
-#     '/<meta name="description" content="(.*)"\/>/i'
-#     ),
+# all tags which can be rewritten and the end of the head are found by one regex in a single pass
+TAGS_REGEX = re.compile(
+    br"(?P<title><title>.*?</title>)"
+    br"|(?P<description><meta\s+name=\"description\"\s+content=\"[^\"]*\"\s*/?>)"
+    br"|(?P<h1><h1(?P<h1_attrs>(?:\s[^>]*)?)>.*?</h1>)"
+    br"|(?P<head_end></head>)",
+    re.I | re.S)
+# start of an element which is not closed yet in the current chunk
+OPEN_REGEX = re.compile(br"<(?:title|h1)\b", re.I)
+# unfinished element longer than this is passed through without rewriting
+MAX_HOLD = 64 * 1024
 
 
-H1_REGEX = re.compile(r"<h1([^>]*)>(.*?)</h1>", re.I | re.U)
-TITLE_REGEX = re.compile(r"<title>(.*?)</title>", re.I | re.U)
-DESCRIPTION_REGEX = re.compile(r"""<meta name="description" content="(.*)"/>""", re.I | re.U)
+class SeoRewriter(object):
+    """
+    Single-pass rewriter of title, meta description and the first h1 of an HTML body.
+    Works on chunks of bytes, keeps only a possibly unfinished tag between chunks and
+    stops scanning once the head is closed and the first h1 is rewritten.
+    """
+
+    def __init__(self, seo, charset='utf-8'):
+        self.pending = {}
+        if seo.title_tag:
+            self.pending['title'] = "<title>%s</title>" % seo.title_tag
+        if seo.meta_description:
+            self.pending['description'] = """<meta name="description" content="%s"/>""" % seo.meta_description
+        if seo.page_h1:
+            self.pending['h1'] = seo.page_h1
+        self.charset = charset
+        self.head_closed = False
+        self._buffer = b""
+
+    @property
+    def done(self):
+        return "h1" not in self.pending and (self.head_closed or not self.pending)
+
+    def _replace(self, match):
+        kind = match.lastgroup
+        if kind == "head_end":
+            self.head_closed = True
+        elif kind in self.pending and (kind == "h1" or not self.head_closed):
+            value = self.pending.pop(kind)
+            if kind == "h1":
+                value = "<h1%s>%s</h1>" % (match.group("h1_attrs").decode(self.charset), value)
+            return value.encode(self.charset)
+        return match.group(0)
+
+    def feed(self, chunk):
+        """
+        Returns rewritten part of the body which is safe to send.
+        """
+        if self.done:
+            return chunk
+        data = self._buffer + chunk
+        parts = []
+        position = 0
+        for match in TAGS_REGEX.finditer(data):
+            parts.append(data[position:match.start()])
+            parts.append(self._replace(match))
+            position = match.end()
+            if self.done:
+                parts.append(data[position:])
+                self._buffer = b""
+                return b"".join(parts)
+
+        opener = OPEN_REGEX.search(data, position)
+        hold = opener.start() if opener else data.rfind(b"<", position)
+        if hold == -1 or len(data) - hold > MAX_HOLD:
+            hold = len(data)
+        parts.append(data[position:hold])
+        self._buffer = data[hold:]
+        return b"".join(parts)
+
+    def flush(self):
+        """
+        Returns the rest of the body.
+        """
+        data, self._buffer = self._buffer, b""
+        return data
+
+    def rewrite(self, chunks):
+        for chunk in chunks:
+            data = self.feed(chunk)
+            if data:
+                yield data
+        data = self.flush()
+        if data:
+            yield data
+
+
+def is_html_response(response):
+    content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+    return content_type == "text/html" and not response.has_header("Content-Encoding")
+
 
-#     '/<meta name="description" content="(.*)"\/>/i'
-# a.sub("<h1>ffd</h1>", "<h1>fggsaaaaa</h1>dsadsa</h1>")
 class SeoMiddleware(object):
     """
+    Rewrites title, meta description and h1 of HTML pages with SeoData of the page url.
     """
 
     def __init__(self, get_response):
@@ -32,19 +111,22 @@ class SeoMiddleware(object):
     def __call__(self, request):
 
         response = self.get_response(request)
+        if not is_html_response(response):
+            return response
 
-        try:
-            seo = SeoData.objects.get(url=request.path)
-        except SeoData.DoesNotExist:
-            pass
-        else:
-            res = unicode(response.content.decode("utf-8"))
-            if seo.page_h1:
-                res = H1_REGEX.sub(ur"<h1\1>%s</h1>" % seo.page_h1, res)
-            if seo.title_tag:
-                res = TITLE_REGEX.sub(ur"<title>%s</title>" % seo.title_tag, res)
-            if seo.meta_description:
-                res = DESCRIPTION_REGEX.sub(ur"""<meta name="description" content="%s"/>""" % seo.meta_description, res)
-            response.content = res
+        seo = get_seo_data(request.path)
+        if seo is None:
+            return response
 
+        rewriter = SeoRewriter(seo, response.charset)
+        if rewriter.done:
+            return response
+        if response.streaming:
+            response.streaming_content = rewriter.rewrite(response.streaming_content)
+            if response.has_header("Content-Length"):
+                del response["Content-Length"]
+        else:
+            response.content = rewriter.feed(response.content) + rewriter.flush()
+            if response.has_header("Content-Length"):
+                response["Content-Length"] = str(len(response.content))
         return response
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seo', '0002_auto_20151205_1800'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='seodata',
+            name='url',
+            field=models.CharField(max_length=255, verbose_name='Page url', db_index=True),
+        ),
+    ]
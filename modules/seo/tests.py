@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+import sys
+import threading
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from .cache import SeoDataCache, VERSION_KEY
+
+
+class FakeSeoDataCache(SeoDataCache):
+
+    def __init__(self):
+        super(FakeSeoDataCache, self).__init__()
+        self.loads = 0
+
+    def _load(self):
+        self.loads += 1
+        return {'/': 'home'}
+
+
+class SeoDataCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reloads_after_version_change(self):
+        seo_data = FakeSeoDataCache()
+        with self.settings(SEO_CACHE_CHECK_INTERVAL=0):
+            self.assertEqual(seo_data.get('/'), 'home')
+            self.assertIsNone(seo_data.get('/missing/'))
+            self.assertEqual(seo_data.loads, 1)
+            cache.incr(VERSION_KEY)
+            seo_data.get('/')
+        self.assertEqual(seo_data.loads, 2)
+
+    def test_clear_during_get(self):
+        seo_data = FakeSeoDataCache()
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    seo_data.get('/')
+            except Exception as error:
+                errors.append(error)
+
+        # switch threads as often as possible
+        self.addCleanup(sys.setcheckinterval, sys.getcheckinterval())
+        sys.setcheckinterval(1)
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(10000):
+            seo_data.clear()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
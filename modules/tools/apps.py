@@ -4,4 +4,12 @@ from django.apps import AppConfig
 
 
 class ToolsConfig(AppConfig):
-    name = 'tools'
+    name = 'modules.tools'
+    label = 'tools'
+
+    def ready(self):
+        from django.core.checks import register
+
+        from .utilities.jobs import check_jobs_cache
+
+        register(check_jobs_cache, deploy=True)
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+import math
+import time
+from multiprocessing.pool import ThreadPool
+
+
+def percentile(values, fraction):
+    """
+    Returns percentile of sorted values by the nearest-rank method.
+    :param values: sorted values
+    :type values: list
+    :param fraction: percentile as a fraction, like 0.99
+    :type fraction: float
+    :return: value or None for empty values
+    :rtype: float or None
+    """
+    if not values:
+        return None
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+def summarize(durations, errors, elapsed):
+    """
+    Returns throughput and latency distribution of measured calls.
+    :param durations: durations of calls in seconds
+    :type durations: list
+    :param errors: count of failed calls
+    :type errors: int
+    :param elapsed: wall time of all calls in seconds
+    :type elapsed: float
+    :return: dict with count, errors, throughput per second and mean, p50, p90, p99 and max latency in milliseconds
+    :rtype: dict
+    """
+    durations = sorted(durations)
+    milliseconds = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'count': len(durations),
+        'errors': errors,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(durations) / elapsed, 1) if elapsed else None,
+        'mean': milliseconds(sum(durations) / len(durations) if durations else None),
+        'p50': milliseconds(percentile(durations, 0.5)),
+        'p90': milliseconds(percentile(durations, 0.9)),
+        'p99': milliseconds(percentile(durations, 0.99)),
+        'max': milliseconds(durations[-1] if durations else None),
+    }
+
+
+def measure(func, items, concurrency=1):
+    """
+    Calls func for every item from the given count of threads and measures every call.
+    :param func: measured callable, exceptions are counted as errors
+    :type func: callable
+    :param items: arguments of calls
+    :type items: list
+    :param concurrency: count of concurrent callers
+    :type concurrency: int
+    :return: summary, see summarize
+    :rtype: dict
+    """
+    def call(item):
+        start = time.time()
+        try:
+            func(item)
+        except Exception:
+            return time.time() - start, True
+        return time.time() - start, False
+
+    pool = ThreadPool(concurrency)
+    try:
+        start = time.time()
+        results = pool.map(call, items, chunksize=1)
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    return summarize([duration for duration, _ in results], sum(1 for _, failed in results if failed), elapsed)
@@ -0,0 +1,297 @@
+from __future__ import unicode_literals
+
+import Cookie
+import io
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from multiprocessing.pool import ThreadPool
+from urllib import urlencode
+from urlparse import urlsplit
+
+from django.db import connections
+from django.urls import Resolver404, resolve
+from django.utils.encoding import force_bytes
+
+from . import percentile, summarize
+
+logger = logging.getLogger(__name__)
+
+class Response(object):
+
+    def __init__(self, status, headers, content):
+        self.status_code = int(status.split(' ', 1)[0])
+        self.headers = headers
+        self.content = content
+
+    def get_all(self, name):
+        return [value for key, value in self.headers if key.lower() == name.lower()]
+
+    def get(self, name, default=None):
+        values = self.get_all(name)
+        return values[0] if values else default
+
+
+class User(object):
+    """
+    Simulated visitor with its own address and cookies, requests of one visitor are sent one at a time.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.cookies = OrderedDict()
+        self.lock = threading.Lock()
+
+    def update_cookies(self, response):
+        for header in response.get_all('Set-Cookie'):
+            cookie = Cookie.SimpleCookie()
+            cookie.load(str(header))
+            for name, morsel in cookie.items():
+                self.cookies[name] = morsel.value
+
+
+class WSGIClient(object):
+    """
+    Calls a WSGI application in the current thread like a front-end server would do and reads the whole body,
+    streaming responses included.
+    """
+
+    def __init__(self, application, host='localhost'):
+        self.application = application
+        self.host = host
+
+    def request(self, user, method, path, data=None, body=None, content_type=None, headers=None):
+        """
+        Sends one request of the user.
+        :param user: simulated visitor
+        :type user: User
+        :param method: HTTP method
+        :type method: str
+        :param path: path with optional query string
+        :type path: str
+        :param data: form fields, urlencoded into the body
+        :type data: dict
+        :param body: raw body
+        :type body: bytes
+        :param content_type: content type of the body
+        :type content_type: str
+        :param headers: extra headers
+        :type headers: dict
+        :return: response
+        :rtype: Response
+        """
+        url = urlsplit(path)
+        if data is not None:
+            body = urlencode(dict((force_bytes(key), force_bytes(value)) for key, value in data.items()))
+            content_type = 'application/x-www-form-urlencoded'
+        body = force_bytes(body or b'')
+        environ = {
+            'REQUEST_METHOD': method.upper(),
+            'SCRIPT_NAME': str(''),
+            'PATH_INFO': str(url.path),
+            'QUERY_STRING': str(url.query),
+            'SERVER_NAME': str(self.host),
+            'SERVER_PORT': str('80'),
+            'SERVER_PROTOCOL': str('HTTP/1.1'),
+            'REMOTE_ADDR': str(user.address),
+            'HTTP_HOST': str(self.host),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': str('http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if content_type:
+            environ['CONTENT_TYPE'] = str(content_type)
+        if user.cookies:
+            environ['HTTP_COOKIE'] = str('; '.join('%s=%s' % item for item in user.cookies.items()))
+        for name, value in (headers or {}).items():
+            environ[str('HTTP_' + name.upper().replace('-', '_'))] = str(value)
+
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = response_headers
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        response = Response(started['status'], started['headers'], content)
+        user.update_cookies(response)
+        return response
+
+
+def load_traffic(path):
+    """
+    Reads recorded traffic, one JSON object per line with method (GET by default), path and optional data
+    (form fields), json (JSON body) and headers.
+    :param path: path to JSONL file
+    :type path: str
+    :return: list of requests
+    :rtype: list
+    """
+    entries = []
+    with io.open(path, encoding='utf-8') as traffic:
+        for number, line in enumerate(traffic, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line)
+            if 'path' not in entry:
+                raise ValueError('Line %d has no path' % number)
+            entries.append(entry)
+    return entries
+
+
+def get_route(path):
+    """
+    Returns name of the url pattern which handles the path.
+    """
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return 'not-found'
+    return match.url_name or match.view_name
+
+
+def get_upstream_time(response):
+    """
+    Returns seconds spent in upstream calls according to Server-Timing header of the response.
+    """
+    total = 0.0
+    for entry in (response.get('Server-Timing') or '').split(','):
+        name, _, parameters = entry.strip().partition(';')
+        if name and name != 'app' and parameters.startswith('dur='):
+            total += float(parameters[4:]) / 1000
+    return total
+
+
+class LoadGenerator(object):
+    """
+    Replays recorded traffic through a WSGI application from concurrent threads and collects latency
+    of every url pattern. Visitors fetch the form page before their first POST to get a CSRF token.
+    Connections passed as shared_connections are used by all threads, like in LiveServerTestCase,
+    in-memory SQLite databases are not visible to other connections.
+    Requests which raise are counted with 'exception' status, the first exception of every url pattern is logged.
+    """
+
+    def __init__(self, application, entries, users=100, host='localhost', replacements=None,
+                 shared_connections=None):
+        self.client = WSGIClient(application, host)
+        self.entries = entries
+        self.users = [User('10.%d.%d.%d' % (index >> 16 & 255, index >> 8 & 255, index & 255 or 1))
+                      for index in range(1, users + 1)]
+        self.replacements = replacements or {}
+        self.shared_connections = shared_connections or {}
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)
+        self._upstream = defaultdict(list)
+        self._statuses = defaultdict(lambda: defaultdict(int))
+        self._failed_routes = set()
+
+    def _prepare(self, value):
+        if isinstance(value, dict):
+            return dict((key, self._prepare(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [self._prepare(item) for item in value]
+        if isinstance(value, basestring):
+            for placeholder, replacement in self.replacements.items():
+                value = value.replace(placeholder, replacement)
+        return value
+
+    def _send(self, user, entry):
+        method = entry.get('method', 'GET').upper()
+        path = self._prepare(entry['path'])
+        data = self._prepare(entry.get('data'))
+        body = json.dumps(self._prepare(entry['json'])) if 'json' in entry else None
+        headers = self._prepare(entry.get('headers') or {})
+        if method == 'POST' and 'json' not in entry:
+            if 'csrftoken' not in user.cookies:
+                self.client.request(user, 'GET', path)
+            data = dict(data or {}, csrfmiddlewaretoken=user.cookies.get('csrftoken', ''))
+        start = time.time()
+        response = self.client.request(user, method, path, data=data, body=body,
+                                       content_type='application/json' if body is not None else None,
+                                       headers=headers)
+        return time.time() - start, response
+
+    def _share_connections(self):
+        for alias, connection in self.shared_connections.items():
+            connections[alias] = connection
+
+    def _run(self, index):
+        entry = self.entries[index % len(self.entries)]
+        user = self.users[index % len(self.users)]
+        route = get_route(self._prepare(entry['path']))
+        with user.lock:
+            try:
+                duration, response = self._send(user, entry)
+            except Exception:
+                status, duration, upstream = 'exception', None, None
+                with self._lock:
+                    first = route not in self._failed_routes
+                    self._failed_routes.add(route)
+                if first:
+                    logger.exception('Request to %s (%s) raised, further exceptions of the route are only counted',
+                                     route, entry['path'])
+            else:
+                status, upstream = '%dxx' % (response.status_code // 100), get_upstream_time(response)
+        with self._lock:
+            self._statuses[route][status] += 1
+            if duration is not None:
+                self._durations[route].append(duration)
+                self._upstream[route].append(upstream)
+
+    def run(self, count, concurrency=8):
+        """
+        Sends count requests, entries are replayed in order and repeated as needed.
+        :param count: count of requests
+        :type count: int
+        :param concurrency: count of concurrent requests
+        :type concurrency: int
+        :return: summary for every url pattern and 'total', see benchmark.summarize, with statuses
+            and p50 of upstream time in milliseconds. Url patterns are replayed together, so throughput of
+            a pattern is its share of the total throughput, its requests divided by the time of the whole run
+        :rtype: OrderedDict
+        """
+        for connection in self.shared_connections.values():
+            connection.allow_thread_sharing = True
+        pool = ThreadPool(concurrency, self._share_connections)
+        try:
+            start = time.time()
+            for _ in pool.imap_unordered(self._run, range(count)):
+                pass
+            elapsed = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+
+        results = OrderedDict()
+        routes = sorted(self._statuses)
+        for route in routes + ['total']:
+            if route == 'total':
+                durations = [value for values in self._durations.values() for value in values]
+                upstream = [value for values in self._upstream.values() for value in values]
+                statuses = defaultdict(int)
+                for counts in self._statuses.values():
+                    for status, value in counts.items():
+                        statuses[status] += value
+            else:
+                durations, upstream, statuses = self._durations[route], self._upstream[route], self._statuses[route]
+            errors = sum(value for status, value in statuses.items() if status in ('5xx', 'exception'))
+            result = summarize(durations, errors, elapsed)
+            upstream_p50 = percentile(sorted(upstream), 0.5)
+            result['upstream_p50'] = round(upstream_p50 * 1000, 3) if upstream_p50 is not None else None
+            result['statuses'] = dict(statuses)
+            results[route] = result
+        return results
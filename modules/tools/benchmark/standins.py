@@ -0,0 +1,478 @@
+from __future__ import unicode_literals
+
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import dns.dnssec
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+import dns.rrset
+import ipaddress
+from dns.rdtypes.ANY.DNSKEY import DNSKEY
+from dns.rdtypes.ANY.RRSIG import RRSIG
+from Crypto.PublicKey import RSA
+from Crypto.Util.number import long_to_bytes
+from django.conf import settings
+from django.core.cache import caches
+from django.test.utils import override_settings
+from ipwhois.net import Net
+
+from ..utilities.dnsbl import BLACK_LISTS
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+TEST_ZONE = dns.name.from_text('test.')
+BENCH_ZONE = dns.name.from_text('bench.test.')
+# names of bench.test. which are hosts, all other labels are delegated signed zones
+HOSTS = ('ns', 'mx')
+MX_RECORDS = {dns.rdatatype.A: ['192.0.2.25'], dns.rdatatype.AAAA: ['2001:db8::25']}
+CYMRU_ZONE = dns.name.from_text('origin.asn.cymru.com.')
+# nested zones like dul.dnsbl.sorbs.net go before their parents
+BLACK_LIST_ZONES = sorted((dns.name.from_text(zone) for zone in BLACK_LISTS), key=len, reverse=True)
+# address listed by every black list, like 127.0.0.2 test entries of real DNSBLs
+LISTED_ADDRESS = '127.0.0.2'
+TTL = 300
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as fixture:
+        return fixture.read()
+
+
+def _make_key():
+    private = RSA.generate(1024)
+    exponent = long_to_bytes(private.e)
+    public = DNSKEY(dns.rdataclass.IN, dns.rdatatype.DNSKEY, 257, 3, dns.dnssec.RSASHA256,
+                    struct.pack('!B', len(exponent)) + exponent + long_to_bytes(private.n))
+    return private, public
+
+
+def _make_rrsig(rrset, signer, public, signature):
+    now = int(time.time())
+    return RRSIG(dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype, dns.dnssec.RSASHA256, len(rrset.name) - 1,
+                 rrset.ttl, now + 24 * 60 * 60, now - 60 * 60, dns.dnssec.key_id(public), signer, signature)
+
+
+def _sign(rrset, signer, private, public):
+    """
+    Returns RRSIG rrset of rrset signed with RSASHA256 key, see RFC 4034 section 3.1.8.1.
+    """
+    unsigned = _make_rrsig(rrset, signer, public, b'')
+    digest = hashlib.sha256(dns.dnssec._to_rdata(unsigned, None)[:18] + signer.to_digestable())
+    fixed = struct.pack('!HHI', rrset.rdtype, rrset.rdclass, rrset.ttl)
+    for rdata in sorted(rrset):
+        wire = rdata.to_digestable()
+        digest.update(rrset.name.to_digestable() + fixed + struct.pack('!H', len(wire)) + wire)
+
+    # PKCS #1 v1.5 padding of the DigestInfo
+    info = dns.dnssec._make_algorithm_id(dns.dnssec.RSASHA256) + digest.digest()
+    size = len(long_to_bytes(private.n))
+    padded = b'\x00\x01' + b'\xff' * (size - len(info) - 3) + b'\x00' + info
+    signature = long_to_bytes(private.sign(padded, b'')[0], size)
+    rrsigs = dns.rrset.RRset(rrset.name, dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype)
+    rrsigs.update_ttl(rrset.ttl)
+    rrsigs.add(_make_rrsig(rrset, signer, public, signature))
+    return rrsigs
+
+
+class FakeDNSServer(object):
+    """
+    Authoritative and recursive stand-in DNS server on the loopback interface, answers over UDP and TCP
+    on one port.
+    Serves the signed tree . > test. > bench.test. > <label>.bench.test., where every label except
+    ns and mx is a signed zone with A, AAAA, MX, NS and TXT records, so any count of distinct targets
+    can be resolved and validated. Answers DNSBL queries (only 127.0.0.2 is listed) and Team Cymru
+    origin queries used by ipwhois.
+    """
+
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.port = None
+        self.queries = 0
+        self._keys = {}
+        self._signatures = {}
+        self._lock = threading.Lock()
+        self._sockets = []
+
+    def start(self):
+        """
+        Generates zone keys and starts serving in daemon threads.
+        :return: address and port
+        :rtype: tuple
+        """
+        for zone in (dns.name.root, TEST_ZONE, BENCH_ZONE, None):
+            self._keys[zone] = _make_key()
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind((self.host, 0))
+        self.port = udp.getsockname()[1]
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp.bind((self.host, self.port))
+        tcp.listen(128)
+        self._sockets = [udp, tcp]
+        for target, args in ((self._serve_udp, (udp,)), (self._serve_tcp, (tcp,))):
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+        return self.host, self.port
+
+    def stop(self):
+        for sock in self._sockets:
+            sock.close()
+
+    @property
+    def trust_anchors(self):
+        """
+        DS records of the root key in the format of settings.DNSSEC_TRUST_ANCHORS.
+        """
+        return [dns.dnssec.make_ds(dns.name.root, self._keys[dns.name.root][1], 'SHA256').to_text()]
+
+    def _serve_udp(self, sock):
+        while True:
+            try:
+                wire, address = sock.recvfrom(65535)
+                sock.sendto(self.answer(wire, tcp=False), address)
+            except socket.error:
+                return
+            except Exception:
+                continue
+
+    def _serve_tcp(self, sock):
+        while True:
+            try:
+                connection, _ = sock.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self._serve_connection, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_connection(self, connection):
+        stream = connection.makefile('rb')
+        try:
+            while True:
+                header = stream.read(2)
+                if len(header) < 2:
+                    break
+                wire = self.answer(stream.read(struct.unpack('!H', header)[0]), tcp=True)
+                connection.sendall(struct.pack('!H', len(wire)) + wire)
+        except socket.error:
+            pass
+        finally:
+            stream.close()
+            connection.close()
+
+    def _get_zone(self, name):
+        if not name.is_subdomain(TEST_ZONE):
+            return dns.name.root
+        if not name.is_subdomain(BENCH_ZONE):
+            return TEST_ZONE
+        labels = name.relativize(BENCH_ZONE).labels
+        if not labels or labels[-1].lower() in HOSTS:
+            return BENCH_ZONE
+        return dns.name.Name(labels[-1:]).derelativize(BENCH_ZONE)
+
+    def _get_key(self, zone):
+        return self._keys.get(zone) or self._keys[None]
+
+    def _get_records(self, name):
+        """
+        Returns dict with lists of rdata of every type of the name or None if the name does not exist.
+        """
+        if name.is_subdomain(CYMRU_ZONE):
+            labels = name.relativize(CYMRU_ZONE).labels
+            network = ipaddress.ip_network('%s/24' % '.'.join(reversed(labels)), strict=False)
+            return {dns.rdatatype.TXT: ['"15133 | %s | US | arin | 2008-06-02"' % network]}
+        for zone in BLACK_LIST_ZONES:
+            if name.is_subdomain(zone) and name != zone:
+                if '.'.join(reversed(name.relativize(zone).labels)) == LISTED_ADDRESS:
+                    return {dns.rdatatype.A: ['127.0.0.2'], dns.rdatatype.TXT: ['"Listed for benchmarks"']}
+                return None
+
+        zone = self._get_zone(name)
+        if name != zone:
+            labels = name.relativize(BENCH_ZONE).labels if name.is_subdomain(BENCH_ZONE) else ()
+            if labels == ('ns',):
+                return {dns.rdatatype.A: [self.host]}
+            if labels == ('mx',):
+                return MX_RECORDS
+            return None
+        records = {
+            dns.rdatatype.NS: ['ns.bench.test.'],
+            dns.rdatatype.SOA: ['ns.bench.test. hostmaster.bench.test. 1 7200 3600 1209600 300'],
+            dns.rdatatype.DNSKEY: [self._get_key(zone)[1]],
+        }
+        if zone != dns.name.root:
+            records[dns.rdatatype.DS] = [dns.dnssec.make_ds(zone, self._get_key(zone)[1], 'SHA256')]
+        if zone.is_subdomain(BENCH_ZONE):
+            records[dns.rdatatype.A] = ['192.0.2.%d' % (hash(zone) % 254 + 1)]
+            records[dns.rdatatype.AAAA] = ['2001:db8::%x' % (hash(zone) % 65535 + 1)]
+            records[dns.rdatatype.MX] = ['10 mx.bench.test.']
+            records[dns.rdatatype.TXT] = ['"v=spf1 mx -all"']
+        return records
+
+    def _make_rrset(self, name, rdtype, rdatas):
+        rrset = dns.rrset.RRset(name, dns.rdataclass.IN, rdtype)
+        rrset.update_ttl(TTL)
+        for rdata in rdatas:
+            rrset.add(rdata if isinstance(rdata, dns.rdata.Rdata) else
+                      dns.rdata.from_text(dns.rdataclass.IN, rdtype, rdata))
+        return rrset
+
+    def _get_signature(self, rrset, zone):
+        key = (rrset.name, rrset.rdtype)
+        signature = self._signatures.get(key)
+        if signature is None:
+            signature = _sign(rrset, zone, *self._get_key(zone))
+            with self._lock:
+                self._signatures[key] = signature
+        return signature
+
+    def answer(self, wire, tcp=False):
+        """
+        Returns wire response for the wire request, UDP responses longer than the requested payload are truncated.
+        """
+        request = dns.message.from_wire(wire)
+        response = dns.message.make_response(request)
+        response.flags |= dns.flags.AA
+        self.queries += 1
+        question = request.question[0]
+        name = question.name
+        records = self._get_records(name)
+        zone = self._get_zone(name)
+        if records is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif question.rdtype in records:
+            rrset = self._make_rrset(name, question.rdtype, records[question.rdtype])
+            response.answer.append(rrset)
+            if request.ednsflags & dns.flags.DO and question.rdtype in (dns.rdatatype.DNSKEY, dns.rdatatype.DS):
+                # DS records are signed by the parent zone
+                signer = zone.parent() if question.rdtype == dns.rdatatype.DS else zone
+                response.answer.append(self._get_signature(rrset, signer))
+        if not response.answer:
+            soa = self._get_records(zone)[dns.rdatatype.SOA]
+            response.authority.append(self._make_rrset(zone, dns.rdatatype.SOA, soa))
+
+        wire = response.to_wire()
+        if not tcp and len(wire) > (request.payload if request.edns >= 0 else 512):
+            response.answer = []
+            response.authority = []
+            response.flags |= dns.flags.TC
+            wire = response.to_wire()
+        return wire
+
+
+class _HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the response is sent in one packet, otherwise delayed ACKs add tens of milliseconds to every request
+    wbufsize = -1
+
+    def _respond(self, body):
+        if not self.path.startswith('/final'):
+            self.send_response(301)
+            self.send_header('Location', '/final')
+            body = b''
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Cache-Control', 'max-age=60')
+            self.send_header('Strict-Transport-Security', 'max-age=31536000')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self._respond(b'')
+
+    def do_GET(self):
+        self.wfile.write(self._respond(b'<html><body>ok</body></html>'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingMixIn(SocketServer.ThreadingMixIn):
+    """
+    Handles every connection in a thread, open connections are closed on stop,
+    so handler threads do not outlive the server.
+    """
+    request_queue_size = 128
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self.connections.discard(request)
+        SocketServer.TCPServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def handle_error(self, request, client_address):
+        # clients of benchmarks drop keep-alive connections at any time
+        pass
+
+
+class _ThreadingHTTPServer(_ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    pass
+
+
+class _WhoisHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        query = self.rfile.readline(1024)
+        match = re.search(br'(\d{1,3}(?:\.\d{1,3}){3})', query)
+        if match is None:
+            return
+        network = ipaddress.ip_network('%s/24' % match.group(1).decode('ascii'), strict=False)
+        # the recorded answer is moved to the network of the queried address
+        fixture = re.sub(br'(?m)^(NetRange:\s+).*$', ('\\g<1>%s - %s' % (network[0], network[-1])).encode('ascii'),
+                         self.server.fixture)
+        fixture = re.sub(br'(?m)^(CIDR:\s+).*$', ('\\g<1>%s' % network).encode('ascii'), fixture)
+        self.wfile.write(fixture)
+
+
+class _ThreadingTCPServer(_ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+
+
+class _Server(object):
+
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.port = None
+        self._server = None
+
+    def _create(self):
+        raise NotImplementedError()
+
+    def start(self):
+        """
+        Starts serving in a daemon thread.
+        :return: address and port
+        :rtype: tuple
+        """
+        self._server = self._create()
+        self._server.lock = threading.Lock()
+        self._server.connections = set()
+        self.port = self._server.server_address[1]
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.host, self.port
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._server.close_connections()
+
+
+class LocalHTTPServer(_Server):
+    """
+    Keep-alive HTTP server on the loopback interface, every path redirects to /final which answers 200.
+    """
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % (self.host, self.port)
+
+    def _create(self):
+        return _ThreadingHTTPServer((self.host, 0), _HTTPHandler)
+
+
+class WhoisFixtureServer(_Server):
+    """
+    WHOIS (port 43 protocol) server on the loopback interface which replays a recorded ARIN answer
+    for the /24 network of every queried address.
+    """
+
+    def __init__(self, host='127.0.0.1', fixture='whois-arin.txt'):
+        super(WhoisFixtureServer, self).__init__(host)
+        self.fixture = read_fixture(fixture)
+
+    def _create(self):
+        server = _ThreadingTCPServer((self.host, 0), _WhoisHandler)
+        server.fixture = self.fixture
+        return server
+
+
+@contextmanager
+def _redirect_ipwhois(dns_address, whois_address):
+    """
+    Points ASN lookups and WHOIS queries of ipwhois, which have fixed servers, to the stand-ins.
+    """
+    init = Net.__init__
+    get_whois = Net.get_whois
+
+    def patched_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        self.dns_resolver.nameservers = [dns_address[0]]
+        self.dns_resolver.port = dns_address[1]
+
+    def patched_get_whois(self, asn_registry='arin', retry_count=3, server=None, port=43, extra_blacklist=None):
+        return get_whois(self, asn_registry, retry_count, whois_address[0], whois_address[1], extra_blacklist)
+
+    Net.__init__ = patched_init
+    Net.get_whois = patched_get_whois
+    try:
+        yield
+    finally:
+        Net.__init__ = init
+        Net.get_whois = get_whois
+
+
+@contextmanager
+def use_standins(dns_server, whois_server):
+    """
+    Routes DNS resolution, DNSSEC validation, pipelined queries and WHOIS lookups of the tools to the stand-ins.
+    Every configured cache is replaced with an empty local memory cache, so results of the stand-ins never get
+    into real caches and earlier entries of real caches are not used.
+    :param dns_server: started DNS stand-in
+    :type dns_server: FakeDNSServer
+    :param whois_server: started WHOIS stand-in
+    :type whois_server: WhoisFixtureServer
+    """
+    resolver = dns.resolver.get_default_resolver()
+    nameservers, port = resolver.nameservers, resolver.port
+    resolver.nameservers, resolver.port = [dns_server.host], dns_server.port
+    standin_caches = dict((alias, {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                   'LOCATION': 'standins-%s' % alias})
+                          for alias in settings.CACHES)
+    try:
+        with override_settings(DNS_PIPELINE_RESOLVER=dns_server.host, DNS_PIPELINE_PORT=dns_server.port,
+                               DNS_PIPELINE_TRANSPORT='udp', DNSSEC_QUERY_PORT=dns_server.port,
+                               DNSSEC_TRUST_ANCHORS=dns_server.trust_anchors, CACHES=standin_caches), \
+                _redirect_ipwhois((dns_server.host, dns_server.port), (whois_server.host, whois_server.port)):
+            for alias in standin_caches:
+                caches[alias].clear()
+            try:
+                yield
+            finally:
+                for alias in standin_caches:
+                    caches[alias].clear()
+    finally:
+        resolver.nameservers, resolver.port = nameservers, port
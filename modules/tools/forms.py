@@ -1,13 +1,17 @@
 from __future__ import unicode_literals
 
+import ipaddress
 from django import forms
+from django.conf import settings
 from django.core.validators import validate_ipv46_address
+from django.utils.encoding import force_text
 
 from .validators import validate_domain
 
 
 class HeadersForm(forms.Form):
     headers = forms.CharField(widget=forms.Textarea())
+    enrich = forms.BooleanField(required=False, help_text='Look up location and black lists of hop addresses')
 
 
 class DomainForm(forms.Form):
@@ -39,3 +43,49 @@ class IPorDomainForm(forms.Form):
         if not any([ipv46, domain]):
             raise forms.ValidationError('Invalid domain name or IP4/IP6')
         return ip_or_domain
+
+
+class CIDRForm(forms.Form):
+    cidr = forms.CharField(help_text='IPv4 or IPv6 network, like 192.0.2.0/24 or 2001:db8::/120')
+
+    def clean_cidr(self):
+        try:
+            network = ipaddress.ip_network(self.cleaned_data.get('cidr').strip(), strict=False)
+        except ValueError:
+            raise forms.ValidationError('Invalid network')
+        max_addresses = getattr(settings, 'PTR_SWEEP_MAX_ADDRESSES', 256)
+        if network.num_addresses > max_addresses:
+            raise forms.ValidationError('Network is too large, maximum is %d addresses' % max_addresses)
+        return network
+
+
+# forms which validate targets of the batch and job APIs like the tool views do, keys are the same as of TOOLS
+TOOL_FORMS = {
+    'email-headers': (HeadersForm, 'headers'),
+    'email-abuse-info': (DomainForm, 'domain'),
+    'mx-lookup': (DomainForm, 'domain'),
+    'dns-black-list': (IPForm, 'ip'),
+    'http-headers': (DomainForm, 'domain'),
+    'dns-sec': (DomainForm, 'domain'),
+    'ip-lookup': (IPForm, 'ip'),
+    'who-is': (IPorDomainForm, 'ip_or_domain'),
+    'ns-lookup': (DomainForm, 'domain'),
+    'dns-report': (IPorDomainForm, 'ip_or_domain'),
+}
+
+
+def clean_target(tool, target):
+    """
+    Validates target of the tool with the form of its view.
+    :param tool: tool name
+    :type tool: str
+    :param target: target entered by the user
+    :type target: str
+    :return: cleaned target and None or None and error message
+    :rtype: tuple
+    """
+    form_class, field = TOOL_FORMS[tool]
+    form = form_class({field: target})
+    if form.is_valid():
+        return form.cleaned_data[field], None
+    return None, force_text(form.errors[field][0])
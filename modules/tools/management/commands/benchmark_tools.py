@@ -0,0 +1,137 @@
+from __future__ import unicode_literals
+
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from modules.tools.benchmark import measure
+from modules.tools.benchmark.standins import (FakeDNSServer, LocalHTTPServer, WhoisFixtureServer, LISTED_ADDRESS,
+                                              read_fixture, use_standins)
+from modules.tools.utilities.utils import is_rate_limited
+from modules.tools.utils import (get_abuse_tool, get_dns_black_list_tool, get_dnssec_tool, get_http_headers,
+                                 get_mx_lookup_tool, get_ns_tool, parse_email_header)
+
+ROW_FORMAT = '{tool:<18} {mode:<5} {concurrency:>4} {count:>7} {errors:>6} {throughput:>9} {p50:>9} {p99:>9}'
+
+
+class EmptyResult(Exception):
+    pass
+
+
+def _checked(func):
+    # tools return None or False instead of raising, such calls are counted as errors
+    def call(target):
+        result = func(target)
+        if result is None or result is False or result == (False, {}):
+            raise EmptyResult(target)
+        return result
+    return call
+
+
+def _rate_limit(request):
+    return is_rate_limited(request, '1000000/h', increment=True)
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks tools against local stand-ins of DNS, HTTP and WHOIS servers and reports throughput '
+            'and p50/p99 latency for every concurrency level.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tools', default=','.join(self.get_benchmarks()),
+                            help='Comma separated benchmarks to run (default: all)')
+        parser.add_argument('--concurrency', default='1,8,32',
+                            help='Comma separated counts of concurrent callers (default: 1,8,32)')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Count of calls for every benchmark and concurrency level (default: 200)')
+        parser.add_argument('--cold', action='store_true',
+                            help='Use a distinct target for every call, so every lookup misses the caches')
+        parser.add_argument('--json', action='store_true',
+                            help='Print one JSON object per result instead of a table')
+
+    def get_benchmarks(self):
+        """
+        Returns tool functions by benchmark name.
+        """
+        return OrderedDict([
+            ('mx-lookup', _checked(get_mx_lookup_tool)),
+            ('ns-lookup', _checked(get_ns_tool)),
+            ('dns-sec', _checked(lambda target: get_dnssec_tool(target)[0] or None)),
+            ('dns-black-list', _checked(get_dns_black_list_tool)),
+            ('http-headers', _checked(get_http_headers)),
+            ('email-headers', _checked(parse_email_header)),
+            ('email-abuse-info', _checked(get_abuse_tool)),
+            ('rate-limit', _rate_limit),
+        ])
+
+    def get_target(self, name, index, cold):
+        """
+        Returns argument of the benchmark call, cold targets are unique within the run of the command.
+        """
+        index = self.sequence + index if cold else 0
+        if name in ('mx-lookup', 'ns-lookup', 'dns-sec'):
+            return 'host%d.bench.test' % index
+        if name == 'dns-black-list':
+            return '10.%d.%d.%d' % (index >> 16 & 255, index >> 8 & 255, index & 255) if cold else LISTED_ADDRESS
+        if name == 'http-headers':
+            # every path redirects to the final page
+            return '%s%d' % (self.http_server.url, index) if cold else self.http_server.url
+        if name == 'email-headers':
+            return self.email_headers
+        if name == 'email-abuse-info':
+            # every address is in a distinct /24 network, so WHOIS results are not shared
+            return '100.%d.%d.1' % (64 + (index >> 8 & 63), index & 255)
+        request = RequestFactory().get('/', REMOTE_ADDR='10.%d.%d.%d' % (
+            index >> 16 & 255, index >> 8 & 255, index & 255))
+        request.user = AnonymousUser()
+        return request
+
+    def write_result(self, result, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(result, sort_keys=True))
+        else:
+            self.stdout.write(ROW_FORMAT.format(**dict(
+                (key, '-' if value is None else value) for key, value in result.items())))
+
+    def handle(self, *args, **options):
+        benchmarks = self.get_benchmarks()
+        names = [name.strip() for name in options['tools'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in benchmarks]
+        if unknown:
+            raise CommandError('Unknown benchmarks: %s, available: %s' % (', '.join(unknown), ', '.join(benchmarks)))
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        count = options['requests']
+        mode = 'cold' if options['cold'] else 'warm'
+
+        dns_server = FakeDNSServer()
+        self.http_server = LocalHTTPServer()
+        whois_server = WhoisFixtureServer()
+        self.email_headers = read_fixture('email-headers.txt')
+        # the caches of the stand-ins are empty in every run, targets are only unique across concurrency levels
+        self.sequence = 0
+        for server in (dns_server, self.http_server, whois_server):
+            server.start()
+        try:
+            with use_standins(dns_server, whois_server):
+                if not options['json']:
+                    self.stdout.write('cache backend: %s' % settings.CACHES['default']['BACKEND'])
+                    self.stdout.write(ROW_FORMAT.format(tool='benchmark', mode='mode', concurrency='conc',
+                                                        count='calls', errors='errors', throughput='calls/s',
+                                                        p50='p50 ms', p99='p99 ms'))
+                for name in names:
+                    func = benchmarks[name]
+                    for concurrency in levels:
+                        targets = [self.get_target(name, index, options['cold']) for index in range(count)]
+                        if not options['cold']:
+                            # the first call fills caches and opens connections
+                            measure(func, targets[:1])
+                        result = measure(func, targets, concurrency)
+                        result.update(tool=name, mode=mode, concurrency=concurrency)
+                        self.write_result(result, options['json'])
+                        self.sequence += count
+        finally:
+            for server in (dns_server, self.http_server, whois_server):
+                server.stop()
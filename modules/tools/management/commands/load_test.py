@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+from modules.tools.benchmark.loadgen import LoadGenerator, load_traffic
+from modules.tools.benchmark.standins import (FIXTURES_DIR, FakeDNSServer, LocalHTTPServer, WhoisFixtureServer,
+                                              use_standins)
+
+ROW_FORMAT = '{route:<22} {count:>7} {errors:>6} {throughput:>8} {p50:>9} {p90:>9} {p99:>9} {upstream_p50:>9}  {statuses}'
+
+
+class Command(BaseCommand):
+    help = ('Replays recorded traffic through configs.wsgi.application with the whole middleware stack and '
+            'reports requests/s and latency for every url pattern. Upstream servers are replaced with local '
+            'stand-ins by default, time spent in them is taken from Server-Timing headers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--traffic', default=os.path.join(FIXTURES_DIR, 'traffic.jsonl'),
+                            help='JSONL file with recorded requests (default: benchmark/fixtures/traffic.jsonl)')
+        parser.add_argument('--requests', type=int, default=1000, help='Count of requests (default: 1000)')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Count of concurrent requests (default: 8)')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Count of simulated visitors with own address and cookies (default: 100)')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS')
+        parser.add_argument('--live', action='store_true',
+                            help='Use real DNS, HTTP and WHOIS servers instead of local stand-ins')
+        parser.add_argument('--test-database', action='store_true',
+                            help='Run against a fresh test database instead of the configured one')
+        parser.add_argument('--json', action='store_true',
+                            help='Print one JSON object per url pattern instead of a table')
+
+    def write_results(self, results, as_json):
+        if not as_json:
+            self.stdout.write(ROW_FORMAT.format(route='url', count='reqs', errors='errors', throughput='req/s',
+                                                p50='p50 ms', p90='p90 ms', p99='p99 ms',
+                                                upstream_p50='upstr p50', statuses='statuses'))
+        for route, result in results.items():
+            result = dict(result, route=route)
+            if as_json:
+                self.stdout.write(json.dumps(result, sort_keys=True))
+            else:
+                result['statuses'] = ' '.join('%s:%d' % item for item in sorted(result['statuses'].items()))
+                self.stdout.write(ROW_FORMAT.format(**dict(
+                    (key, '-' if value is None else value) for key, value in result.items())))
+        if not as_json:
+            self.stdout.write('req/s of a url is its share of the total: its requests / duration of the whole run')
+
+    def replay(self, entries, options):
+        from configs.wsgi import application
+
+        shared_connections = dict(
+            (connection.alias, connection) for connection in connections.all()
+            if connection.vendor == 'sqlite' and connection.is_in_memory_db())
+        if options['live']:
+            generator = LoadGenerator(application, entries, options['users'], options['host'],
+                                      shared_connections=shared_connections)
+            return generator.run(options['requests'], options['concurrency'])
+
+        servers = [FakeDNSServer(), LocalHTTPServer(), WhoisFixtureServer()]
+        for server in servers:
+            server.start()
+        try:
+            generator = LoadGenerator(application, entries, options['users'], options['host'],
+                                      {'{http_url}': servers[1].url}, shared_connections)
+            with use_standins(servers[0], servers[2]):
+                return generator.run(options['requests'], options['concurrency'])
+        finally:
+            for server in servers:
+                server.stop()
+
+    def handle(self, *args, **options):
+        try:
+            entries = load_traffic(options['traffic'])
+        except (IOError, ValueError) as error:
+            raise CommandError('Could not read traffic: %s' % error)
+        if not entries:
+            raise CommandError('No requests in %s' % options['traffic'])
+
+        if options['test_database']:
+            # only databases of the test runner are used, its test environment would instrument templates
+            runner = DiscoverRunner(verbosity=0)
+            old_config = runner.setup_databases()
+        try:
+            results = self.replay(entries, options)
+        finally:
+            if options['test_database']:
+                runner.teardown_databases(old_config)
+        self.write_results(results, options['json'])
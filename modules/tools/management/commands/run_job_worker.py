@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+import pika
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from modules.tools.utilities.jobs import check_shared_cache, execute, get_queue_name
+
+
+class Command(BaseCommand):
+    help = 'Executes lookup jobs queued to RabbitMQ by the job api (settings.JOBS_BACKEND = "pika").'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefetch', type=int, default=1,
+                            help='Count of unacknowledged jobs delivered to the worker at once')
+
+    def handle(self, *args, **options):
+        check_shared_cache()
+        connection = pika.BlockingConnection(pika.ConnectionParameters(**settings.RABBITMQ_CONFIG['connect']))
+        channel = connection.channel()
+        channel.queue_declare(queue=get_queue_name(), durable=True)
+        channel.basic_qos(prefetch_count=options['prefetch'])
+
+        def on_message(channel, method, properties, body):
+            try:
+                job = execute(body)
+            except ValueError as error:
+                # redelivery would fail again, the message is dropped
+                self.stderr.write('Dropped malformed message %r: %s' % (body[:200], error))
+            else:
+                self.stdout.write('%s %s %s: %s' % (job['id'], job['tool'], job['target'], job['status']))
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
+        channel.basic_consume(on_message, queue=get_queue_name())
+        self.stdout.write('Waiting for jobs in %s' % get_queue_name())
+        try:
+            channel.start_consuming()
+        except KeyboardInterrupt:
+            channel.stop_consuming()
+        finally:
+            connection.close()
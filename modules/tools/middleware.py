@@ -0,0 +1,47 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.conf import settings
+
+from .utilities.metrics import finish_request, publish, request_duration, start_request
+
+logger = logging.getLogger(__name__)
+
+# any other method is recorded as 'other', so clients can not add series to the request metric
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class MetricsMiddleware(object):
+    """
+    Measures requests by view and status, adds Server-Timing header with durations of upstream calls
+    made while handling the request, logs slow requests and publishes metrics of the worker.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_request()
+        start = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = finish_request()
+        duration = time.time() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'none'
+        method = request.method if request.method in METHODS else 'other'
+        request_duration.observe((view, method, '%dxx' % (response.status_code // 100)), duration)
+
+        timings['app'] = duration
+        if getattr(settings, 'METRICS_SERVER_TIMING', True):
+            response['Server-Timing'] = ', '.join(
+                '%s;dur=%.1f' % (name, value * 1000) for name, value in timings.items())
+        if duration > getattr(settings, 'METRICS_SLOW_REQUEST', 5):
+            logger.warning('Slow request %s %s: %s', request.method, request.path,
+                           ', '.join('%s %.3fs' % (name, value) for name, value in timings.items()))
+        publish()
+        return response
@@ -1,3 +1,856 @@
-from django.test import TestCase
+from __future__ import unicode_literals
 
-# Create your tests here.
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import random
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+import dns.rrset
+import ipaddress
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .benchmark import loadgen
+from .benchmark.standins import FakeDNSServer, LISTED_ADDRESS, WhoisFixtureServer, use_standins
+from .utilities import (cidr, dnsbl, dnscache, dnssec, emailheaders, jobs, metrics, ptrsweep, results, singleflight,
+                        utils, whois)
+from .utilities.httpclient import ConnectionPool
+
+
+class StandinsTestCase(TestCase):
+    """
+    Runs tests against local DNS and WHOIS stand-ins with an empty cache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(StandinsTestCase, cls).setUpClass()
+        cls.dns_server = FakeDNSServer()
+        cls.dns_server.start()
+        cls.whois_server = WhoisFixtureServer()
+        cls.whois_server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dns_server.stop()
+        cls.whois_server.stop()
+        super(StandinsTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        standins = use_standins(self.dns_server, self.whois_server)
+        standins.__enter__()
+        self.addCleanup(standins.__exit__, None, None, None)
+
+
+class UseStandinsTestCase(StandinsTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_configured_cache_is_not_used(self):
+        cache.set('outside', 1)
+        with use_standins(self.dns_server, self.whois_server):
+            self.assertIsNone(cache.get('outside'))
+            self.assertEqual([rdata.to_text() for rdata in dnscache.cached_query('host1.bench.test', 'NS')],
+                             ['ns.bench.test.'])
+            cache.set('inside', 1)
+        self.assertEqual(cache.get('outside'), 1)
+        self.assertIsNone(cache.get('inside'))
+        self.assertFalse([key for key in cache._cache if 'dns:' in key])
+
+
+class BlackListTestCase(StandinsTestCase):
+
+    def test_listed_address(self):
+        results = dnsbl.check_black_lists(LISTED_ADDRESS)
+        self.assertEqual(len(results), len(dnsbl.BLACK_LISTS))
+        self.assertTrue(all(result['status'] == dnsbl.LISTED for result in results))
+        self.assertEqual(results[0]['reason'], 'Listed for benchmarks')
+
+    def test_not_listed_address(self):
+        results = dnsbl.check_black_lists('192.0.2.1')
+        self.assertTrue(all(result['status'] == dnsbl.NOT_LISTED for result in results))
+
+    def test_silent_servers_are_unknown_after_deadline(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.1', 0))
+        self.addCleanup(silent.close)
+        resolver = dns.resolver.get_default_resolver()
+        resolver.port = silent.getsockname()[1]
+
+        start = time.time()
+        results = dnsbl.check_black_lists('192.0.2.1', timeout=0.5)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertTrue(all(result['status'] == dnsbl.UNKNOWN for result in results))
+
+    def test_check_after_deadline_is_not_sent(self):
+        queries = self.dns_server.queries
+        result = dnsbl._check_black_list(dns.resolver.get_default_resolver(), LISTED_ADDRESS,
+                                         dnsbl.reverse_ip(LISTED_ADDRESS), dnsbl.BLACK_LISTS[0], time.time() - 1)
+        self.assertEqual(result['status'], dnsbl.UNKNOWN)
+        self.assertEqual(self.dns_server.queries, queries)
+
+    @override_settings(DNSBL_CONCURRENT_SWEEPS=1)
+    def test_concurrent_sweeps_are_not_queued_past_deadline(self):
+        dnsbl._sweep_slots = None
+        self.addCleanup(setattr, dnsbl, '_sweep_slots', None)
+        check_black_list = dnsbl._check_black_list
+
+        def slow_check(*args):
+            time.sleep(0.6)
+            return check_black_list(*args)
+
+        dnsbl._check_black_list = slow_check
+        self.addCleanup(setattr, dnsbl, '_check_black_list', check_black_list)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(dnsbl.check_black_lists(LISTED_ADDRESS, timeout=1)))
+                   for _ in range(3)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # sweeps waited for each other instead of starting their checks after the deadline
+        self.assertGreaterEqual(time.time() - start, 1.8)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result['status'] == dnsbl.LISTED for sweep in results for result in sweep))
+
+
+class WhoisCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(setattr, cidr, '_index', cidr._index)
+        cidr._index = cidr.CIDRIndex()
+
+    def _store(self, address, cidr):
+        whois._store('lookup_rdap', ipaddress.ip_address(address),
+                     {'asn': '64496', 'query': address, 'network': {'cidr': cidr, 'name': 'EXAMPLE'}})
+
+    def test_network_answers_covered_addresses(self):
+        self._store('198.51.100.10', '198.51.100.0/24')
+        result = whois._get_cached('lookup_rdap', ipaddress.ip_address('198.51.100.200'))
+        self.assertEqual(result['network']['cidr'], '198.51.100.0/24')
+        self.assertEqual(result['query'], '198.51.100.200')
+        self.assertIsNone(whois._get_cached('lookup_rdap', ipaddress.ip_address('198.51.101.1')))
+
+    def test_short_network_is_stored_under_covering_network(self):
+        self._store('203.0.113.1', '192.0.0.0/4')
+        self.assertIsNotNone(whois._get_cached('lookup_rdap', ipaddress.ip_address('203.0.200.1')))
+
+    def test_network_longer_than_cached_prefixes_is_not_widened(self):
+        self._store('2001:db8:0:1::1', '2001:db8:0:1::/96')
+        self.assertIsNone(whois._get_cached('lookup_rdap', ipaddress.ip_address('2001:db8:0:1:1::1')))
+        self.assertIsNone(whois._get_cached('lookup_rdap', ipaddress.ip_address('2001:db8:0:1::2')))
+
+
+class PrefixTrieTestCase(SimpleTestCase):
+
+    def test_matches_brute_force(self):
+        generator = random.Random(5)
+        networks = {}
+        for _ in range(300):
+            length = generator.randint(0, 32)
+            network = ipaddress.ip_network('%s/%d' % (ipaddress.ip_address(generator.getrandbits(32)), length),
+                                           strict=False)
+            networks[network] = generator.randint(1, 5)
+        trie = cidr.PrefixTrie(32)
+        for network, value in networks.items():
+            trie.insert(int(network.network_address), network.prefixlen, value)
+        self.assertEqual(len(trie), len(networks))
+        for _ in range(2000):
+            address = ipaddress.ip_address(generator.getrandbits(32))
+            covering = [network for network in networks if address in network]
+            expected = max(covering, key=lambda network: network.prefixlen) if covering else None
+            found = trie.lookup(int(address))
+            if expected is None:
+                self.assertIsNone(found)
+            else:
+                self.assertEqual(found, (int(expected.network_address), expected.prefixlen, networks[expected]))
+
+    def test_insert_order_and_replacement(self):
+        trie = cidr.PrefixTrie(32)
+        # the narrow prefix first, so the broad one splits its edge
+        trie.insert(0x0A010000, 16, 'narrow')
+        trie.insert(0x0A020000, 16, 'sibling')
+        trie.insert(0x0A000000, 8, 'broad')
+        trie.insert(0x0A010203, 32, 'host')
+        trie.insert(0x0A000000, 8, 'replaced')
+        self.assertEqual(len(trie), 4)
+        self.assertEqual(trie.lookup(0x0A010203)[2], 'host')
+        self.assertEqual(trie.lookup(0x0A010204)[2], 'narrow')
+        self.assertEqual(trie.lookup(0x0A020001)[2], 'sibling')
+        self.assertEqual(trie.lookup(0x0A030001), (0x0A000000, 8, 'replaced'))
+        self.assertIsNone(trie.lookup(0x0B000000))
+
+    def test_load_prefix_dump(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'pfx2as.gz')
+        dump = gzip.open(path, 'wb')
+        dump.write(b'# comment\n\n192.0.2.0\t24\t64496\n2001:db8::/32 64497\nbroken\nnot-an-ip/8 64498\n')
+        dump.close()
+        index = cidr.CIDRIndex()
+        self.assertEqual(cidr.load_prefix_dump(index, path), 2)
+        self.assertEqual(index.lookup('192.0.2.7'), ('192.0.2.0/24', ('64496', None, None)))
+        self.assertEqual(index.lookup('2001:db8::1')[1][0], '64497')
+
+
+class AttributionTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, cidr, '_index', cidr._index)
+        cidr._index = cidr.CIDRIndex()
+
+    def test_longest_prefix_match(self):
+        index = cidr.get_index()
+        index.add('10.0.0.0/8', ('64496', 'BROAD', None))
+        index.add('10.1.0.0/16', ('64497', 'NARROW', None))
+        index.add('2001:db8::/32', ('64498', 'V6', None))
+        self.assertEqual(cidr.get_attribution('10.1.2.3')['cidr'], '10.1.0.0/16')
+        self.assertEqual(cidr.get_attribution('10.2.0.1')['name'], 'BROAD')
+        self.assertEqual(cidr.get_attribution('2001:db8::1')['asn'], '64498')
+        self.assertIsNone(cidr.get_attribution('192.0.2.1'))
+        self.assertIsNone(cidr.get_attribution('not an address'))
+
+    def test_whois_result_and_index_agree(self):
+        info = {'asn': '64496', 'nets': [
+            {'cidr': '198.51.0.0/16', 'name': 'BROAD', 'address': 'Broad Street'},
+            {'cidr': '198.51.100.0/24', 'name': 'SPECIFIC', 'address': 'Specific Street'},
+        ]}
+        ip = ipaddress.ip_address('198.51.100.1')
+        network, (asn, name, description) = whois.get_attribution_value(info, ip)
+        self.assertEqual(network, ipaddress.ip_network('198.51.100.0/24'))
+        self.assertEqual((name, description), ('SPECIFIC', 'Specific Street'))
+
+        whois._remember(ip, info)
+        attribution = cidr.get_attribution('198.51.100.1')
+        self.assertEqual((attribution['name'], attribution['description']), (name, description))
+
+    def test_rdap_description(self):
+        ip = ipaddress.ip_address('203.0.113.1')
+        info = {'asn': '64496', 'network': {'cidr': '203.0.113.0/24', 'name': 'EXAMPLE-NET',
+                                            'remarks': [{'title': 'Remarks', 'description': 'Example network'}]}}
+        self.assertEqual(whois.get_attribution_value(info, ip)[1][2], 'Example network')
+        del info['network']['remarks']
+        self.assertEqual(whois.get_attribution_value(info, ip)[1][2], 'EXAMPLE-NET')
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def test_reuse_per_host(self):
+        pool = ConnectionPool(max_idle_per_host=1)
+        first, second = FakeConnection(), FakeConnection()
+        pool.release('a', first)
+        pool.release('a', second)
+        self.assertTrue(second.closed)
+        self.assertIs(pool.acquire('a'), first)
+        self.assertIsNone(pool.acquire('a'))
+        self.assertIsNone(pool.acquire('b'))
+
+    def test_least_recently_released_is_evicted(self):
+        pool = ConnectionPool(max_idle=2)
+        connections = [FakeConnection() for _ in range(3)]
+        for host, conn in zip('abc', connections):
+            pool.release(host, conn)
+        self.assertEqual(len(pool), 2)
+        self.assertEqual([conn.closed for conn in connections], [True, False, False])
+        self.assertIsNone(pool.acquire('a'))
+        self.assertIs(pool.acquire('c'), connections[2])
+
+    def test_expired_connections_of_other_hosts_are_closed_on_release(self):
+        pool = ConnectionPool(idle_timeout=0.05)
+        stale = FakeConnection()
+        pool.release('a', stale)
+        time.sleep(0.1)
+        pool.release('b', FakeConnection())
+        self.assertTrue(stale.closed)
+        self.assertEqual(len(pool), 1)
+
+
+class BatchLookupTestCase(StandinsTestCase):
+
+    def _post(self, tool, targets):
+        response = self.client.post(reverse('batch-lookup', kwargs={'tool': tool}), json.dumps({'targets': targets}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return dict((line['target'], line) for line in map(json.loads, b''.join(response.streaming_content).splitlines()))
+
+    def test_targets_are_validated_by_tool_forms(self):
+        queries = self.dns_server.queries
+        lines = self._post('mx-lookup', ['not a domain', 'http://'])
+        self.assertEqual(lines['not a domain']['error'], 'Enter a valid URL.')
+        self.assertIn('error', lines['http://'])
+        self.assertEqual(self.dns_server.queries, queries)
+
+        lines = self._post('dns-black-list', ['not an address', LISTED_ADDRESS])
+        self.assertIn('error', lines['not an address'])
+        self.assertTrue(all(result['status'] == dnsbl.LISTED for result in lines[LISTED_ADDRESS]['result']))
+
+    def test_valid_targets_are_looked_up(self):
+        lines = self._post('ns-lookup', ['http://host1.bench.test', 'http://host1.bench.test'])
+        self.assertEqual(lines['http://host1.bench.test']['result'], ['ns.bench.test.'])
+        self.assertEqual(len(lines), 1)
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class RateLimitTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock(600000.0)
+        self.addCleanup(setattr, utils, 'time', utils.time)
+        utils.time = self.clock
+
+    def _request(self, ip='192.0.2.1'):
+        request = RequestFactory().get('/', REMOTE_ADDR=ip)
+        request.user = AnonymousUser()
+        return request
+
+    def test_limit_within_window(self):
+        results = [utils.is_rate_limited(self._request(), '3/m', increment=True) for _ in range(4)]
+        self.assertEqual(results, [False, False, False, True])
+        self.assertFalse(utils.is_rate_limited(self._request('192.0.2.2'), '3/m', increment=True))
+
+    def test_checking_does_not_count(self):
+        for _ in range(5):
+            self.assertFalse(utils.is_rate_limited(self._request(), '1/m'))
+        self.assertEqual(utils.get_usage_count(self._request(), '1/m')['count'], 0)
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        for _ in range(10):
+            utils.is_rate_limited(self._request(), '10/m', increment=True)
+        # a quarter of the next window has passed, three quarters of the previous window overlap it
+        self.clock.now += 60 + 15
+        usage = utils.get_usage_count(self._request(), '10/m', increment=True)
+        self.assertEqual(usage['count'], 1 + 7)
+        self.clock.now += 45
+        self.assertEqual(utils.get_usage_count(self._request(), '10/m')['count'], 1)
+
+
+class ResultCacheTestCase(StandinsTestCase):
+
+    def test_rejected_results_are_not_cached(self):
+        calls = []
+
+        def lookup(target):
+            calls.append(target)
+            return {'status': 'indeterminate' if len(calls) == 1 else 'secure'}
+
+        is_cacheable = lambda result: result['status'] != 'indeterminate'
+        self.assertIsNone(results.get_result('dns-sec', lookup, 'example.com', is_cacheable)['etag'])
+        entry = results.get_result('dns-sec', lookup, 'example.com', is_cacheable)
+        self.assertEqual(entry['result']['status'], 'secure')
+        self.assertEqual(results.get_result('dns-sec', lookup, 'example.com', is_cacheable), entry)
+        self.assertEqual(len(calls), 2)
+
+    def test_permalink_is_private_and_revalidated(self):
+        url = reverse('dns-sec-result', kwargs={'target': 'host1.bench.test'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['status'], True)
+        self.assertIn('private', response['Cache-Control'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_indeterminate_permalink_is_not_cached(self):
+        resolver = dns.resolver.get_default_resolver()
+        resolver.nameservers = ['127.0.0.1']
+        with self.settings(DNSSEC_QUERY_PORT=1, DNSSEC_QUERY_TIMEOUT=0.5):
+            response = self.client.get(reverse('dns-sec-result', kwargs={'target': 'host2.bench.test'}))
+        self.assertEqual(response.context['result']['status'], dnssec.INDETERMINATE)
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+class DenialOfExistenceTestCase(SimpleTestCase):
+    """
+    Checks that NSEC and NSEC3 records prove absence of DS records of the zone and nothing else.
+    """
+
+    parent = dns.name.from_text('example.')
+    zone = dns.name.from_text('child.example.')
+
+    def nsec(self, owner, next_name, types):
+        return dns.rrset.from_text(owner, 3600, 'IN', 'NSEC', '%s %s' % (next_name, types))
+
+    def nsec3(self, name, next_name, types, flags=0):
+        return dns.rrset.from_text(
+            '%s.example.' % dnssec.nsec3_hash(dns.name.from_text(name), b'\xaa\xbb\xcc\xdd', 12), 3600, 'IN',
+            'NSEC3', '1 %d 12 aabbccdd %s %s' % (flags, next_name, types))
+
+    def test_nsec3_hash(self):
+        # example from RFC 5155 appendix A
+        self.assertEqual(dnssec.nsec3_hash(self.parent, b'\xaa\xbb\xcc\xdd', 12), '0P9MHAVEQVM6T7VBL5LOP2U3T2RP3TOM')
+
+    def test_nsec_of_zone(self):
+        self.assertTrue(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('child.example.', 'd.example.', 'NS')]))
+        self.assertFalse(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('child.example.', 'd.example.',
+                                                                            'NS DS RRSIG NSEC')]))
+        # record from the apex of the child zone
+        self.assertFalse(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('child.example.', 'a.child.example.',
+                                                                            'NS SOA RRSIG NSEC DNSKEY')]))
+
+    def test_nsec_of_other_name(self):
+        self.assertFalse(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('other.example.', 'x.example.', 'NS')]))
+        self.assertFalse(dnssec._proves_no_ds_by_nsec(self.zone, []))
+
+    def test_covering_nsec(self):
+        self.assertTrue(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('b.example.', 'd.example.', 'NS')]))
+        # the last record of the zone
+        self.assertTrue(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('b.example.', 'example.', 'NS')]))
+        self.assertFalse(dnssec._proves_no_ds_by_nsec(self.zone, [self.nsec('d.example.', 'example.', 'NS')]))
+
+    def test_nsec3_of_zone(self):
+        proof = [self.nsec3('child.example.', 'VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV', 'NS')]
+        self.assertTrue(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, proof))
+        proof = [self.nsec3('child.example.', 'VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV', 'NS DS RRSIG')]
+        self.assertFalse(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, proof))
+        proof = [self.nsec3('other.example.', 'VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV', 'NS')]
+        self.assertFalse(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, proof))
+
+    def test_nsec3_opt_out(self):
+        hashed = dnssec.nsec3_hash(self.zone, b'\xaa\xbb\xcc\xdd', 12)
+        covering = dns.rrset.from_text('00000000000000000000000000000000.example.', 3600, 'IN', 'NSEC3',
+                                       '1 1 12 aabbccdd VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV NS')
+        not_covering = dns.rrset.from_text('%s.example.' % hashed[:-1] + 'V', 3600, 'IN', 'NSEC3',
+                                           '1 1 12 aabbccdd VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV NS')
+        not_opt_out = dns.rrset.from_text('00000000000000000000000000000000.example.', 3600, 'IN', 'NSEC3',
+                                          '1 0 12 aabbccdd VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV NS')
+        apex = self.nsec3('example.', '00000000000000000000000000000001', 'NS SOA RRSIG DNSKEY NSEC3PARAM')
+        self.assertTrue(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, [apex, covering]))
+        self.assertFalse(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, [covering]))
+        self.assertFalse(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, [apex, not_opt_out]))
+        self.assertFalse(dnssec._proves_no_ds_by_nsec3(self.parent, self.zone, [apex, not_covering]))
+
+
+class TruncatingDNSServer(object):
+    """
+    Resolver which truncates every UDP response and answers h<N>.example. A 192.0.2.<N> over TCP,
+    if tcp is False the TCP port is closed.
+    """
+
+    def __init__(self, tcp=True):
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(('127.0.0.1', 0))
+        self.port = self.udp.getsockname()[1]
+        self.payloads = []
+        self.tcp = None
+        if tcp:
+            self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.tcp.bind(('127.0.0.1', self.port))
+            self.tcp.listen(8)
+        for target in (self.serve_udp, self.serve_tcp):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        for sock in (self.udp, self.tcp):
+            if sock is not None:
+                sock.close()
+
+    def respond(self, wire):
+        request = dns.message.from_wire(wire)
+        self.payloads.append(request.payload if request.edns >= 0 else None)
+        response = dns.message.make_response(request)
+        name = request.question[0].name
+        response.answer.append(dns.rrset.from_text(name, 300, 'IN', 'A', '192.0.2.%s' % name.labels[0][1:]))
+        return response
+
+    def serve_udp(self):
+        while True:
+            try:
+                wire, address = self.udp.recvfrom(65535)
+            except socket.error:
+                return
+            response = self.respond(wire)
+            response.answer = []
+            response.flags |= dns.flags.TC
+            self.udp.sendto(response.to_wire(), address)
+
+    def serve_tcp(self):
+        if self.tcp is None:
+            return
+        connection, _ = self.tcp.accept()
+        stream = connection.makefile('rb')
+        while True:
+            header = stream.read(2)
+            if len(header) < 2:
+                break
+            wire = self.respond(stream.read(struct.unpack('!H', header)[0])).to_wire()
+            connection.sendall(struct.pack('!H', len(wire)) + wire)
+        connection.close()
+
+
+class PipelineTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def query(self, server, names):
+        self.addCleanup(server.close)
+        with self.settings(DNS_PIPELINE_RESOLVER='127.0.0.1', DNS_PIPELINE_PORT=server.port,
+                           DNS_PIPELINE_TRANSPORT='udp', DNS_PIPELINE_TIMEOUT=1):
+            return dnscache.cached_query_many([(name, 'A') for name in names])
+
+    def test_truncated_responses_are_repeated_over_tcp(self):
+        server = TruncatingDNSServer()
+        names = ['h%d.example.' % number for number in range(1, 101)]
+        answers = self.query(server, names)
+        self.assertEqual([answer[0].address for answer in answers],
+                         ['192.0.2.%d' % number for number in range(1, 101)])
+        self.assertEqual(set(server.payloads), {dnscache.EDNS_PAYLOAD})
+
+    def test_truncated_responses_are_not_cached(self):
+        answers = self.query(TruncatingDNSServer(tcp=False), ['h1.example.', 'h2.example.'])
+        for answer in answers:
+            self.assertIsInstance(answer, dns.exception.Timeout)
+        self.assertIsNone(cache.get(dnscache._make_cache_key(dns.name.from_text('h1.example.'), dns.rdatatype.A)))
+
+
+class RecordingCache(object):
+
+    def __init__(self):
+        self.stored = {}
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout):
+        self.stored[key] = (value, timeout)
+
+
+class PtrSweepTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock(1000.0)
+        self.addCleanup(setattr, dnscache, 'time', dnscache.time)
+        dnscache.time = self.clock
+        self.sweep_cache = RecordingCache()
+        self.addCleanup(setattr, ptrsweep, '_get_cache', ptrsweep._get_cache)
+        ptrsweep._get_cache = lambda: self.sweep_cache
+
+    def remember(self, address, entry, ttl):
+        qname = dns.reversename.from_address(address)
+        dnscache._store(cache, dnscache._make_cache_key(qname, dns.rdatatype.PTR), entry, ttl)
+
+    def test_block_expires_with_first_negative_answer(self):
+        self.remember('192.0.2.0', (dnscache.ANSWER, dns.reversename.from_address('192.0.2.0').to_text(),
+                                    (dns.rdatatype.PTR, ['host.example.']), 1900.0), 900)
+        for address, ttl in (('192.0.2.1', 600), ('192.0.2.2', 60), ('192.0.2.3', 300)):
+            self.remember(address, (dnscache.NXDOMAIN, None, None, 1000.0 + ttl), ttl)
+        self.clock.now += 30
+        results = list(ptrsweep.sweep(ipaddress.ip_network('192.0.2.0/30')))
+        self.assertEqual([result['ptr'] for result in results], [['host.example.'], [], [], []])
+        self.assertEqual(self.sweep_cache.stored['ptr-sweep:192.0.2.0/30'], (results, 30))
+
+    def test_socket_errors_are_retried(self):
+        batches = []
+
+        def query_many(queries):
+            batches.append(len(queries))
+            return cached_query_many(queries)
+
+        cached_query_many = ptrsweep.cached_query_many
+        self.addCleanup(setattr, ptrsweep, 'cached_query_many', cached_query_many)
+        ptrsweep.cached_query_many = query_many
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        # nothing listens on the port, so connections are refused
+        listener.close()
+        with self.settings(DNS_PIPELINE_RESOLVER='127.0.0.1', DNS_PIPELINE_PORT=port, DNS_PIPELINE_TRANSPORT='tcp',
+                           PTR_SWEEP_RETRIES=1, PTR_SWEEP_WINDOW=2):
+            results = list(ptrsweep.sweep(ipaddress.ip_network('192.0.2.0/31')))
+        self.assertEqual([result['error'] for result in results], ['Lookup failed'] * 2)
+        # the window is halved after the failure
+        self.assertEqual(batches, [2, 1, 1])
+        self.assertEqual(self.sweep_cache.stored, {})
+
+    def test_cached_answers_have_remaining_ttl(self):
+        self.remember('192.0.2.0', (dnscache.ANSWER, dns.reversename.from_address('192.0.2.0').to_text(),
+                                    (dns.rdatatype.PTR, ['host.example.']), 1900.0), 900)
+        self.remember('192.0.2.1', (dnscache.NO_ANSWER, None, None, 1600.0), 600)
+        self.clock.now += 100
+        answer, negative = dnscache.cached_query_many(
+            [(dns.reversename.from_address(address), 'PTR') for address in ('192.0.2.0', '192.0.2.1')])
+        self.assertEqual(answer.ttl, 800)
+        self.assertIsInstance(negative, dns.resolver.NoAnswer)
+        self.assertEqual(negative.ttl, 500)
+
+
+MESSAGE_HEADERS = """Received: from mx.example.net (mx.example.net [93.184.216.34])
+\tby inbound.example.com with ESMTPS id abc123
+\tfor <user@example.com>; Tue, 1 Mar 2016 10:00:05 +0000
+Received: from [192.0.2.10] (helo=sender)
+\tby mx.example.net with ESMTP; Tue, 1 Mar 2016 10:00:00 +0000
+Received: from localhost by sender.example.org with LMTP; Tue, 1 Mar 2016 09:59:58 +0000
+From: Sender <sender@example.org>
+To: user@example.com,
+ other@EXAMPLE.net
+Subject: folded
+  subject
+not a header line
+
+Received: from body.example.invalid by body.example.invalid; Tue, 1 Mar 2016 10:00:00 +0000
+"""
+
+
+class EmailHeadersTestCase(SimpleTestCase):
+
+    def test_headers_are_unfolded_until_body(self):
+        headers = list(emailheaders.iter_headers(MESSAGE_HEADERS))
+        self.assertEqual([name for name, _ in headers], ['Received'] * 3 + ['From', 'To', 'Subject'])
+        self.assertEqual(headers[-1], ('Subject', 'folded subject'))
+        self.assertEqual(headers[-2], ('To', 'user@example.com, other@EXAMPLE.net'))
+
+    def test_hop_chain(self):
+        result = emailheaders.analyze_headers(MESSAGE_HEADERS)
+        hops = result['hops']
+        self.assertEqual([hop['by'] for hop in hops], ['sender.example.org', 'mx.example.net', 'inbound.example.com'])
+        self.assertEqual([hop['ip'] for hop in hops], [None, '192.0.2.10', '93.184.216.34'])
+        self.assertEqual([hop['delay'] for hop in hops], [None, 2, 5])
+        self.assertEqual(hops[2]['with'], 'ESMTPS')
+        self.assertTrue(hops[2]['public'])
+        self.assertFalse(hops[1]['public'])
+        self.assertEqual(result['total_delay'], 7)
+        self.assertEqual(result['ips'], ['192.0.2.10', '93.184.216.34'])
+        self.assertEqual(result['domains'], ['example.org', 'example.com', 'example.net', 'sender.example.org',
+                                             'mx.example.net', 'inbound.example.com'])
+
+    def test_received_variants(self):
+        hop = emailheaders.parse_received('from [IPv6:2001:db8::1] by mx.example.com; not a date')
+        self.assertEqual(hop['ip'], '2001:db8::1')
+        self.assertIsNone(hop['timestamp'])
+        hop = emailheaders.parse_received('by mx.example.com (Postfix) with ESMTP id 1 (from 192.0.2.1)')
+        self.assertIsNone(hop['from'])
+        self.assertIsNone(hop['ip'])
+
+    def test_long_input_is_parsed_in_linear_time(self):
+        started = time.time()
+        emailheaders.analyze_headers('Received: from ' + 'a.' * 50000 + ' ' + '(' * 50000 + '\n' +
+                                     'From: ' + 'a' * 100000 + '@' + 'b-' * 50000)
+        self.assertLess(time.time() - started, 5)
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_forwarded_addresses_are_not_trusted(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1', HTTP_X_FORWARDED_FOR='127.0.0.1',
+                                   HTTP_X_REAL_IP='127.0.0.1')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 200)
+
+    def test_workers_are_summed(self):
+        metrics.coalesced_calls.inc(('metrics-test', 'shared'), 2)
+        worker = metrics.snapshot()
+        worker['metrics'][metrics.coalesced_calls.name] = {('metrics-test', 'shared'): 5}
+        worker['caches'] = {'metrics-test': (3, 4)}
+        cache.set(metrics._make_worker_key(1), worker)
+        # the second worker has expired
+        cache.set(metrics.WORKERS_KEY, [1, 2])
+        text = metrics.render()
+        self.assertIn('toolset_coalesced_calls_total{tool="metrics-test",scope="shared"} 7\n', text)
+        self.assertIn('toolset_cache_misses_total{cache="metrics-test"} 4\n', text)
+        self.assertNotIn(2, cache.get(metrics.WORKERS_KEY))
+
+    def test_publish(self):
+        metrics.publish(force=True)
+        self.assertIn(os.getpid(), cache.get(metrics.WORKERS_KEY))
+        self.assertIsNotNone(cache.get(metrics._make_worker_key(os.getpid())))
+
+    def test_unknown_methods_are_other(self):
+        self.client.generic('FOO', reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        methods = {labels[1] for labels in metrics.request_duration.snapshot()}
+        self.assertIn('other', methods)
+        self.assertIn('GET', methods)
+        self.assertNotIn('FOO', methods)
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LoadGeneratorTestCase(SimpleTestCase):
+
+    def test_exceptions_are_counted_and_logged_once(self):
+        def application(environ, start_response):
+            if environ['PATH_INFO'] == '/metrics':
+                raise RuntimeError('broken')
+            start_response(str('200 OK'), [])
+            return [b'ok']
+
+        handler = RecordingHandler()
+        loadgen.logger.addHandler(handler)
+        self.addCleanup(loadgen.logger.removeHandler, handler)
+        loadgen.logger.propagate = False
+        self.addCleanup(setattr, loadgen.logger, 'propagate', True)
+        generator = loadgen.LoadGenerator(application, [{'path': '/metrics'}, {'path': '/'}], users=3)
+        results = generator.run(10, 3)
+        self.assertEqual(results['metrics']['statuses'], {'exception': 5})
+        self.assertEqual(results['metrics']['errors'], 5)
+        self.assertEqual(results['total']['statuses'], {'exception': 5, '2xx': 5})
+        self.assertEqual(len(handler.records), 1)
+        self.assertIn('metrics', handler.records[0].getMessage())
+        self.assertIsNotNone(handler.records[0].exc_info)
+
+
+class AtomicLocMemCache(LocMemCache):
+    """
+    LocMemCache of Django 1.11 deletes a missing key after get() outside of the read lock, which removes keys
+    added meanwhile by other threads. Shared caches like memcached do not, workers are simulated by threads here.
+    """
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock.reader():
+            if self._has_expired(key):
+                return default
+            pickled = self._cache[key]
+        return pickle.loads(pickled)
+
+
+@override_settings(SINGLEFLIGHT_CACHE_ALIAS='singleflight', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'singleflight': {'BACKEND': 'modules.tools.tests.AtomicLocMemCache', 'LOCATION': 'singleflight'},
+})
+class SingleFlightTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches['singleflight']
+        self.cache.clear()
+        self.calls = []
+
+    def lookup(self, target):
+        self.calls.append(target)
+        time.sleep(0.2)
+        return target.upper()
+
+    def call_concurrently(self, call, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(call())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_calls_in_process_are_collapsed(self):
+        lookup = singleflight.coalesce('singleflight-test')(self.lookup)
+        self.assertEqual(self.call_concurrently(lambda: lookup('example.com')), ['EXAMPLE.COM'] * 5)
+        self.assertEqual(self.calls, ['example.com'])
+
+    def test_calls_of_workers_are_collapsed(self):
+        # every thread calls the shared path directly, like separate workers would
+        results = self.call_concurrently(
+            lambda: singleflight._call_shared('test', self.lookup, ('example.com',), {}))
+        self.assertEqual(self.calls, ['example.com'])
+        self.assertEqual(sorted(shared for _, _, shared in results), [False] + [True] * 4)
+        self.assertEqual(set(result for result, _, _ in results), {'EXAMPLE.COM'})
+
+    def test_waiter_takes_over_released_lock(self):
+        self.cache.add('singleflight:lock:test', 'failed', 15)
+        threading.Timer(0.1, self.cache.delete, ('singleflight:lock:test',)).start()
+        results = self.call_concurrently(
+            lambda: singleflight._call_shared('test', self.lookup, ('example.com',), {}), 3)
+        self.assertEqual(self.calls, ['example.com'])
+        self.assertEqual(set(result for result, _, _ in results), {'EXAMPLE.COM'})
+
+    def test_waiter_calls_itself_after_wait(self):
+        lock_key = 'singleflight:lock:singleflight-test:%s' % hashlib.md5(b'example.com').hexdigest()
+        self.cache.add(lock_key, 'stuck', 15)
+        lookup = singleflight.coalesce('singleflight-test')(self.lookup)
+        started = time.time()
+        with self.settings(SINGLEFLIGHT_SHARED=True, SINGLEFLIGHT_WAIT=0.3):
+            self.assertEqual(lookup('example.com'), 'EXAMPLE.COM')
+        # waited for the stuck holder, then called the lookup which takes 0.2 seconds
+        self.assertGreaterEqual(time.time() - started, 0.5)
+        self.assertEqual(self.calls, ['example.com'])
+        self.assertEqual(self.cache.get(lock_key), 'stuck')
+
+
+class JobsTestCase(StandinsTestCase):
+
+    def test_execute(self):
+        job = jobs.execute(json.dumps({'id': 'a' * 32, 'tool': 'ns-lookup', 'target': 'http://host1.bench.test'}))
+        self.assertEqual(job['status'], jobs.DONE)
+        self.assertEqual(jobs.get_job('a' * 32)['result'], ['ns.bench.test.'])
+
+    def test_malformed_messages(self):
+        for message in (b'not json', b'\xff', b'[]', json.dumps({'id': 'a' * 32, 'tool': 'ns-lookup'}),
+                        json.dumps({'id': 'a' * 32, 'tool': 'unknown', 'target': 'example.com'})):
+            self.assertRaises(ValueError, jobs.execute, message)
+
+    def test_failed_publish_fails_job(self):
+        class BrokenBackend(object):
+            def publish(self, message):
+                raise IOError('broker is down')
+
+        self.addCleanup(jobs.BACKENDS.pop, 'broken')
+        jobs.BACKENDS['broken'] = BrokenBackend
+        with self.settings(JOBS_BACKEND='broken'):
+            job = jobs.enqueue('ns-lookup', 'host1.bench.test')
+            response = self.client.post(reverse('job-create', kwargs={'tool': 'ns-lookup'}),
+                                        json.dumps({'target': 'host1.bench.test'}), content_type='application/json')
+        self.assertEqual(jobs.get_job(job['id'])['status'], jobs.FAILED)
+        self.assertIn('broker is down', jobs.get_job(job['id'])['error'])
+        self.assertEqual(response.status_code, 503)
+
+    def test_local_memory_cache_is_reported(self):
+        self.assertEqual([message.id for message in jobs.check_jobs_cache(None)], ['tools.W001'])
+
+    def test_pika_backend_needs_shared_cache(self):
+        with self.settings(JOBS_BACKEND='pika'):
+            self.assertRaises(ImproperlyConfigured, jobs.get_backend)
@@ -17,7 +17,7 @@ def get_ip_from_request(request):
     :return: ip address
     :rtype: str
     """
-    if (settings.DEBUG or settings.TESTING_MODE) and hasattr(settings, "DEBUG_REMOTE_IP"):
+    if (settings.DEBUG or getattr(settings, "TESTING_MODE", False)) and hasattr(settings, "DEBUG_REMOTE_IP"):
         return settings.DEBUG_REMOTE_IP
 
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -31,14 +31,15 @@ def get_ip_from_request(request):
 
 def get_user_agent_from_request(request):
     """
-    Returns user's user agent form request.
+    Returns user's parsed user agent form request.
     :param request: http request
     :type request: django.http.HttpRequest
-    :return: user agent
-    :rtype: instance
+    :return: dict with user_agent, os, device and string or None if there is no User-Agent header
+    :rtype: dict or None
     """
-    from user_agents import parse
-    return parse(request.META.get('HTTP_USER_AGENT', ''))
+    from .useragent import parse_user_agent
+
+    return parse_user_agent(request.META.get('HTTP_USER_AGENT', ''))
 
 
 def get_location_from_request(request):
@@ -49,14 +50,7 @@ def get_location_from_request(request):
     :return: location instance or empty dict
     :rtype: instance or dict
     """
-    from django.contrib.gis.geoip2 import GeoIP2
-    from geoip2.errors import AddressNotFoundError
+    from .geoip import get_city
 
     user_ip = get_ip_from_request(request=request)
-    g = GeoIP2()
-    try:
-        location = g.city(user_ip)
-    except AddressNotFoundError:
-        return dict()
-    else:
-        return location
+    return get_city(user_ip) or dict()
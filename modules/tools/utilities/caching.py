@@ -0,0 +1,171 @@
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_stats = {}
+_stats_lock = threading.Lock()
+_local = threading.local()
+
+
+class CacheStats(object):
+    """
+    Per-process hit/miss counters of a cache.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+        _note_lookup(0)
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+        _note_lookup(1)
+
+    @property
+    def ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def as_dict(self):
+        return {'name': self.name, 'hits': self.hits, 'misses': self.misses, 'ratio': self.ratio}
+
+
+class LRUCache(object):
+    """
+    Bounded thread-safe in-process LRU cache.
+    """
+
+    def __init__(self, size, name=None):
+        self.size = size
+        self.stats = get_cache_stats(name) if name else None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                found = False
+            else:
+                self._data[key] = value
+                found = True
+        if self.stats is not None:
+            if found:
+                self.stats.hit()
+            else:
+                self.stats.miss()
+        return value if found else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_cache_stats(name):
+    """
+    Returns counters of the cache with specified name, creates them if needed.
+    :param name: cache name
+    :type name: str
+    :return: cache counters
+    :rtype: CacheStats
+    """
+    try:
+        return _stats[name]
+    except KeyError:
+        with _stats_lock:
+            return _stats.setdefault(name, CacheStats(name))
+
+
+def get_all_cache_stats():
+    """
+    Returns counters of all known caches.
+    :return: list of dicts
+    :rtype: list
+    """
+    return [stats.as_dict() for name, stats in sorted(_stats.items())]
+
+
+class TTLScope(object):
+    """
+    Collects the minimum TTL of upstream data used while computing a result.
+    """
+
+    def __init__(self):
+        self.ttl = None
+
+    def note(self, ttl):
+        if self.ttl is None or ttl < self.ttl:
+            self.ttl = ttl
+
+
+@contextmanager
+def track_ttl():
+    """
+    Context manager which collects TTLs noted by caches in the current thread.
+    Example:
+        with track_ttl() as scope:
+            result = get_mx_lookup_tool(domain)
+        ttl = scope.ttl
+    """
+    previous = getattr(_local, 'scope', None)
+    scope = _local.scope = TTLScope()
+    try:
+        yield scope
+    finally:
+        _local.scope = previous
+        if previous is not None and scope.ttl is not None:
+            previous.note(scope.ttl)
+
+
+def note_ttl(ttl):
+    """
+    Notes TTL of upstream data for the enclosing track_ttl scope if any.
+    :param ttl: seconds
+    :type ttl: int
+    """
+    scope = getattr(_local, 'scope', None)
+    if scope is not None:
+        scope.note(ttl)
+
+
+def _note_lookup(index):
+    lookups = getattr(_local, 'lookups', None)
+    if lookups is not None:
+        lookups[index] += 1
+
+
+@contextmanager
+def track_lookups():
+    """
+    Context manager which counts cache hits and misses of all caches in the current thread.
+    Example:
+        with track_lookups() as lookups:
+            answer = cached_query(domain, 'MX')
+        hits, misses = lookups
+    """
+    previous = getattr(_local, 'lookups', None)
+    lookups = _local.lookups = [0, 0]
+    try:
+        yield lookups
+    finally:
+        _local.lookups = previous
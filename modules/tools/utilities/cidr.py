@@ -0,0 +1,249 @@
+from __future__ import unicode_literals
+
+import binascii
+import gzip
+import socket
+import struct
+import threading
+
+from django.conf import settings
+from django.utils.encoding import force_text
+
+_WIDTHS = {
+    4: 32,
+    6: 128,
+}
+
+
+class _Node(object):
+    __slots__ = ('prefix', 'length', 'value', 'left', 'right')
+
+    def __init__(self, prefix, length, value=None):
+        self.prefix = prefix
+        self.length = length
+        self.value = value
+        self.left = None
+        self.right = None
+
+
+class PrefixTrie(object):
+    """
+    Path-compressed binary (Patricia) trie for longest prefix match over integer addresses.
+    Prefixes are stored left-aligned in width bits, nodes without value are only created at branch points.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _mask(self, value, length):
+        return value >> (self.width - length) << (self.width - length) if length else 0
+
+    def _bit(self, value, position):
+        return (value >> (self.width - 1 - position)) & 1
+
+    def _common_length(self, a, b, limit):
+        return min(limit, self.width - (a ^ b).bit_length())
+
+    def _attach(self, parent, node):
+        if self._bit(node.prefix, parent.length):
+            parent.right = node
+        else:
+            parent.left = node
+
+    def insert(self, prefix, length, value):
+        """
+        Inserts prefix or replaces value of existing one.
+        :param prefix: network address as an integer
+        :type prefix: int
+        :param length: prefix length
+        :type length: int
+        :param value: any value except None
+        """
+        prefix = self._mask(prefix, length)
+        parent, node = None, self._root
+        while node is not None:
+            common = self._common_length(node.prefix, prefix, min(node.length, length))
+            if common < node.length:
+                break
+            if node.length == length:
+                if node.value is None:
+                    self._size += 1
+                node.value = value
+                return
+            parent, node = node, node.right if self._bit(prefix, node.length) else node.left
+
+        self._size += 1
+        new = _Node(prefix, length, value)
+        if node is not None:
+            # split the edge: the new node or a new branch node becomes the parent of existing one
+            if common == length:
+                branch = new
+            else:
+                branch = _Node(self._mask(prefix, common), common)
+                self._attach(branch, new)
+            self._attach(branch, node)
+            new = branch
+        if parent is None:
+            self._root = new
+        else:
+            self._attach(parent, new)
+
+    def lookup(self, address):
+        """
+        Returns the longest prefix which covers address.
+        :param address: address as an integer
+        :type address: int
+        :return: (prefix, length, value) or None
+        :rtype: tuple
+        """
+        best = None
+        node = self._root
+        while node is not None and (address ^ node.prefix) >> (self.width - node.length) == 0:
+            if node.value is not None:
+                best = node
+            if node.length == self.width:
+                break
+            node = node.right if self._bit(address, node.length) else node.left
+        if best is None:
+            return None
+        return best.prefix, best.length, best.value
+
+
+def _address_to_int(address):
+    address = force_text(address).strip()
+    if ':' in address:
+        return 6, int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, address)), 16)
+    return 4, struct.unpack(b'!I', socket.inet_pton(socket.AF_INET, address))[0]
+
+
+def _int_to_address(version, value):
+    if version == 6:
+        return force_text(socket.inet_ntop(socket.AF_INET6, binascii.unhexlify('%032x' % value)))
+    return force_text(socket.inet_ntop(socket.AF_INET, struct.pack(b'!I', value)))
+
+
+class CIDRIndex(object):
+    """
+    In-memory longest prefix match index of IPv4 and IPv6 networks.
+    Values are (asn, name, description) tuples, equal tuples loaded from dumps are shared.
+    """
+
+    def __init__(self):
+        self._tries = dict((version, PrefixTrie(width)) for version, width in _WIDTHS.items())
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(trie) for trie in self._tries.values())
+
+    def add(self, cidr, value):
+        """
+        Adds network to the index.
+        :param cidr: network like '192.0.2.0/24'
+        :type cidr: str
+        :param value: network attribution
+        :type value: tuple
+        """
+        address, _, length = force_text(cidr).partition('/')
+        version, prefix = _address_to_int(address)
+        length = int(length) if length else _WIDTHS[version]
+        with self._lock:
+            self._tries[version].insert(prefix, length, value)
+
+    def lookup(self, ip):
+        """
+        Returns the most specific known network which covers ip.
+        :param ip: IP address
+        :type ip: str
+        :return: (cidr, value) or None
+        :rtype: tuple
+        """
+        version, address = _address_to_int(ip)
+        found = self._tries[version].lookup(address)
+        if found is None:
+            return None
+        prefix, length, value = found
+        return '%s/%d' % (_int_to_address(version, prefix), length), value
+
+
+def _open_dump(path):
+    return gzip.open(path) if path.endswith('.gz') else open(path)
+
+
+def load_prefix_dump(index, path):
+    """
+    Loads offline prefix to ASN dump into the index.
+    Supports 'prefix/length asn' lines and CAIDA pfx2as 'prefix<TAB>length<TAB>asn' lines,
+    empty lines and lines starting with '#' are skipped.
+    :param index: index to fill
+    :type index: CIDRIndex
+    :param path: path to the dump, may be gzipped
+    :type path: str
+    :return: count of loaded prefixes
+    :rtype: int
+    """
+    values = {}
+    count = 0
+    with _open_dump(path) as dump:
+        for line in dump:
+            parts = line.split()
+            if not parts or parts[0].startswith(b'#'):
+                continue
+            if len(parts) >= 3 and b'/' not in parts[0]:
+                cidr, asn = b'%s/%s' % (parts[0], parts[1]), parts[2]
+            elif len(parts) >= 2:
+                cidr, asn = parts[0], parts[1]
+            else:
+                continue
+            asn = force_text(asn)
+            value = values.setdefault(asn, (asn, None, None))
+            try:
+                index.add(cidr, value)
+            except (ValueError, socket.error):
+                continue
+            count += 1
+    return count
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns per-process CIDR index. It is filled from settings.CIDR_INDEX_DUMP on first use if set.
+    :return: index
+    :rtype: CIDRIndex
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = CIDRIndex()
+                dump = getattr(settings, 'CIDR_INDEX_DUMP', None)
+                if dump:
+                    load_prefix_dump(index, dump)
+                _index = index
+    return _index
+
+
+def get_attribution(ip):
+    """
+    Returns attribution of already known network which covers ip without any network I/O.
+    :param ip: IP address
+    :type ip: str
+    :return: dict with cidr, asn, name and description or None
+    :rtype: dict or None
+    """
+    try:
+        found = get_index().lookup(ip)
+    except (ValueError, socket.error):
+        return None
+    if found is None:
+        return None
+    cidr, (asn, name, description) = found
+    return {'cidr': cidr, 'asn': asn, 'name': name, 'description': description}
@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import Queue
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class Pending(object):
+    """
+    Marker for tasks which were not completed before the deadline.
+    """
+
+    def __repr__(self):
+        return '<Pending>'
+
+
+PENDING = Pending()
+
+
+def is_gevent_patched():
+    """
+    Returns True if the process runs with gevent monkey patching (see configs/wsgi_async.py).
+    :return: True or False
+    :rtype: bool
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def _create_pool(name, min_size):
+    if is_gevent_patched():
+        # greenlets are cheap, so pools are unbounded unless a size is configured, upstreams which need
+        # a limit have their own semaphore (see whois.py)
+        size = getattr(settings, 'TOOLS_GEVENT_POOL_SIZES', {}).get(name)
+        if size is None:
+            from gevent.pool import Group
+            return Group()
+        from gevent.pool import Pool
+        return Pool(max(size, min_size))
+    return ThreadPool(max(getattr(settings, 'TOOLS_POOL_SIZES', {}).get(name, 32), min_size))
+
+
+def _wait(task, timeout):
+    # ThreadPool returns AsyncResult, gevent pool returns Greenlet
+    if hasattr(task, 'wait'):
+        task.wait(timeout)
+    else:
+        task.join(timeout)
+
+
+def get_pool(name='default', min_size=0):
+    """
+    Returns per-process worker pool with specified name.
+    Pools are created lazily and re-created after fork, so they are safe to use under uWSGI workers.
+    Under gevent the pool runs greenlets instead of threads and is unbounded by default, so one process
+    can hold thousands of lookups in flight.
+    :param name: pool name, size is taken from settings.TOOLS_POOL_SIZES (32 by default) or
+        settings.TOOLS_GEVENT_POOL_SIZES under gevent
+    :type name: str
+    :param min_size: minimal size of the pool, used when the pool is created
+    :type min_size: int
+    :return: worker pool
+    :rtype: multiprocessing.pool.ThreadPool, gevent.pool.Group or gevent.pool.Pool
+    """
+    pid = os.getpid()
+    pool = _pools.get(name)
+    if pool is not None and pool[0] == pid:
+        return pool[1]
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None or pool[0] != pid:
+            pool = (pid, _create_pool(name, min_size))
+            _pools[name] = pool
+    return pool[1]
+
+
+def map_with_deadline(func, items, timeout, pool_name='default', pool_size=0):
+    """
+    Runs func for every item concurrently and waits for them until the overall deadline.
+    Tasks which missed the deadline keep running in the pool, so func should limit its own blocking calls.
+    :param func: callable which accepts one item
+    :param items: iterable with items
+    :param timeout: overall deadline in seconds
+    :type timeout: float
+    :param pool_name: name of the pool to run tasks on
+    :type pool_name: str
+    :param pool_size: minimal size of the pool, see get_pool
+    :type pool_size: int
+    :return: list of (item, result, error) in the order of items, result is PENDING for timed out items
+    :rtype: list
+    """
+    pool = get_pool(pool_name, pool_size)
+    deadline = time.time() + timeout
+    tasks = [(item, pool.apply_async(func, (item,))) for item in items]
+    results = []
+    for item, task in tasks:
+        _wait(task, max(deadline - time.time(), 0))
+        if not task.ready():
+            results.append((item, PENDING, None))
+            continue
+        try:
+            results.append((item, task.get(0), None))
+        except Exception as error:
+            results.append((item, None, error))
+    return results
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def first_result(func, items, timeout, pool_name='default'):
+    """
+    Runs func for every item concurrently and returns the first result which was returned without an error.
+    Remaining tasks are left to finish in the background.
+    :param func: callable which accepts one item
+    :param items: iterable with items
+    :param timeout: overall deadline in seconds
+    :type timeout: float
+    :param pool_name: name of the pool to run tasks on
+    :type pool_name: str
+    :return: result of the first successful call
+    :raises DeadlineExceeded: if no call succeeded before the deadline, the last error is raised if all calls failed
+    """
+    pool = get_pool(pool_name)
+    results = Queue.Queue()
+
+    def run(item):
+        try:
+            results.put((func(item), None))
+        except Exception as error:
+            results.put((None, error))
+
+    count = 0
+    for item in items:
+        pool.apply_async(run, (item,))
+        count += 1
+    deadline = time.time() + timeout
+    error = None
+    for _ in range(count):
+        try:
+            result, error = results.get(timeout=max(deadline - time.time(), 0))
+        except Queue.Empty:
+            raise DeadlineExceeded()
+        if error is None:
+            return result
+    if error is not None:
+        raise error
+    raise DeadlineExceeded()
@@ -0,0 +1,165 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+import dns.exception
+import dns.resolver
+import dns.reversename
+from django.conf import settings
+
+from .concurrency import PENDING, map_with_deadline
+from .dnscache import cached_query
+
+BLACK_LISTS = [
+    'b.barracudacentral.org', 'bl.spamcannibal.org', 'bl.spamcop.net', 'blacklist.woody.ch', 'cbl.abuseat.org',
+    'cdl.anti-spam.org.cn', 'combined.abuse.ch', 'combined.rbl.msrbl.net', 'db.wpbl.info',
+    'dnsbl-1.uceprotect.net', 'dnsbl-2.uceprotect.net', 'dnsbl-3.uceprotect.net', 'dnsbl.cyberlogic.net',
+    'dnsbl.sorbs.net', 'drone.abuse.ch', 'duinv.aupads.org', 'dul.dnsbl.sorbs.net', 'dul.ru',
+    'dyna.spamrats.com', 'dynip.rothen.com', 'http.dnsbl.sorbs.net', 'images.rbl.msrbl.net',
+    'ips.backscatterer.org', 'ix.dnsbl.manitu.net', 'korea.services.net', 'misc.dnsbl.sorbs.net',
+    'noptr.spamrats.com', 'ohps.dnsbl.net.au', 'omrs.dnsbl.net.au', 'orvedb.aupads.org', 'osps.dnsbl.net.au',
+    'osrs.dnsbl.net.au', 'owfs.dnsbl.net.au', 'pbl.spamhaus.org', 'phishing.rbl.msrbl.net', 'probes.dnsbl.net.au',
+    'proxy.bl.gweep.ca', 'rbl.interserver.net', 'rdts.dnsbl.net.au', 'relays.bl.gweep.ca', 'relays.nether.net',
+    'residential.block.transip.nl', 'ricn.dnsbl.net.au', 'rmst.dnsbl.net.au', 'smtp.dnsbl.sorbs.net',
+    'socks.dnsbl.sorbs.net', 'spam.abuse.ch', 'spam.dnsbl.sorbs.net', 'spam.rbl.msrbl.net', 'spam.spamrats.com',
+    'spamrbl.imp.ch', 't3direct.dnsbl.net.au', 'tor.dnsbl.sectoor.de', 'torserver.tor.dnsbl.sectoor.de',
+    'ubl.lashback.com', 'ubl.unsubscore.com', 'virus.rbl.jp', 'virus.rbl.msrbl.net', 'web.dnsbl.sorbs.net',
+    'wormrbl.imp.ch', 'xbl.spamhaus.org', 'zen.spamhaus.org', 'zombie.dnsbl.sorbs.net', 'virbl.dnsbl.bit.nl',
+    'dnsbl.inps.de'
+]
+
+# statuses of a single black list check
+LISTED = 'listed'
+NOT_LISTED = 'not_listed'
+NO_ANSWER = 'no_answer'
+UNKNOWN = 'unknown'
+
+_IS_PRESENT = {
+    LISTED: True,
+    NOT_LISTED: False,
+    NO_ANSWER: None,
+    UNKNOWN: None,
+}
+
+_sweep_slots = None
+_sweep_slots_lock = threading.Lock()
+
+
+def reverse_ip(ip):
+    """
+    Returns reversed IP address as it is used in DNSBL queries: 4.3.2.1 for 1.2.3.4, nibbles for IPv6.
+    :param ip: IP address
+    :type ip: str
+    :return: reversed address without arpa suffix
+    :rtype: str
+    """
+    name = dns.reversename.from_address(ip)
+    if name.is_subdomain(dns.reversename.ipv4_reverse_domain):
+        return name.relativize(dns.reversename.ipv4_reverse_domain).to_text()
+    return name.relativize(dns.reversename.ipv6_reverse_domain).to_text()
+
+
+def _make_result(ip, black_list, status, reason=None):
+    return {'ip': ip, 'address': black_list, 'is_present': _IS_PRESENT[status], 'status': status, 'reason': reason}
+
+
+def _make_resolver(nameservers, port, timeout):
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = nameservers
+    resolver.port = port
+    resolver.lifetime = timeout
+    resolver.timeout = min(resolver.timeout, timeout)
+    return resolver
+
+
+def _check_black_list(default, ip, reversed_ip, black_list, deadline):
+    """
+    Checks single black list zone. TXT record is fetched only for listed addresses.
+    Every query is limited by the time left to the deadline, so late checks do not hold pool threads.
+    """
+    query = '%s.%s' % (reversed_ip, black_list)
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return _make_result(ip, black_list, UNKNOWN)
+    try:
+        cached_query(query, 'A', _make_resolver(default.nameservers, default.port, remaining))
+    except dns.resolver.NXDOMAIN:
+        return _make_result(ip, black_list, NOT_LISTED)
+    except (dns.resolver.NoAnswer, dns.resolver.NoNameservers):
+        return _make_result(ip, black_list, NO_ANSWER)
+    except dns.exception.Timeout:
+        return _make_result(ip, black_list, UNKNOWN)
+
+    remaining = deadline - time.time()
+    reason = None
+    if remaining > 0:
+        try:
+            reason = ' '.join(txt.to_text().strip('"') for txt in cached_query(
+                query, 'TXT', _make_resolver(default.nameservers, default.port, remaining)))
+        except dns.exception.DNSException:
+            pass
+    return _make_result(ip, black_list, LISTED, reason)
+
+
+def _get_sweep_slots(count):
+    """
+    Returns per-process semaphore which limits the number of sweeps running on the 'dnsbl' pool.
+    """
+    global _sweep_slots
+    pid = os.getpid()
+    slots = _sweep_slots
+    if slots is not None and slots[0] == pid:
+        return slots[1]
+    with _sweep_slots_lock:
+        if _sweep_slots is None or _sweep_slots[0] != pid:
+            _sweep_slots = (pid, threading.BoundedSemaphore(count))
+    return _sweep_slots[1]
+
+
+def check_black_lists(ip, black_lists=None, timeout=None):
+    """
+    Queries all black list zones concurrently under one overall deadline.
+    Zones which did not answer in time or failed with an unexpected error are returned with 'unknown' status.
+    The pool has a thread for every zone of settings.DNSBL_CONCURRENT_SWEEPS sweeps (4 by default), further
+    sweeps wait for a running one to finish before the deadline starts, so their checks are never queued
+    behind other sweeps and reported as 'unknown' without being sent.
+    :param ip: IP address
+    :type ip: str
+    :param black_lists: list of DNSBL zones, BLACK_LISTS by default
+    :type black_lists: list
+    :param timeout: overall deadline in seconds, settings.DNSBL_TIMEOUT by default
+    :type timeout: float
+    :return: list with a result for every zone
+    :rtype: list
+    """
+    black_lists = black_lists or BLACK_LISTS
+    timeout = timeout or getattr(settings, 'DNSBL_TIMEOUT', 5)
+    reversed_ip = reverse_ip(ip)
+    sweeps = getattr(settings, 'DNSBL_CONCURRENT_SWEEPS', 4)
+
+    # the system configuration is read once by the default resolver, not on every check
+    default = dns.resolver.get_default_resolver()
+    slots = _get_sweep_slots(sweeps)
+    slots.acquire()
+    deadline = time.time() + timeout
+    # the slot is released by the last check, checks which missed the deadline still hold pool threads
+    left = [len(black_lists)]
+    left_lock = threading.Lock()
+
+    def check(black_list):
+        try:
+            return _check_black_list(default, ip, reversed_ip, black_list, deadline)
+        finally:
+            with left_lock:
+                left[0] -= 1
+                if not left[0]:
+                    slots.release()
+
+    results = map_with_deadline(check, black_lists, timeout, pool_name='dnsbl',
+                                pool_size=sweeps * max(len(BLACK_LISTS), len(black_lists)))
+    return [
+        _make_result(ip, black_list, UNKNOWN) if result is PENDING or error is not None else result
+        for black_list, result, error in results
+    ]
@@ -0,0 +1,261 @@
+from __future__ import unicode_literals
+
+import socket
+import ssl
+import time
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+from django.conf import settings
+from django.core.cache import caches
+
+from .caching import get_cache_stats, note_ttl
+from .concurrency import PENDING, map_with_deadline
+from .dnspipeline import query_many
+
+# kinds of cached entries
+ANSWER = 'answer'
+NXDOMAIN = 'nxdomain'
+NO_ANSWER = 'noanswer'
+# EDNS buffer size which avoids IP fragmentation of UDP responses (DNS flag day 2020)
+EDNS_PAYLOAD = 1232
+
+stats = get_cache_stats('dns')
+
+
+class CachedAnswer(object):
+    """
+    Answer restored from the cache. Behaves like dns.resolver.Answer for iteration and rrset access.
+    """
+
+    def __init__(self, rrset, ttl):
+        self.rrset = rrset
+        self.ttl = ttl
+
+    def __iter__(self):
+        return iter(self.rrset)
+
+    def __len__(self):
+        return len(self.rrset)
+
+    def __getitem__(self, index):
+        return self.rrset[index]
+
+
+def _get_cache():
+    return caches[getattr(settings, 'DNS_CACHE_ALIAS', 'default')]
+
+
+def _make_cache_key(qname, rdtype):
+    return 'dns:%s:%s' % (qname.to_text().lower(), dns.rdatatype.to_text(rdtype))
+
+
+def _clamp_ttl(ttl, negative=False):
+    if negative:
+        return min(ttl, getattr(settings, 'DNS_CACHE_MAX_NEGATIVE_TTL', 3 * 60 * 60))
+    return min(ttl, getattr(settings, 'DNS_CACHE_MAX_TTL', 24 * 60 * 60))
+
+
+def _negative_ttl(responses):
+    """
+    Returns TTL of a negative answer according to RFC 2308: minimum of SOA TTL and SOA MINIMUM field.
+    :param responses: DNS responses
+    :type responses: list
+    :return: TTL in seconds
+    :rtype: int
+    """
+    ttls = [
+        min(rrset.ttl, rrset[0].minimum)
+        for response in responses if response is not None
+        for rrset in response.authority if rrset.rdtype == dns.rdatatype.SOA
+    ]
+    if ttls:
+        return _clamp_ttl(min(ttls), negative=True)
+    return getattr(settings, 'DNS_CACHE_NEGATIVE_TTL', 5 * 60)
+
+
+def _store(cache, key, entry, ttl):
+    if ttl > 0:
+        cache.set(key, entry, ttl)
+
+
+def _negative(error, ttl):
+    # negative answers are raised, so their remaining TTL is attached to the exception
+    error.ttl = ttl
+    return error
+
+
+def _restore(entry):
+    kind, name, rdatas, expires = entry
+    ttl = max(int(expires - time.time()), 0)
+    note_ttl(ttl)
+    if kind == NXDOMAIN:
+        raise _negative(dns.resolver.NXDOMAIN(), ttl)
+    if kind == NO_ANSWER:
+        raise _negative(dns.resolver.NoAnswer(), ttl)
+    rdtype, texts = rdatas
+    rrset = dns.rrset.from_text_list(name, ttl, dns.rdataclass.IN, rdtype, texts)
+    return CachedAnswer(rrset, ttl)
+
+
+def cached_query(qname, rdtype, resolver=None):
+    """
+    Resolves qname through the shared DNS cache.
+    Positive answers are cached for their TTL, NXDOMAIN and NoAnswer are cached according to RFC 2308
+    and raised again on every cache hit with the remaining TTL in their ttl attribute. Other errors are never cached.
+    :param qname: domain name
+    :type qname: str or dns.name.Name
+    :param rdtype: record type, like 'MX' or dns.rdatatype.MX
+    :type rdtype: str or int
+    :param resolver: resolver to use on cache miss, default resolver by default
+    :type resolver: dns.resolver.Resolver
+    :return: iterable answer with rrset and ttl attributes
+    :rtype: CachedAnswer
+    """
+    if not isinstance(qname, dns.name.Name):
+        qname = dns.name.from_text(qname)
+    if not isinstance(rdtype, int):
+        rdtype = dns.rdatatype.from_text(rdtype)
+    cache = _get_cache()
+    key = _make_cache_key(qname, rdtype)
+
+    entry = cache.get(key)
+    if entry is not None:
+        stats.hit()
+        return _restore(entry)
+    stats.miss()
+
+    resolver = resolver or dns.resolver.get_default_resolver()
+    try:
+        answer = resolver.query(qname, rdtype)
+    except dns.resolver.NXDOMAIN as error:
+        ttl = _negative_ttl(error.kwargs.get('responses', {}).values())
+        note_ttl(ttl)
+        _store(cache, key, (NXDOMAIN, None, None, time.time() + ttl), ttl)
+        _negative(error, ttl)
+        raise
+    except dns.resolver.NoAnswer as error:
+        ttl = _negative_ttl([error.kwargs.get('response')])
+        note_ttl(ttl)
+        _store(cache, key, (NO_ANSWER, None, None, time.time() + ttl), ttl)
+        _negative(error, ttl)
+        raise
+
+    ttl = _clamp_ttl(answer.rrset.ttl)
+    note_ttl(ttl)
+    rdatas = (rdtype, [rdata.to_text() for rdata in answer.rrset])
+    _store(cache, key, (ANSWER, answer.rrset.name.to_text(), rdatas, time.time() + ttl), ttl)
+    return CachedAnswer(answer.rrset, ttl)
+
+
+def resolve_addresses(names, timeout=None):
+    """
+    Resolves A and AAAA records of all names concurrently through the cache.
+    :param names: domain names
+    :type names: iterable
+    :param timeout: overall deadline in seconds, settings.DNS_LOOKUP_TIMEOUT by default
+    :type timeout: float
+    :return: dict with list of IPv4 addresses followed by IPv6 addresses for every name
+    :rtype: dict
+    """
+    queries = [(name, rdtype) for name in set(names) for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA)]
+    results = map_with_deadline(lambda query: cached_query(*query), queries,
+                                timeout or getattr(settings, 'DNS_LOOKUP_TIMEOUT', 5), pool_name='dns')
+    addresses = dict((name, []) for name, rdtype in queries)
+    for (name, rdtype), answer, error in results:
+        if answer is not PENDING and error is None:
+            # answers are resolved in pool threads, so their TTLs are noted here
+            note_ttl(answer.ttl)
+            addresses[name].extend(rdata.address for rdata in answer)
+    return addresses
+
+
+def _parse_response(qname, rdtype, response):
+    """
+    Returns cache entry and TTL for the response of a recursive resolver, CNAME chains are followed.
+    """
+    name = qname
+    ttl = None
+    for _ in range(16):
+        rrset = response.get_rrset(response.answer, name, dns.rdataclass.IN, rdtype)
+        if rrset is not None:
+            ttl = _clamp_ttl(min(rrset.ttl, ttl) if ttl is not None else rrset.ttl)
+            rdatas = (rdtype, [rdata.to_text() for rdata in rrset])
+            return (ANSWER, rrset.name.to_text(), rdatas, time.time() + ttl), ttl
+        cname = response.get_rrset(response.answer, name, dns.rdataclass.IN, dns.rdatatype.CNAME)
+        if cname is None:
+            break
+        ttl = min(cname.ttl, ttl) if ttl is not None else cname.ttl
+        name = cname[0].target
+    if response.rcode() == dns.rcode.NXDOMAIN:
+        ttl = _negative_ttl([response])
+        return (NXDOMAIN, None, None, time.time() + ttl), ttl
+    if response.rcode() == dns.rcode.NOERROR:
+        ttl = _negative_ttl([response])
+        return (NO_ANSWER, None, None, time.time() + ttl), ttl
+    return None, None
+
+
+def cached_query_many(queries, timeout=None):
+    """
+    Resolves many queries through the shared DNS cache, all cache misses are sent to the resolver at once
+    (see dnspipeline.query_many), so the whole batch costs about one round trip.
+    :param queries: list of (qname, rdtype)
+    :type queries: list
+    :param timeout: overall deadline in seconds, settings.DNS_PIPELINE_TIMEOUT by default
+    :type timeout: float
+    :return: answer or exception (NXDOMAIN, NoAnswer, Timeout or DNSException) for every query in the same order,
+        answers and negative answers have the remaining TTL in their ttl attribute
+    :rtype: list
+    """
+    cache = _get_cache()
+    queries = [(qname if isinstance(qname, dns.name.Name) else dns.name.from_text(qname),
+                rdtype if isinstance(rdtype, int) else dns.rdatatype.from_text(rdtype))
+               for qname, rdtype in queries]
+    keys = [_make_cache_key(qname, rdtype) for qname, rdtype in queries]
+    cached = cache.get_many(keys)
+
+    def restore(entry):
+        try:
+            return _restore(entry)
+        except dns.exception.DNSException as error:
+            return error
+
+    results = [None] * len(queries)
+    missed = []
+    for index, key in enumerate(keys):
+        if key in cached:
+            stats.hit()
+            results[index] = restore(cached[key])
+        else:
+            stats.miss()
+            missed.append(index)
+
+    requests = [dns.message.make_query(*queries[index]) for index in missed]
+    for request in requests:
+        request.use_edns(0, 0, EDNS_PAYLOAD)
+    try:
+        responses = query_many(requests, timeout)
+    except (socket.error, ssl.SSLError, dns.exception.DNSException) as error:
+        responses = [None] * len(requests)
+        failure = error
+    else:
+        failure = dns.exception.Timeout()
+    for index, response in zip(missed, responses):
+        if response is None:
+            results[index] = failure
+            continue
+        entry, ttl = _parse_response(queries[index][0], queries[index][1], response)
+        if entry is None:
+            results[index] = dns.exception.DNSException(
+                '%s answered %s' % (queries[index][0], dns.rcode.to_text(response.rcode())))
+            continue
+        _store(cache, keys[index], entry, ttl)
+        results[index] = restore(entry)
+    return results
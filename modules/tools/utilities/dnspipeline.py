@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import random
+import select
+import socket
+import ssl
+import struct
+import time
+
+import dns.exception
+import dns.flags
+import dns.inet
+import dns.message
+import dns.resolver
+from django.conf import settings
+
+UDP = 'udp'
+TCP = 'tcp'
+TLS = 'tls'
+DEFAULT_PORTS = {
+    UDP: 53,
+    TCP: 53,
+    TLS: 853,
+}
+# ids are the only protection of UDP queries against spoofed responses, so they must not be predictable
+_random = random.SystemRandom()
+
+
+def get_resolver():
+    """
+    Returns address, port and transport of the resolver for pipelined queries.
+    settings.DNS_PIPELINE_RESOLVER is the first nameserver of the system resolver by default,
+    settings.DNS_PIPELINE_TRANSPORT is one of 'udp' (default), 'tcp' or 'tls' (DNS over TLS).
+    :return: address, port and transport
+    :rtype: tuple
+    """
+    transport = getattr(settings, 'DNS_PIPELINE_TRANSPORT', UDP)
+    address = getattr(settings, 'DNS_PIPELINE_RESOLVER', None) or dns.resolver.get_default_resolver().nameservers[0]
+    port = getattr(settings, 'DNS_PIPELINE_PORT', None) or DEFAULT_PORTS[transport]
+    return address, port, transport
+
+
+def _assign_ids(requests):
+    # responses are matched to requests by id, so ids must be unique within one batch
+    ids = _random.sample(xrange(65536), len(requests))
+    for request, request_id in zip(requests, ids):
+        request.id = request_id
+
+
+def _accept(pending, requests, responses, wire):
+    try:
+        response = dns.message.from_wire(wire)
+    except dns.exception.DNSException:
+        return
+    index = pending.get(response.id)
+    if index is not None and requests[index].is_response(response):
+        responses[index] = response
+        del pending[response.id]
+
+
+def _query_udp(requests, address, port, deadline):
+    """
+    Sends all requests through one UDP socket and collects responses until the deadline.
+    """
+    pending = dict((request.id, index) for index, request in enumerate(requests))
+    responses = [None] * len(requests)
+    sock = socket.socket(dns.inet.af_for_address(address), socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(0)
+        for request in requests:
+            sock.sendto(request.to_wire(), (address, port))
+        while pending:
+            timeout = deadline - time.time()
+            if timeout <= 0 or not select.select([sock], [], [], timeout)[0]:
+                break
+            wire, source = sock.recvfrom(65535)
+            if source[0] == address and source[1] == port:
+                _accept(pending, requests, responses, wire)
+    finally:
+        sock.close()
+    return responses
+
+
+def _read(sock, size, deadline):
+    data = b''
+    while len(data) < size:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            raise dns.exception.Timeout()
+        sock.settimeout(timeout)
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def _query_stream(requests, address, port, deadline, tls=False):
+    """
+    Writes all requests into one TCP or TLS connection and reads responses in any order (RFC 7766 pipelining).
+    """
+    pending = dict((request.id, index) for index, request in enumerate(requests))
+    responses = [None] * len(requests)
+    sock = socket.create_connection((address, port), max(deadline - time.time(), 0))
+    try:
+        if tls:
+            hostname = getattr(settings, 'DNS_PIPELINE_TLS_HOSTNAME', None)
+            context = ssl.create_default_context()
+            if hostname is None:
+                # opportunistic privacy profile of RFC 7858, the server is not authenticated
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            sock = context.wrap_socket(sock, server_hostname=hostname)
+        sock.sendall(b''.join(struct.pack('!H', len(wire)) + wire
+                              for wire in (request.to_wire() for request in requests)))
+        while pending:
+            try:
+                length, = struct.unpack('!H', _read(sock, 2, deadline))
+                _accept(pending, requests, responses, _read(sock, length, deadline))
+            except (dns.exception.Timeout, socket.timeout, EOFError):
+                break
+    finally:
+        sock.close()
+    return responses
+
+
+def query_many(requests, timeout=None):
+    """
+    Sends all requests to the resolver at once and returns responses in the order of requests.
+    Over UDP all requests share one socket and truncated responses are repeated over one TCP connection,
+    over TCP and TLS requests are pipelined in one connection. Ids of requests are replaced.
+    :param requests: DNS requests
+    :type requests: list of dns.message.Message
+    :param timeout: overall deadline in seconds, settings.DNS_PIPELINE_TIMEOUT by default
+    :type timeout: float
+    :return: responses, None for requests without complete response before the deadline
+    :rtype: list
+    """
+    if not requests:
+        return []
+    address, port, transport = get_resolver()
+    deadline = time.time() + (timeout or getattr(settings, 'DNS_PIPELINE_TIMEOUT', 3))
+    _assign_ids(requests)
+    if transport == UDP:
+        responses = _query_udp(requests, address, port, deadline)
+        truncated = [index for index, response in enumerate(responses)
+                     if response is not None and response.flags & dns.flags.TC]
+        if truncated:
+            try:
+                retried = _query_stream([requests[index] for index in truncated], address, port, deadline)
+            except (socket.error, ssl.SSLError):
+                retried = [None] * len(truncated)
+            # truncated responses are incomplete, they are dropped if they are not repeated over TCP
+            for index, response in zip(truncated, retried):
+                responses[index] = response
+    else:
+        responses = _query_stream(requests, address, port, deadline, tls=transport == TLS)
+    return [None if response is not None and response.flags & dns.flags.TC else response
+            for response in responses]
@@ -0,0 +1,409 @@
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import string
+import time
+
+import dns.dnssec
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_text
+
+from .caching import get_cache_stats
+from .concurrency import DeadlineExceeded, first_result
+from .dnscache import cached_query, resolve_addresses
+
+# results of validation
+SECURE = 'secure'
+INSECURE = 'insecure'
+BOGUS = 'bogus'
+INDETERMINATE = 'indeterminate'
+
+# DS record of the root KSK-2017
+ROOT_TRUST_ANCHORS = (
+    '20326 8 2 E06D44B80B8F1D39A95C0B0D7C65D08458E880409BBC683457104237C7F8EC8D',
+)
+# algorithms which dnspython is able to verify, zones signed only with other algorithms are treated as insecure
+SUPPORTED_ALGORITHMS = (
+    dns.dnssec.RSAMD5, dns.dnssec.DSA, dns.dnssec.RSASHA1, dns.dnssec.DSANSEC3SHA1, dns.dnssec.RSASHA1NSEC3SHA1,
+    dns.dnssec.RSASHA256, dns.dnssec.RSASHA512,
+) + ((dns.dnssec.ECDSAP256SHA256, dns.dnssec.ECDSAP384SHA384) if dns.dnssec._have_ecdsa else ())
+DIGEST_TYPES = {
+    1: 'SHA1',
+    2: 'SHA256',
+}
+# marker of a delegation without DS records in the cache
+NO_DS = 'nods'
+# NSEC3 hashes are written in base32 with the extended hex alphabet, which keeps the order of hashes
+_BASE32HEX = string.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567', b'0123456789ABCDEFGHIJKLMNOPQRSTUV')
+NSEC3_SHA1 = 1
+NSEC3_OPT_OUT = 1
+
+stats = get_cache_stats('dnssec')
+
+
+class ValidationError(Exception):
+    """
+    Stops the walk of the chain of trust with specified status.
+    """
+
+    def __init__(self, status, reason):
+        super(ValidationError, self).__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+def _get_cache():
+    return caches[getattr(settings, 'DNSSEC_CACHE_ALIAS', 'default')]
+
+
+def _get_servers(zone):
+    """
+    Returns addresses of authoritative servers of the zone, one address for every server.
+    """
+    names = [rdata.target for rdata in cached_query(zone, 'NS')]
+    addresses = resolve_addresses(names)
+    servers = [addresses[name][0] for name in names if addresses[name]]
+    return servers[:getattr(settings, 'DNSSEC_MAX_SERVERS', 4)]
+
+
+def _query_server(request, server, timeout):
+    port = getattr(settings, 'DNSSEC_QUERY_PORT', 53)
+    response = dns.query.udp(request, server, timeout, port)
+    if response.flags & dns.flags.TC:
+        response = dns.query.tcp(request, server, timeout, port)
+    if response.rcode() not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+        raise dns.exception.DNSException('%s answered %s' % (server, dns.rcode.to_text(response.rcode())))
+    return response
+
+
+def _query(zone, qname, rdtype):
+    """
+    Queries all authoritative servers of the zone at once and returns the first answer,
+    truncated UDP answers are repeated over TCP.
+    """
+    try:
+        servers = _get_servers(zone)
+    except dns.exception.DNSException as error:
+        raise ValidationError(INDETERMINATE, 'Could not find servers of %s: %s' % (zone, force_text(error)))
+    if not servers:
+        raise ValidationError(INDETERMINATE, 'Could not find servers of %s' % zone)
+
+    timeout = getattr(settings, 'DNSSEC_QUERY_TIMEOUT', 3)
+    request = dns.message.make_query(qname, rdtype, want_dnssec=True)
+    request.use_edns(0, dns.flags.DO, 4096)
+    try:
+        return first_result(lambda server: _query_server(request, server, timeout), servers, timeout, pool_name='dns')
+    except DeadlineExceeded:
+        raise ValidationError(INDETERMINATE, 'Servers of %s did not answer %s %s' % (
+            zone, qname, dns.rdatatype.to_text(rdtype)))
+    except (dns.exception.DNSException, EnvironmentError) as error:
+        raise ValidationError(INDETERMINATE, force_text(error))
+
+
+def _find(section, name, rdtype, covers=dns.rdatatype.NONE):
+    for rrset in section:
+        if rrset.name == name and rrset.rdtype == rdtype and rrset.covers == covers:
+            return rrset
+    return None
+
+
+def _validate(rrset, rrsigs, zone, keys):
+    """
+    Checks that rrset is signed by one of keys of the zone.
+    """
+    if rrsigs is None:
+        raise ValidationError(BOGUS, '%s %s is not signed' % (rrset.name, dns.rdatatype.to_text(rrset.rdtype)))
+    try:
+        dns.dnssec.validate(rrset, rrsigs, {zone: keys})
+    except dns.dnssec.ValidationFailure as error:
+        raise ValidationError(BOGUS, '%s %s: %s' % (rrset.name, dns.rdatatype.to_text(rrset.rdtype), error))
+
+
+def _get_ttl(rrset, rrsigs):
+    """
+    Returns time for which validated rrset can be cached: its TTL, but not longer than its signatures are valid.
+    """
+    expiration = min(rrsig.expiration for rrsig in rrsigs) if rrsigs else time.time()
+    return max(min(rrset.ttl, int(expiration - time.time())), 0)
+
+
+def _store(key, rrset, ttl):
+    if ttl > 0:
+        value = NO_DS if rrset is None else (rrset.name.to_text(), [rdata.to_text() for rdata in rrset])
+        _get_cache().set(key, value, ttl)
+
+
+def _restore(key, rdtype):
+    value = _get_cache().get(key)
+    if value is None or value == NO_DS:
+        return value
+    name, texts = value
+    return dns.rrset.from_text_list(name, 0, dns.rdataclass.IN, rdtype, texts)
+
+
+def _get_trusted_keys(zone, keys, ds_rrset):
+    """
+    Returns keys of the zone which match DS records of its parent.
+    """
+    trusted = []
+    for ds in ds_rrset:
+        if ds.digest_type not in DIGEST_TYPES:
+            continue
+        for key in keys:
+            if key.algorithm != ds.algorithm or dns.dnssec.key_id(key) != ds.key_tag:
+                continue
+            if dns.dnssec.make_ds(zone, key, DIGEST_TYPES[ds.digest_type]).digest == ds.digest:
+                trusted.append(key)
+    return trusted
+
+
+def get_zone_keys(zone, ds_rrset):
+    """
+    Returns DNSKEY records of the zone validated against DS records of its parent.
+    Validated keys are cached for their TTL.
+    :param zone: zone name
+    :type zone: dns.name.Name
+    :param ds_rrset: validated DS records of the zone, trust anchors for the root zone
+    :type ds_rrset: dns.rrset.RRset
+    :return: DNSKEY records
+    :rtype: dns.rrset.RRset
+    :raises ValidationError: if keys could not be fetched or validated
+    """
+    key = 'dnssec:dnskey:%s' % zone.to_text().lower()
+    keys = _restore(key, dns.rdatatype.DNSKEY)
+    if keys is not None:
+        stats.hit()
+        return keys
+    stats.miss()
+
+    response = _query(zone, zone, dns.rdatatype.DNSKEY)
+    keys = _find(response.answer, zone, dns.rdatatype.DNSKEY)
+    if keys is None:
+        raise ValidationError(BOGUS, 'No DNSKEY records found for %s' % zone)
+    trusted = _get_trusted_keys(zone, keys, ds_rrset)
+    if not trusted:
+        raise ValidationError(BOGUS, 'No DNSKEY of %s matches its DS records' % zone)
+    rrsigs = _find(response.answer, zone, dns.rdatatype.RRSIG, dns.rdatatype.DNSKEY)
+    trusted_rrset = dns.rrset.RRset(zone, dns.rdataclass.IN, dns.rdatatype.DNSKEY)
+    for rdata in trusted:
+        trusted_rrset.add(rdata)
+    _validate(keys, rrsigs, zone, trusted_rrset)
+    _store(key, keys, _get_ttl(keys, rrsigs))
+    return keys
+
+
+def _has_type(windows, rdtype):
+    """
+    Returns True if the type bitmap of NSEC or NSEC3 record contains rdtype.
+    """
+    window, offset = divmod(rdtype, 256)
+    for number, bitmap in windows:
+        if number == window:
+            bitmap = bytearray(bitmap)
+            return offset // 8 < len(bitmap) and bool(bitmap[offset // 8] & (0x80 >> offset % 8))
+    return False
+
+
+def _covers(owner, name, next_name):
+    # the last record of the zone covers names after it, its next name is the first one
+    if owner < next_name:
+        return owner < name < next_name
+    return name > owner or name < next_name
+
+
+def nsec3_hash(name, salt, iterations):
+    """
+    Returns NSEC3 hash of the name (RFC 5155) as it is used in owner names of NSEC3 records.
+    :param name: domain name
+    :type name: dns.name.Name
+    :param salt: salt of the zone
+    :type salt: bytes
+    :param iterations: count of additional iterations
+    :type iterations: int
+    :return: base32hex hash in upper case
+    :rtype: str
+    """
+    digest = hashlib.sha1(name.canonicalize().to_wire() + salt).digest()
+    for _ in range(iterations):
+        digest = hashlib.sha1(digest + salt).digest()
+    return base64.b32encode(digest).translate(_BASE32HEX).decode('ascii')
+
+
+def _proves_no_ds_by_nsec(zone, rrsets):
+    """
+    Checks NSEC records: one of them matches the zone and has no DS and SOA in its bitmap,
+    SOA would mean that it is a record of the child zone, or covers the zone, so it does not exist.
+    """
+    for rrset in rrsets:
+        for rdata in rrset:
+            if rrset.name == zone:
+                if not _has_type(rdata.windows, dns.rdatatype.DS) and \
+                        not _has_type(rdata.windows, dns.rdatatype.SOA):
+                    return True
+            elif _covers(rrset.name, zone, rdata.next):
+                return True
+    return False
+
+
+def _proves_no_ds_by_nsec3(parent, zone, rrsets):
+    """
+    Checks NSEC3 records: one of them matches hash of the zone and has no DS and SOA in its bitmap,
+    or the closest encloser of the zone is proven and the record which covers the next closer name
+    has the Opt-Out flag (RFC 5155 8.6).
+    """
+    records = [
+        (rrset.name.labels[0].decode('ascii').upper(), rdata) for rrset in rrsets for rdata in rrset
+        if rdata.algorithm == NSEC3_SHA1 and rrset.name.parent() == parent
+    ]
+
+    def find(name, match):
+        for owner, rdata in records:
+            hashed = nsec3_hash(name, rdata.salt, rdata.iterations)
+            next_hash = base64.b32encode(rdata.next).translate(_BASE32HEX).decode('ascii')
+            if (owner == hashed) == match and (match or _covers(owner, hashed, next_hash)):
+                return rdata
+        return None
+
+    matching = find(zone, True)
+    if matching is not None:
+        return not _has_type(matching.windows, dns.rdatatype.DS) and \
+            not _has_type(matching.windows, dns.rdatatype.SOA)
+    # the zone is below the parent, so the closest encloser is found at the latest at the parent
+    next_closer = zone
+    while find(next_closer.parent(), True) is None:
+        if next_closer.parent() == parent:
+            return False
+        next_closer = next_closer.parent()
+    covering = find(next_closer, False)
+    return covering is not None and bool(covering.flags & NSEC3_OPT_OUT)
+
+
+def get_delegation(parent, parent_keys, zone):
+    """
+    Returns DS records of the zone validated with keys of its parent or None if the delegation is insecure.
+    :param parent: parent zone name
+    :type parent: dns.name.Name
+    :param parent_keys: validated keys of the parent zone
+    :type parent_keys: dns.rrset.RRset
+    :param zone: zone name
+    :type zone: dns.name.Name
+    :return: DS records
+    :rtype: dns.rrset.RRset
+    :raises ValidationError: if DS records could not be fetched or validated
+    """
+    key = 'dnssec:ds:%s' % zone.to_text().lower()
+    ds_rrset = _restore(key, dns.rdatatype.DS)
+    if ds_rrset is not None:
+        stats.hit()
+        return None if ds_rrset == NO_DS else ds_rrset
+    stats.miss()
+
+    response = _query(parent, zone, dns.rdatatype.DS)
+    ds_rrset = _find(response.answer, zone, dns.rdatatype.DS)
+    if ds_rrset is not None:
+        rrsigs = _find(response.answer, zone, dns.rdatatype.RRSIG, dns.rdatatype.DS)
+        _validate(ds_rrset, rrsigs, parent, parent_keys)
+        _store(key, ds_rrset, _get_ttl(ds_rrset, rrsigs))
+        return ds_rrset
+
+    # absence of DS records must be proven by signed NSEC or NSEC3 records of the parent, which match
+    # or cover the zone, records of other names could be replayed from another response
+    proofs = [rrset for rrset in response.authority
+              if rrset.rdtype in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3)]
+    ttls = []
+    for proof in proofs:
+        rrsigs = _find(response.authority, proof.name, dns.rdatatype.RRSIG, proof.rdtype)
+        _validate(proof, rrsigs, parent, parent_keys)
+        ttls.append(_get_ttl(proof, rrsigs))
+    nsec = [proof for proof in proofs if proof.rdtype == dns.rdatatype.NSEC]
+    nsec3 = [proof for proof in proofs if proof.rdtype == dns.rdatatype.NSEC3]
+    if not _proves_no_ds_by_nsec(zone, nsec) and not _proves_no_ds_by_nsec3(parent, zone, nsec3):
+        raise ValidationError(BOGUS, 'Absence of DS records of %s is not proven' % zone)
+    _store(key, None, min(ttls))
+    return None
+
+
+def get_zones(domain):
+    """
+    Returns zones from the root to the zone of the domain.
+    :param domain: domain name
+    :type domain: dns.name.Name
+    :return: list of zone names
+    :rtype: list
+    :raises ValidationError: if the domain does not exist
+    """
+    zones = [dns.name.root]
+    for depth in range(2, len(domain.labels) + 1):
+        name = domain.split(depth)[1]
+        try:
+            answer = cached_query(name, dns.rdatatype.NS)
+        except dns.resolver.NXDOMAIN:
+            raise ValidationError(INDETERMINATE, '%s does not exist' % name)
+        except dns.resolver.NoAnswer:
+            continue
+        except dns.exception.DNSException as error:
+            raise ValidationError(INDETERMINATE, force_text(error) or 'Could not resolve NS of %s' % name)
+        if answer.rrset.name == name:
+            zones.append(name)
+    return zones
+
+
+def _describe_keys(keys):
+    return [
+        {'key_tag': dns.dnssec.key_id(key), 'algorithm': dns.dnssec.algorithm_to_text(key.algorithm),
+         'flags': key.flags}
+        for key in keys
+    ]
+
+
+def validate_domain(domain):
+    """
+    Walks the chain of trust from the root trust anchors to the zone of the domain.
+    Every zone is asked for its DNSKEY records and its parent is asked for DS records, validated keys and
+    delegations are cached, so domains under the same TLD are validated with a few queries.
+    :param domain: domain name
+    :type domain: str
+    :return: dict with status (secure, insecure, bogus or indeterminate), reason and list of checked zones
+    :rtype: dict
+    """
+    name = dns.name.from_text(domain)
+    result = {'domain': name.to_text(), 'status': SECURE, 'reason': None, 'chain': []}
+    anchors = getattr(settings, 'DNSSEC_TRUST_ANCHORS', ROOT_TRUST_ANCHORS)
+    ds_rrset = dns.rrset.from_text_list(dns.name.root, 0, dns.rdataclass.IN, dns.rdatatype.DS, anchors)
+    try:
+        zones = get_zones(name)
+        parent = parent_keys = None
+        for zone in zones:
+            if parent is not None:
+                ds_rrset = get_delegation(parent, parent_keys, zone)
+                if ds_rrset is None:
+                    raise ValidationError(INSECURE, '%s is not signed, its parent %s has no DS records for it' % (
+                        zone, parent))
+            if not any(ds.algorithm in SUPPORTED_ALGORITHMS for ds in ds_rrset):
+                raise ValidationError(INSECURE, '%s is signed with unsupported algorithm' % zone)
+            keys = get_zone_keys(zone, ds_rrset)
+            result['chain'].append({
+                'zone': zone.to_text(),
+                'ds': [ds.to_text() for ds in ds_rrset],
+                'keys': _describe_keys(keys),
+            })
+            parent, parent_keys = zone, keys
+    except ValidationError as error:
+        result['status'] = error.status
+        result['reason'] = error.reason
+    except NotImplementedError as error:
+        result['status'] = INDETERMINATE
+        result['reason'] = force_text(error)
+    return result
@@ -0,0 +1,201 @@
+from __future__ import unicode_literals
+
+import re
+from collections import OrderedDict
+from email.utils import getaddresses, mktime_tz, parsedate_tz
+
+import ipaddress
+from django.conf import settings
+from django.utils.encoding import force_text
+
+from .concurrency import PENDING, map_with_deadline
+from .dnsbl import check_black_lists
+from .geoip import get_city
+from .metrics import upstream
+
+HEADERS_ORDER = {
+    'date': 1,
+    'from': 2,
+    'to': 3,
+    'subject': 4,
+    'return-path': 5,
+    'delivered-to': 6,
+    'in-reply-to': 7,
+    'message-id': 8,
+    'mime-version': 9,
+    'received': 10,
+    'x-mailer': 11
+}
+# headers with email addresses which domains are collected
+ADDRESS_HEADERS = ('from', 'to', 'cc', 'reply-to', 'sender', 'return-path', 'delivered-to', 'message-id')
+
+HEADER_NAME_RE = re.compile(r'^[!-9;-~]+$')
+# clauses of the Received header, RFC 5321 section 4.4
+CLAUSE_RE = re.compile(r'(?:^|\s)(from|by|via|with|id|for)\s+([^\s;()]+)', re.I)
+COMMENT_RE = re.compile(r'\([^()]*\)')
+ADDRESS_RE = re.compile(r'\[(?:IPv6:)?([0-9A-Fa-f:.]+)\]|\b((?:\d{1,3}\.){3}\d{1,3})\b')
+DOMAIN_RE = re.compile(r'^(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z][a-z0-9-]*[a-z0-9]$', re.I)
+
+
+def iter_headers(text):
+    """
+    Yields headers of the message in one pass, folded lines are unfolded.
+    Headers end at the first empty line after them, lines which are not headers are skipped.
+    :param text: message headers
+    :type text: str
+    :return: generator of (name, value)
+    :rtype: generator
+    """
+    name = None
+    parts = []
+    started = False
+    for line in text.splitlines():
+        if not line.strip():
+            if started:
+                break
+            continue
+        if line[0] in ' \t':
+            if name is not None:
+                parts.append(line.strip())
+            continue
+        if name is not None:
+            yield name, ' '.join(parts)
+        name, separator, value = line.partition(':')
+        if not separator or not HEADER_NAME_RE.match(name):
+            name = None
+            continue
+        started = True
+        parts = [value.strip()]
+    if name is not None:
+        yield name, ' '.join(parts)
+
+
+def _parse_address(text):
+    try:
+        return ipaddress.ip_address(force_text(text))
+    except ValueError:
+        return None
+
+
+def _parse_domain(text):
+    text = text.strip('[]<>.').lower()
+    # longer names are not valid and are not matched to keep parsing linear
+    if len(text) <= 253 and DOMAIN_RE.match(text) and _parse_address(text) is None:
+        return text
+    return None
+
+
+def parse_received(value):
+    """
+    Parses Received header.
+    :param value: header value
+    :type value: str
+    :return: dict with from, by, with, ip and timestamp of the hop
+    :rtype: dict
+    """
+    body, separator, date = value.rpartition(';')
+    if not separator:
+        body, date = value, ''
+    clauses = {}
+    for match in CLAUSE_RE.finditer(body):
+        clauses.setdefault(match.group(1).lower(), match)
+
+    # connecting address is in the comment of the from clause, like "from helo (mx.example.com [192.0.2.1])",
+    # the helo name itself may be an address literal as well, hops without from clause have no connecting address
+    ip = None
+    comments = []
+    if 'from' in clauses:
+        start = clauses['from'].start()
+        end = clauses['by'].start() if 'by' in clauses and clauses['by'].start() > start else len(body)
+        comments = [(match.start(), match.end()) for match in COMMENT_RE.finditer(body, start, end)] + [(start, end)]
+    for comment_start, comment_end in comments:
+        for match in ADDRESS_RE.finditer(body, comment_start, comment_end):
+            ip = _parse_address(match.group(1) or match.group(2))
+            if ip is not None:
+                break
+        if ip is not None:
+            break
+
+    parsed_date = parsedate_tz(date.strip()) if date.strip() else None
+    return {
+        'from': clauses['from'].group(2) if 'from' in clauses else None,
+        'by': clauses['by'].group(2) if 'by' in clauses else None,
+        'with': clauses['with'].group(2) if 'with' in clauses else None,
+        'ip': ip.compressed if ip is not None else None,
+        'public': ip is not None and ip.is_global,
+        'date': date.strip() or None,
+        'timestamp': mktime_tz(parsed_date) if parsed_date else None,
+    }
+
+
+def _enrich(ip):
+    info = {'location': get_city(ip), 'black_lists': None}
+    if ipaddress.ip_address(ip).version == 4:
+        info['black_lists'] = [result['address'] for result in check_black_lists(ip) if result['is_present']]
+    return info
+
+
+def analyze_headers(text, enrich=False):
+    """
+    Parses email headers in one pass and extracts the chain of Received hops with delays between them,
+    IP addresses and domain names.
+    :param text: message headers
+    :type text: str
+    :param enrich: look up location and DNSBL listings of public hop addresses concurrently,
+        every address is looked up once under settings.EMAIL_ENRICH_TIMEOUT deadline
+    :type enrich: bool
+    :return: dict with headers, hops, ips, domains and total delay in seconds
+    :rtype: dict
+    """
+    headers = []
+    received = []
+    ips = []
+    domains = []
+    for name, value in iter_headers(force_text(text)):
+        key = name.lower()
+        headers.append({'key': name, 'value': value, 'order': HEADERS_ORDER.get(key) or 100})
+        if key == 'received':
+            received.append(value)
+        elif key in ADDRESS_HEADERS:
+            for _, address in getaddresses([value]):
+                domain = _parse_domain(address.rpartition('@')[2]) if '@' in address else None
+                if domain:
+                    domains.append(domain)
+
+    # the topmost Received header is added by the last hop
+    hops = [parse_received(value) for value in reversed(received)]
+    previous = None
+    for index, hop in enumerate(hops, 1):
+        hop['index'] = index
+        hop['delay'] = None
+        if hop['timestamp'] is not None:
+            if previous is not None:
+                hop['delay'] = hop['timestamp'] - previous
+            previous = hop['timestamp']
+        if hop['ip']:
+            ips.append(hop['ip'])
+        for host in (hop['from'], hop['by']):
+            domain = _parse_domain(host) if host else None
+            if domain:
+                domains.append(domain)
+
+    timestamps = [hop['timestamp'] for hop in hops if hop['timestamp'] is not None]
+    result = {
+        'headers': headers,
+        'hops': hops,
+        'ips': list(OrderedDict.fromkeys(ips)),
+        'domains': list(OrderedDict.fromkeys(domains)),
+        'total_delay': timestamps[-1] - timestamps[0] if len(timestamps) > 1 else None,
+    }
+    if enrich:
+        public = list(OrderedDict.fromkeys(hop['ip'] for hop in hops if hop['public']))
+        enriched = {}
+        with upstream('enrich'):
+            results = map_with_deadline(_enrich, public, getattr(settings, 'EMAIL_ENRICH_TIMEOUT', 5),
+                                        pool_name='email')
+        for ip, info, error in results:
+            if info is not PENDING and error is None:
+                enriched[ip] = info
+        for hop in hops:
+            hop.update(enriched.get(hop['ip']) or {'location': None, 'black_lists': None})
+    return result
@@ -0,0 +1,88 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.gis.geoip2 import GeoIP2
+from geoip2.errors import AddressNotFoundError
+from maxminddb import MODE_MMAP
+
+from .caching import LRUCache
+
+_MISSING = object()
+
+
+class GeoIPReader(object):
+    """
+    Per-process GeoIP2 reader.
+    The database is opened once in mmap mode and reopened only when its files change on disk,
+    recent IP -> city results are kept in a bounded LRU.
+    """
+
+    def __init__(self):
+        self._geoip = None
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._cities = LRUCache(getattr(settings, 'GEOIP_CACHE_SIZE', 4096), name='geoip')
+
+    def _get_mtime(self):
+        path = settings.GEOIP_PATH
+        files = [
+            os.path.join(path, getattr(settings, 'GEOIP_CITY', 'GeoLite2-City.mmdb')),
+            os.path.join(path, getattr(settings, 'GEOIP_COUNTRY', 'GeoLite2-Country.mmdb')),
+        ]
+        return max([os.path.getmtime(name) for name in files if os.path.isfile(name)] or [None])
+
+    def get_geoip(self):
+        """
+        Returns opened GeoIP2 instance, reopens it if database files were changed.
+        Files are checked at most once per settings.GEOIP_RELOAD_INTERVAL seconds.
+        :return: GeoIP2 instance
+        :rtype: django.contrib.gis.geoip2.GeoIP2
+        """
+        now = time.time()
+        if self._geoip is None or now - self._checked_at > getattr(settings, 'GEOIP_RELOAD_INTERVAL', 60):
+            with self._lock:
+                self._checked_at = now
+                mtime = self._get_mtime()
+                if self._geoip is None or mtime != self._mtime:
+                    # the old reader is closed by GeoIP2.__del__ once no thread uses it anymore
+                    self._geoip = GeoIP2(cache=MODE_MMAP)
+                    self._mtime = mtime
+                    self._cities.clear()
+        return self._geoip
+
+    def city(self, ip):
+        """
+        Returns city information for specified IP address.
+        :param ip: IP address
+        :type ip: str
+        :return: city information or None if the address is not in the database
+        :rtype: dict or None
+        """
+        geoip = self.get_geoip()
+        location = self._cities.get(ip, _MISSING)
+        if location is _MISSING:
+            try:
+                location = geoip.city(ip)
+            except AddressNotFoundError:
+                location = None
+            self._cities.set(ip, location)
+        return location
+
+
+reader = GeoIPReader()
+
+
+def get_city(ip):
+    """
+    Returns city information for specified IP address using per-process reader.
+    :param ip: IP address
+    :type ip: str
+    :return: city information or None if the address is not in the database
+    :rtype: dict or None
+    """
+    return reader.city(ip)
@@ -6,7 +6,9 @@ import base64
 import datetime
 import hashlib
 import json
+import os
 import re
+import threading
 import time
 import urllib
 import urllib2
@@ -215,31 +217,141 @@ def url_decode(value, key=None):
     # return "".join(dec)
 
 
-def send_queue_message(connection, queue_name, message):
-    channel = connection.channel()
-    channel.queue_declare(queue=queue_name, durable=True)
-    channel.basic_publish(exchange="", routing_key=queue_name, body=message,
-                          properties=pika.BasicProperties(delivery_mode=2))
-    return True
+class ChannelPool(object):
+    """
+    Per-process RabbitMQ connection shared by all publishers.
+    Single messages go through a channel with publisher confirms, batches through a transactional
+    channel, so a batch costs one round trip. The connection is opened lazily, re-opened after
+    it is lost or the process is forked, and every queue is declared once per connection.
+    """
+
+    def __init__(self, parameters=None, retries=1):
+        self.parameters = parameters
+        self.retries = retries
+        self._lock = threading.RLock()
+        self._pid = None
+        self._connection = None
+        self._channels = {}
+        self._declared = set()
+
+    def _get_parameters(self):
+        return self.parameters or pika.ConnectionParameters(**settings.RABBITMQ_CONFIG["connect"])
+
+    def _reset(self):
+        # connection inherited from the parent process is dropped without closing the shared socket
+        if self._connection is not None and self._pid == os.getpid() and self._connection.is_open:
+            try:
+                self._connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+        self._connection = None
+        self._channels = {}
+        self._declared = set()
+
+    def _get_channel(self, kind):
+        if self._connection is None or self._pid != os.getpid() or not self._connection.is_open:
+            self._reset()
+            self._connection = pika.BlockingConnection(self._get_parameters())
+            self._pid = os.getpid()
+        channel = self._channels.get(kind)
+        if channel is None or not channel.is_open:
+            channel = self._connection.channel()
+            if kind == "confirm":
+                channel.confirm_delivery()
+            else:
+                channel.tx_select()
+            self._channels[kind] = channel
+        return channel
+
+    def _declare(self, channel, queue_name):
+        if queue_name not in self._declared:
+            channel.queue_declare(queue=queue_name, durable=True)
+            self._declared.add(queue_name)
+
+    def _call(self, func, *args):
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    return func(*args)
+                except (pika.exceptions.AMQPConnectionError, pika.exceptions.ChannelClosed):
+                    self._reset()
+                    if attempt == self.retries:
+                        raise
+
+    def _publish(self, queue_name, message):
+        channel = self._get_channel("confirm")
+        self._declare(channel, queue_name)
+        if channel.basic_publish(exchange="", routing_key=queue_name, body=message,
+                                 properties=pika.BasicProperties(delivery_mode=2), mandatory=True):
+            return True
+        # the queue could be deleted after it was declared
+        self._declared.discard(queue_name)
+        self._declare(channel, queue_name)
+        return channel.basic_publish(exchange="", routing_key=queue_name, body=message,
+                                     properties=pika.BasicProperties(delivery_mode=2), mandatory=True)
+
+    def _publish_many(self, queue_name, messages):
+        channel = self._get_channel("tx")
+        self._declare(channel, queue_name)
+        for message in messages:
+            channel.basic_publish(exchange="", routing_key=queue_name, body=message,
+                                  properties=pika.BasicProperties(delivery_mode=2))
+        channel.tx_commit()
+        return True
+
+    def publish(self, queue_name, message):
+        """
+        Publishes persistent message and waits for the broker confirmation
+        @param queue_name: queue name
+        @param message: message body
+        @return: True if the broker confirmed the message
+        """
+        return self._call(self._publish, queue_name, message)
+
+    def publish_many(self, queue_name, messages):
+        """
+        Publishes persistent messages in one transaction
+        @param queue_name: queue name
+        @param messages: list of message bodies
+        @return: True if the transaction was committed
+        """
+        if not messages:
+            return True
+        return self._call(self._publish_many, queue_name, messages)
+
+
+channel_pool = ChannelPool()
+
+
+def send_queue_message(queue_name, message):
+    """
+    Publishes message to the queue through the per-process channel pool
+    @param queue_name: queue name
+    @param message: message body
+    @return: True if the broker confirmed the message, False if it returned it unrouted
+    @raise pika.exceptions.AMQPError: if the broker is unreachable or the channel is closed after a retry
+    """
+    return channel_pool.publish(queue_name, message)
+
+
+def send_queue_messages(queue_name, messages):
+    """
+    Publishes list of messages to the queue in one batch
+    """
+    return channel_pool.publish_many(queue_name, messages)
 
 
 def send_controller_message(data):
+    message = json.dumps(data)
     try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(**settings.RABBITMQ_CONFIG["connect"])
-        )
-    except pika.exceptions.ConnectionClosed:
+        published = send_queue_message(settings.RABBITMQ_CONFIG[settings.CONTROLLER_QUEUE], message)
+    except pika.exceptions.AMQPError:
+        # broker is unreachable or the channel is closed even after reconnect
+        published = False
+    if not published:
         from services.models import Task
-        message = json.dumps(data)
         task = Task(data=message)
         task.save()
-    else:
-        message = json.dumps(data)
-        send_queue_message(
-            connection,
-            settings.RABBITMQ_CONFIG[settings.CONTROLLER_QUEUE],
-            message
-        )
 
 
 def recaptcha_validation(forms, request):
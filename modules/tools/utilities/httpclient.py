@@ -0,0 +1,251 @@
+from __future__ import unicode_literals
+
+import httplib
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from urlparse import urljoin, urlparse
+
+from django.conf import settings
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+}
+# bodies of GET fallbacks longer than this are not drained, the connection is closed instead
+_MAX_DRAIN = 64 * 1024
+
+
+class ConnectionPool(object):
+    """
+    Per-process pool of idle keep-alive HTTP/HTTPS connections keyed by (scheme, host, port).
+    Hosts are chosen by users, so the total count of idle connections is limited too: the least recently
+    released connection is closed when the pool is full, expired connections of all hosts are closed
+    on every release.
+    """
+
+    def __init__(self, max_idle_per_host=4, idle_timeout=30, max_idle=256):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        # idle connections in order of release, values are (key, released_at)
+        self._order = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._order)
+
+    def _remove(self, conn):
+        key, _ = self._order.pop(conn)
+        connections = self._idle[key]
+        connections.remove(conn)
+        if not connections:
+            del self._idle[key]
+
+    def acquire(self, key):
+        """
+        Returns idle connection for key or None.
+        """
+        now = time.time()
+        expired = []
+        found = None
+        with self._lock:
+            connections = self._idle.get(key)
+            while connections and found is None:
+                conn = connections[-1]
+                released_at = self._order[conn][1]
+                self._remove(conn)
+                if now - released_at < self.idle_timeout:
+                    found = conn
+                else:
+                    expired.append(conn)
+                connections = self._idle.get(key)
+        for conn in expired:
+            conn.close()
+        return found
+
+    def release(self, key, conn):
+        """
+        Returns connection to the pool.
+        """
+        now = time.time()
+        closed = []
+        with self._lock:
+            # connections are ordered by release time, so expired ones are at the beginning
+            while self._order:
+                idle = next(iter(self._order))
+                if now - self._order[idle][1] < self.idle_timeout:
+                    break
+                self._remove(idle)
+                closed.append(idle)
+            if len(self._idle.get(key) or ()) < self.max_idle_per_host:
+                self._idle.setdefault(key, []).append(conn)
+                self._order[conn] = (key, now)
+                while len(self._order) > self.max_idle:
+                    oldest = next(iter(self._order))
+                    self._remove(oldest)
+                    closed.append(oldest)
+            else:
+                closed.append(conn)
+        for conn in closed:
+            conn.close()
+
+
+_ssl_context = None
+
+
+def _get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+pool = ConnectionPool(getattr(settings, 'HTTP_POOL_MAX_IDLE_PER_HOST', 4),
+                      getattr(settings, 'HTTP_POOL_IDLE_TIMEOUT', 30),
+                      getattr(settings, 'HTTP_POOL_MAX_IDLE', 256))
+
+
+def _elapsed(started):
+    return round((time.time() - started) * 1000, 2)
+
+
+def _connect(scheme, host, port, timeout, timings):
+    """
+    Opens new connection measuring DNS, TCP connect and TLS handshake time.
+    """
+    started = time.time()
+    family, socktype, proto, _, address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+    timings['dns'] = _elapsed(started)
+
+    started = time.time()
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+        timings['connect'] = _elapsed(started)
+        if scheme == 'https':
+            started = time.time()
+            sock = _get_ssl_context().wrap_socket(sock, server_hostname=host)
+            timings['tls'] = _elapsed(started)
+    except (socket.error, ssl.CertificateError):
+        sock.close()
+        raise
+
+    conn = httplib.HTTPConnection(host, port, timeout=timeout)
+    conn.sock = sock
+    return conn
+
+
+def _request(scheme, host, port, method, path, timeout, read_body=False):
+    """
+    Sends single request over a pooled connection, a stale pooled connection is replaced once.
+    """
+    key = (scheme, host, port)
+    headers = {
+        'Host': host if port == DEFAULT_PORTS[scheme] else '%s:%d' % (host, port),
+        'User-Agent': getattr(settings, 'HTTP_PROBE_USER_AGENT', 'Mozilla/5.0 (compatible; toolset)'),
+        'Connection': 'keep-alive',
+    }
+    conn = pool.acquire(key)
+    while True:
+        timings = {'dns': 0, 'connect': 0, 'tls': 0}
+        reused = conn is not None
+        if reused:
+            conn.sock.settimeout(timeout)
+        else:
+            conn = _connect(scheme, host, port, timeout, timings)
+        started = time.time()
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if not reused:
+                raise
+            conn = None
+            continue
+        timings['ttfb'] = _elapsed(started)
+        break
+
+    body = None
+    length = response.getheader('content-length')
+    if read_body or method == 'HEAD' or (length and length.isdigit() and int(length) <= _MAX_DRAIN):
+        body = response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            pool.release(key, conn)
+    else:
+        conn.close()
+    result = {
+        'method': method,
+        'status': response.status,
+        'reason': response.reason,
+        'headers': dict(response.getheaders()),
+        'timings': timings,
+        'reused': reused,
+    }
+    if read_body:
+        result['body'] = body
+    return result
+
+
+def _split_url(url):
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower() or 'http'
+    if scheme not in DEFAULT_PORTS or not parsed.hostname:
+        raise ValueError('Unsupported url: %s' % url)
+    port = parsed.port or DEFAULT_PORTS[scheme]
+    path = (parsed.path or '/') + ('?' + parsed.query if parsed.query else '')
+    return scheme, parsed.hostname, port, path
+
+
+def fetch(url, timeout=None):
+    """
+    Requests url with GET over a pooled keep-alive connection, redirects are not followed.
+    :param url: url with http or https scheme
+    :type url: str
+    :param timeout: socket timeout in seconds, settings.HTTP_PROBE_TIMEOUT by default
+    :type timeout: float
+    :return: status code and response body
+    :rtype: tuple
+    """
+    scheme, host, port, path = _split_url(url)
+    response = _request(scheme, host, port, 'GET', path, timeout or getattr(settings, 'HTTP_PROBE_TIMEOUT', 5),
+                        read_body=True)
+    return response['status'], response['body']
+
+
+def probe(url, max_redirects=None, timeout=None):
+    """
+    Requests url with HEAD (falling back to GET if HEAD is not allowed) and follows redirects.
+    :param url: url with http or https scheme
+    :type url: str
+    :param max_redirects: maximum count of followed redirects, settings.HTTP_PROBE_MAX_REDIRECTS by default
+    :type max_redirects: int
+    :param timeout: socket timeout in seconds, settings.HTTP_PROBE_TIMEOUT by default
+    :type timeout: float
+    :return: list of hops with url, status, headers and dns/connect/tls/ttfb timings in milliseconds
+    :rtype: list
+    """
+    if max_redirects is None:
+        max_redirects = getattr(settings, 'HTTP_PROBE_MAX_REDIRECTS', 5)
+    timeout = timeout or getattr(settings, 'HTTP_PROBE_TIMEOUT', 5)
+    hops = []
+    while True:
+        scheme, host, port, path = _split_url(url)
+        hop = _request(scheme, host, port, 'HEAD', path, timeout)
+        if hop['status'] in (405, 501):
+            hop = _request(scheme, host, port, 'GET', path, timeout)
+        hop['url'] = url
+        hops.append(hop)
+
+        location = hop['headers'].get('location')
+        if hop['status'] not in REDIRECT_STATUSES or not location or len(hops) > max_redirects:
+            return hops
+        url = urljoin(url, location)
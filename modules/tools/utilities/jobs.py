@@ -0,0 +1,188 @@
+from __future__ import unicode_literals
+
+import json
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_text
+
+from .concurrency import get_pool
+from .helpers import send_queue_message
+
+# statuses of jobs
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _get_cache():
+    return caches[getattr(settings, 'JOBS_CACHE_ALIAS', 'default')]
+
+
+def _make_cache_key(job_id):
+    return 'job:%s' % job_id
+
+
+def _save(job):
+    _get_cache().set(_make_cache_key(job['id']), job, getattr(settings, 'JOBS_RESULT_TTL', 60 * 60))
+
+
+def get_job(job_id):
+    """
+    Returns job with status, result and error or None if job is unknown or expired.
+    :param job_id: job id
+    :type job_id: str
+    :return: job
+    :rtype: dict
+    """
+    return _get_cache().get(_make_cache_key(job_id))
+
+
+def parse_message(message):
+    """
+    Returns job id, tool and target of the queued message.
+    :param message: JSON message with job id, tool and target
+    :type message: str
+    :return: message data
+    :rtype: dict
+    :raises ValueError: if the message is malformed or its tool is unknown
+    """
+    from ..utils import TOOLS
+
+    data = json.loads(message)
+    if not isinstance(data, dict) or not all(isinstance(data.get(key), basestring) for key in ('id', 'tool', 'target')):
+        raise ValueError('Expected JSON object with id, tool and target')
+    if data['tool'] not in TOOLS:
+        raise ValueError('Unknown tool %s' % data['tool'])
+    return data
+
+
+def execute(message):
+    """
+    Runs the tool of the queued job and stores its result.
+    :param message: JSON message with job id, tool and target
+    :type message: str
+    :return: finished job
+    :rtype: dict
+    :raises ValueError: if the message is malformed, see parse_message
+    """
+    from ..utils import TOOLS
+
+    data = parse_message(message)
+    job = get_job(data['id']) or dict(data, status=QUEUED, result=None, error=None, created=int(time.time()))
+    job['status'] = RUNNING
+    _save(job)
+    try:
+        job['result'] = TOOLS[job['tool']](job['target'])
+    except Exception as error:
+        job['status'] = FAILED
+        job['error'] = force_text(error)
+    else:
+        job['status'] = DONE
+    job['finished'] = int(time.time())
+    _save(job)
+    return job
+
+
+class MemoryBackend(object):
+    """
+    Runs jobs on the 'jobs' pool of the current process, does not need a broker or a worker.
+    With several processes (uWSGI runs 5) settings.JOBS_CACHE_ALIAS must be shared by them, like memcached,
+    otherwise status requests served by other processes do not find the job, see check_jobs_cache.
+    """
+
+    def publish(self, message):
+        get_pool('jobs').apply_async(execute, (message,))
+
+
+class PikaBackend(object):
+    """
+    Publishes jobs to the settings.JOBS_QUEUE queue of RabbitMQ, they are executed by `manage.py run_job_worker`.
+    Jobs are stored in the settings.JOBS_CACHE_ALIAS cache, it must be shared by web and worker processes,
+    like memcached, otherwise web processes never see the results.
+    """
+
+    def __init__(self):
+        check_shared_cache()
+
+    def publish(self, message):
+        if not send_queue_message(get_queue_name(), message):
+            raise IOError('RabbitMQ did not confirm the job')
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'pika': PikaBackend,
+}
+
+
+def check_shared_cache():
+    """
+    Raises ImproperlyConfigured if jobs are stored in a local memory cache, which is not seen by other processes.
+    """
+    if isinstance(_get_cache(), LocMemCache):
+        raise ImproperlyConfigured('JOBS_BACKEND "pika" needs a cache shared by web and worker processes, '
+                                   'JOBS_CACHE_ALIAS "%s" is a local memory cache'
+                                   % getattr(settings, 'JOBS_CACHE_ALIAS', 'default'))
+
+
+def check_jobs_cache(app_configs, **kwargs):
+    """
+    Deployment check (manage.py check --deploy) which warns that jobs stored in a local memory cache
+    are not found by status requests served by other processes.
+    """
+    if isinstance(_get_cache(), LocMemCache):
+        return [checks.Warning(
+            'JOBS_CACHE_ALIAS is a local memory cache, status of jobs is only found by the process which '
+            'queued them.',
+            hint='Use a cache shared by all processes, like memcached, or run a single process.',
+            id='tools.W001',
+        )]
+    return []
+
+
+def get_queue_name():
+    return getattr(settings, 'JOBS_QUEUE', 'tools.jobs')
+
+
+def get_backend():
+    """
+    Returns job backend configured by settings.JOBS_BACKEND: 'memory' (default) or 'pika'.
+    """
+    return BACKENDS[getattr(settings, 'JOBS_BACKEND', 'memory')]()
+
+
+def enqueue(tool, target):
+    """
+    Queues lookup of target by the tool, the job is failed right away if it could not be queued.
+    :param tool: tool name, one of keys of utils.TOOLS
+    :type tool: str
+    :param target: domain name, IP address or email headers
+    :type target: str
+    :return: queued job
+    :rtype: dict
+    """
+    job = {
+        'id': uuid4().hex,
+        'tool': tool,
+        'target': target,
+        'status': QUEUED,
+        'result': None,
+        'error': None,
+        'created': int(time.time()),
+    }
+    _save(job)
+    try:
+        get_backend().publish(json.dumps({'id': job['id'], 'tool': tool, 'target': target}))
+    except Exception as error:
+        job['status'] = FAILED
+        job['error'] = 'Could not queue the job: %s' % force_text(error)
+        job['finished'] = int(time.time())
+        _save(job)
+    return job
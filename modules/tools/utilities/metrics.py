@@ -0,0 +1,308 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .caching import get_all_cache_stats, track_lookups
+
+# default buckets of Prometheus client libraries, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_metrics = []
+_local = threading.local()
+_published = [0]
+_publish_lock = threading.Lock()
+WORKERS_KEY = 'metrics:workers'
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape('%s' % value)) for name, value in zip(names, values))
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else '%d' % value
+
+
+class Counter(object):
+    """
+    Counter with labels, it is counted per process and summed over workers by render().
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    @staticmethod
+    def merge(series, other):
+        for labels, value in other.items():
+            series[labels] = series.get(labels, 0) + value
+
+    def collect(self, series):
+        for labels, value in sorted(series.items()):
+            yield '%s%s %s' % (self.name, _format_labels(self.labels, labels), _format_value(value))
+
+
+class Histogram(object):
+    """
+    Histogram with labels and fixed buckets, an observation costs one bisect and one lock.
+    It is counted per process and summed over workers by render().
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, labels, value):
+        # buckets are inclusive, the last counter is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict((labels, [list(counts), total]) for labels, (counts, total) in self._series.items())
+
+    @staticmethod
+    def merge(series, other):
+        for labels, (counts, total) in other.items():
+            current = series.get(labels)
+            if current is None:
+                series[labels] = [list(counts), total]
+            else:
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+
+    def collect(self, series):
+        names = self.labels + ('le',)
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '%s_bucket%s %d' % (self.name, _format_labels(names, labels + (bound,)), cumulative)
+            yield '%s_sum%s %r' % (self.name, _format_labels(self.labels, labels), total)
+            yield '%s_count%s %d' % (self.name, _format_labels(self.labels, labels), cumulative)
+
+
+request_duration = Histogram('toolset_request_duration_seconds', 'Time to response headers by view and status.',
+                             ('view', 'method', 'status'))
+tool_duration = Histogram('toolset_tool_duration_seconds', 'Duration of tool lookups.', ('tool',))
+tool_failures = Counter('toolset_tool_failures_total', 'Tool lookups which returned no result.', ('tool',))
+upstream_duration = Histogram('toolset_upstream_duration_seconds', 'Duration of upstream calls by tool.',
+                              ('tool', 'upstream'))
+upstream_errors = Counter('toolset_upstream_errors_total', 'Upstream calls which raised an exception.',
+                          ('tool', 'upstream', 'error'))
+coalesced_calls = Counter('toolset_coalesced_calls_total',
+                          'Tool calls which got the result of a concurrent call in the process or another worker.',
+                          ('tool', 'scope'))
+upstream_cache = Counter('toolset_upstream_cache_lookups_total', 'Cache lookups made by upstream calls.',
+                         ('tool', 'upstream', 'result'))
+
+
+def get_current_tool():
+    return getattr(_local, 'tool', None) or 'none'
+
+
+def track_tool(name):
+    """
+    Decorator which measures duration of the tool and counts lookups without result (None or False).
+    Upstream calls made by the tool in the current thread are labeled with its name.
+    :param name: tool name, the same as keys of TOOLS
+    :type name: str
+    :return: decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(_local, 'tool', None)
+            _local.tool = name
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                tool_failures.inc((name,))
+                raise
+            finally:
+                tool_duration.observe((name,), time.time() - start)
+                _local.tool = previous
+            if result is None or result is False:
+                tool_failures.inc((name,))
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def upstream(name):
+    """
+    Context manager which measures an upstream call (DNS, WHOIS, GeoIP, HTTP, ...) made by the current tool,
+    counts its exceptions and cache hits, and adds its duration to Server-Timing of the current request.
+    Example:
+        with upstream('dns'):
+            answer = cached_query(domain, 'MX')
+    :param name: upstream name
+    :type name: str
+    """
+    tool = get_current_tool()
+    start = time.time()
+    try:
+        with track_lookups() as lookups:
+            yield
+    except Exception as error:
+        upstream_errors.inc((tool, name, error.__class__.__name__))
+        raise
+    finally:
+        duration = time.time() - start
+        upstream_duration.observe((tool, name), duration)
+        if lookups[0]:
+            upstream_cache.inc((tool, name, 'hit'), lookups[0])
+        if lookups[1]:
+            upstream_cache.inc((tool, name, 'miss'), lookups[1])
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + duration
+
+
+def start_request():
+    """
+    Starts collecting upstream timings of the request handled by the current thread.
+    """
+    _local.timings = OrderedDict()
+
+
+def finish_request():
+    """
+    Stops collecting upstream timings of the current request.
+    :return: total duration of every upstream in seconds
+    :rtype: OrderedDict
+    """
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    return timings or OrderedDict()
+
+
+def _collect_caches(caches_stats):
+    for name, documentation, index in (('toolset_cache_hits_total', 'Hits of in-process and shared caches.', 0),
+                                       ('toolset_cache_misses_total', 'Misses of in-process and shared caches.', 1)):
+        yield '# HELP %s %s' % (name, documentation)
+        yield '# TYPE %s counter' % name
+        for cache, counts in sorted(caches_stats.items()):
+            yield '%s%s %d' % (name, _format_labels(('cache',), (cache,)), counts[index])
+
+
+def _get_cache():
+    return caches[getattr(settings, 'METRICS_CACHE_ALIAS', 'default')]
+
+
+def _make_worker_key(pid):
+    return 'metrics:worker:%d' % pid
+
+
+def snapshot():
+    """
+    Returns metrics of the current process.
+    :return: dict with series of every metric by name and hits and misses of every cache
+    :rtype: dict
+    """
+    return {
+        'metrics': dict((metric.name, metric.snapshot()) for metric in _metrics),
+        'caches': dict((stats['name'], (stats['hits'], stats['misses'])) for stats in get_all_cache_stats()),
+    }
+
+
+def publish(force=False):
+    """
+    Stores metrics of the current process in the cache, so that any worker can render metrics of all workers.
+    Metrics are stored at most every settings.METRICS_PUBLISH_INTERVAL seconds and are kept
+    for settings.METRICS_WORKER_TTL seconds, so counts of recycled workers are kept until they expire.
+    :param force: publish regardless of the interval
+    :type force: bool
+    """
+    now = time.time()
+    with _publish_lock:
+        if not force and now - _published[0] < getattr(settings, 'METRICS_PUBLISH_INTERVAL', 5):
+            return
+        _published[0] = now
+    pid = os.getpid()
+    cache = _get_cache()
+    cache.set(_make_worker_key(pid), snapshot(), getattr(settings, 'METRICS_WORKER_TTL', 24 * 60 * 60))
+    # the list of workers is updated without a lock, a pid lost in a race is added again by the next publish
+    workers = cache.get(WORKERS_KEY) or []
+    if pid not in workers:
+        cache.set(WORKERS_KEY, workers + [pid], None)
+
+
+def _collect_workers():
+    """
+    Returns snapshots of the current process and of other workers published in the cache.
+    """
+    pid = os.getpid()
+    cache = _get_cache()
+    workers = [worker for worker in cache.get(WORKERS_KEY) or [] if worker != pid]
+    published = cache.get_many([_make_worker_key(worker) for worker in workers])
+    alive = [worker for worker in workers if _make_worker_key(worker) in published]
+    if len(alive) < len(workers):
+        cache.set(WORKERS_KEY, alive + [pid], None)
+    return [snapshot()] + [published[_make_worker_key(worker)] for worker in alive]
+
+
+def render():
+    """
+    Returns metrics of all workers in Prometheus text format. Every worker publishes its metrics to the cache
+    (settings.METRICS_CACHE_ALIAS, it must be shared by workers, like memcached), metrics are summed over
+    the current process and all workers which published them.
+    :return: exposition text
+    :rtype: str
+    """
+    series = dict((metric.name, {}) for metric in _metrics)
+    caches_stats = {}
+    for worker in _collect_workers():
+        for metric in _metrics:
+            metric.merge(series[metric.name], worker['metrics'].get(metric.name, {}))
+        for name, (hits, misses) in worker['caches'].items():
+            counts = caches_stats.get(name, (0, 0))
+            caches_stats[name] = (counts[0] + hits, counts[1] + misses)
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend(metric.collect(series[metric.name]))
+    lines.extend(_collect_caches(caches_stats))
+    return '\n'.join(lines) + '\n'
@@ -1,18 +1,24 @@
 from __future__ import unicode_literals
 
 import hashlib
+import time
 from datetime import datetime
 
 from django.conf import settings
 from django.contrib import messages
+from django.core.urlresolvers import reverse
+from django.http import Http404
+from django.utils.cache import add_never_cache_headers, get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 from .exceptions import RateLimited
+from .results import get_result, normalize_target
 from .utils import is_rate_limited
 
 
 class RateLimitMixin(object):
     """
-    Restricts access to a view according to specified rate limit.
+    Restricts access to a view according to specified rate limit and reports usage in X-RateLimit-* headers.
     Possible time options: s - per second, m - per minute, h - per hour, d - per day.
     Example:
         class View(RateLimitMixin):
@@ -23,8 +29,13 @@ class RateLimitMixin(object):
     def dispatch(self, request, *args, **kwargs):
         if is_rate_limited(request, self.rate_limit, True):
             raise RateLimited()
-        else:
-            return super(RateLimitMixin, self).dispatch(request, *args, **kwargs)
+        response = super(RateLimitMixin, self).dispatch(request, *args, **kwargs)
+        usage = getattr(request, 'rate_limit_usage', None)
+        if usage:
+            response['X-RateLimit-Limit'] = usage['limit']
+            response['X-RateLimit-Remaining'] = max(usage['limit'] - usage['count'], 0)
+            response['X-RateLimit-Reset'] = usage['time_left']
+        return response
 
 
 class FormInvalidRenderMixin(object):
@@ -35,3 +46,69 @@ class FormInvalidRenderMixin(object):
         """
         messages.add_message(self.request, messages.ERROR, form.non_field_errors().as_text())
         return self.render_to_response(self.get_context_data())
+
+
+class ResultCacheMixin(object):
+    """
+    Caches results of a tool and serves them on GET permalinks with ETag and Last-Modified,
+    so browsers and CDN revalidate them without upstream lookups.
+    Example:
+        class View(ResultCacheMixin, FormView):
+            tool_name = 'mx-lookup'
+            target_field = 'domain'
+
+            def lookup(self, target):
+                return get_mx_lookup_tool(target)
+    Results for which is_cacheable returns False, like temporary failures, are neither cached nor revalidated.
+    Permalink url is the url named '<tool_name>-result' with target argument.
+    """
+    tool_name = None
+    target_field = None
+
+    def lookup(self, target):
+        raise NotImplementedError()
+
+    def get_result_context(self, result):
+        return {'result': result}
+
+    def is_cacheable(self, result):
+        return True
+
+    def get_initial(self):
+        initial = super(ResultCacheMixin, self).get_initial()
+        if self.kwargs.get('target'):
+            initial[self.target_field] = self.kwargs['target']
+        return initial
+
+    def render_result(self, entry):
+        context = self.get_context_data()
+        context.update(self.get_result_context(entry['result']))
+        if entry['result'] is not None:
+            context['permalink'] = reverse('%s-result' % self.tool_name, kwargs={'target': entry['target']})
+        return self.render_to_response(context)
+
+    def form_valid(self, form):
+        entry = get_result(self.tool_name, self.lookup, normalize_target(form.cleaned_data.get(self.target_field)),
+                           self.is_cacheable)
+        return self.render_result(entry)
+
+    def get(self, request, *args, **kwargs):
+        if not kwargs.get('target'):
+            return super(ResultCacheMixin, self).get(request, *args, **kwargs)
+        form = self.get_form_class()(data={self.target_field: kwargs['target']})
+        if not form.is_valid():
+            raise Http404()
+        entry = get_result(self.tool_name, self.lookup, normalize_target(form.cleaned_data.get(self.target_field)),
+                           self.is_cacheable)
+        if entry['etag'] is None:
+            response = self.render_result(entry)
+            add_never_cache_headers(response)
+            return response
+        response = get_conditional_response(request, etag=entry['etag'], last_modified=entry['created'])
+        if response is None:
+            response = self.render_result(entry)
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['created'])
+        # pages embed a CSRF token and flash messages, so only browsers may cache them
+        patch_cache_control(response, private=True, max_age=max(entry['expires'] - int(time.time()), 0))
+        return response
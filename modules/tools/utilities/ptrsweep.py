@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+import time
+from collections import deque
+
+import dns.resolver
+import dns.reversename
+from django.conf import settings
+from django.core.cache import caches
+
+from .caching import get_cache_stats
+from .dnscache import cached_query_many
+
+stats = get_cache_stats('ptr-sweep')
+
+
+def _get_cache():
+    return caches[getattr(settings, 'PTR_SWEEP_CACHE_ALIAS', 'default')]
+
+
+def _make_cache_key(network):
+    return 'ptr-sweep:%s' % network.with_prefixlen
+
+
+def _to_result(address, answer):
+    if isinstance(answer, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+        return {'ip': address, 'ptr': [], 'error': None}
+    if isinstance(answer, Exception):
+        return {'ip': address, 'ptr': [], 'error': 'Lookup failed'}
+    return {'ip': address, 'ptr': [rdata.target.to_text() for rdata in answer], 'error': None}
+
+
+def sweep(network):
+    """
+    Resolves PTR records of every address of the network and yields results as soon as they are resolved.
+    Addresses are resolved in windows of pipelined queries, the window grows while the resolver answers
+    and is halved with a growing pause after timeouts and server failures (AIMD), failed addresses are retried
+    settings.PTR_SWEEP_RETRIES times. Results of a fully resolved network are cached.
+    :param network: network to sweep
+    :type network: ipaddress.IPv4Network or ipaddress.IPv6Network
+    :return: generator of dicts with ip, list of ptr names and error
+    :rtype: generator
+    """
+    cache = _get_cache()
+    key = _make_cache_key(network)
+    results = cache.get(key)
+    if results is not None:
+        stats.hit()
+        for result in results:
+            yield result
+        return
+    stats.miss()
+
+    window = getattr(settings, 'PTR_SWEEP_WINDOW', 16)
+    max_window = getattr(settings, 'PTR_SWEEP_MAX_WINDOW', 64)
+    max_delay = getattr(settings, 'PTR_SWEEP_MAX_DELAY', 2)
+    retries = getattr(settings, 'PTR_SWEEP_RETRIES', 2)
+    ttl = getattr(settings, 'PTR_SWEEP_CACHE_TTL', 60 * 60)
+    delay = 0
+    results = []
+    pending = deque((address.compressed, 0) for address in network)
+    while pending:
+        batch = [pending.popleft() for _ in range(min(window, len(pending)))]
+        answers = cached_query_many([(dns.reversename.from_address(address), 'PTR') for address, _ in batch])
+        failed = False
+        for (address, attempts), answer in zip(batch, answers):
+            # besides DNS errors the resolver may fail with socket or SSL errors
+            if isinstance(answer, Exception) and \
+                    not isinstance(answer, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+                failed = True
+                if attempts < retries:
+                    pending.append((address, attempts + 1))
+                    continue
+            else:
+                # answers and negative answers carry their remaining TTL, the block expires with the first of them
+                ttl = min(ttl, answer.ttl)
+            result = _to_result(address, answer)
+            results.append(result)
+            yield result
+
+        if failed:
+            window = max(window // 2, 1)
+            delay = min(delay * 2 or 0.1, max_delay)
+            time.sleep(delay)
+        else:
+            window = min(window + 4, max_window)
+            delay = 0
+
+    if ttl > 0 and not any(result['error'] for result in results):
+        cache.set(key, results, ttl)
@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import time
+from urlparse import urlparse
+
+import ipaddress
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import quote_etag
+from django.utils.encoding import force_text
+
+from .caching import get_cache_stats, track_ttl
+
+stats = get_cache_stats('results')
+
+
+def _get_cache():
+    return caches[getattr(settings, 'RESULT_CACHE_ALIAS', 'default')]
+
+
+def normalize_target(target):
+    """
+    Returns normalized domain name or IP address: without scheme, path and trailing dot, lower case.
+    :param target: url, domain name or IP address
+    :type target: str
+    :return: normalized target
+    :rtype: str
+    """
+    target = force_text(target).strip()
+    target = urlparse(target).netloc or urlparse(target).path
+    try:
+        return ipaddress.ip_address(target).compressed
+    except ValueError:
+        return target.rstrip('.').lower()
+
+
+def _make_etag(result):
+    data = json.dumps(result, sort_keys=True, default=force_text)
+    return quote_etag(hashlib.md5(data.encode('utf-8')).hexdigest())
+
+
+def get_result(tool, func, target, is_cacheable=None):
+    """
+    Returns cached result of the tool for normalized target, calls func on cache miss.
+    The result is cached for the minimum TTL of upstream data it was built from (DNS TTLs, WHOIS freshness),
+    settings.RESULT_CACHE_TTL if no TTL was noted; failed lookups (None) and results rejected
+    by is_cacheable are not cached.
+    :param tool: tool name
+    :type tool: str
+    :param func: tool function
+    :type func: callable
+    :param target: normalized target
+    :type target: str
+    :param is_cacheable: callable which returns False for results which must not be cached
+    :type is_cacheable: callable
+    :return: dict with result, target, created and expires timestamps and etag, etag is None
+        for results which were not cached
+    :rtype: dict
+    """
+    cache = _get_cache()
+    key = 'result:%s:%s' % (tool, hashlib.md5(target.encode('utf-8')).hexdigest())
+    entry = cache.get(key)
+    if entry is not None:
+        stats.hit()
+        return entry
+    stats.miss()
+
+    with track_ttl() as scope:
+        result = func(target)
+    ttl = scope.ttl if scope.ttl is not None else getattr(settings, 'RESULT_CACHE_TTL', 5 * 60)
+    ttl = min(ttl, getattr(settings, 'RESULT_CACHE_MAX_TTL', 24 * 60 * 60))
+    now = int(time.time())
+    if result is None or ttl <= 0 or (is_cacheable is not None and not is_cacheable(result)):
+        return {'result': result, 'target': target, 'created': now, 'expires': now, 'etag': None}
+    entry = {'result': result, 'target': target, 'created': now, 'expires': now + ttl, 'etag': _make_etag(result)}
+    cache.set(key, entry, ttl)
+    return entry
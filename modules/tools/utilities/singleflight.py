@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_text
+
+from .caching import note_ttl, track_ttl
+from .metrics import coalesced_calls
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key into one call within the process.
+    Example:
+        flight = SingleFlight()
+        result, shared = flight.do('example.com', lookup, 'example.com')
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Calls func unless a call with the same key is already in flight, in which case waits for its result.
+        :param key: call key
+        :type key: str
+        :param func: callable to execute
+        :return: result of the call and True if it was shared with another caller
+        :rtype: tuple
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+
+_flight = SingleFlight()
+
+
+def _get_cache():
+    return caches[getattr(settings, 'SINGLEFLIGHT_CACHE_ALIAS', 'default')]
+
+
+def _call_shared(key, func, args, kwargs):
+    """
+    Calls func in one worker at a time for the key, other workers wait for the result in the shared cache
+    and contend for the lock again if it is released or expires without a result. func is called by
+    the holder of the lock, a worker which gets neither the lock nor the result in settings.SINGLEFLIGHT_WAIT
+    seconds calls func itself without the lock.
+    :return: result, its TTL and True if it was shared by another worker
+    :rtype: tuple
+    """
+    cache = _get_cache()
+    lock_key = 'singleflight:lock:%s' % key
+    result_key = 'singleflight:result:%s' % key
+    # waiting and the own call after it must end before uWSGI harakiri (20 seconds) kills the worker
+    lock_ttl = getattr(settings, 'SINGLEFLIGHT_LOCK_TTL', 15)
+    deadline = time.time() + getattr(settings, 'SINGLEFLIGHT_WAIT', 10)
+    interval = getattr(settings, 'SINGLEFLIGHT_POLL_INTERVAL', 0.05)
+    token = uuid.uuid4().hex
+
+    locked = cache.add(lock_key, token, lock_ttl)
+    while not locked:
+        time.sleep(interval)
+        owner = cache.get(lock_key)
+        shared = cache.get(result_key)
+        # the holder stores the result before it releases the lock, results of earlier calls are ignored
+        if shared is not None and (owner is None or shared[0] == owner):
+            return shared[1], shared[2], True
+        if time.time() >= deadline:
+            # the holder is stuck, callers of tools expect a result
+            break
+        # the lock was released or expired without a result
+        locked = owner is None and cache.add(lock_key, token, lock_ttl)
+
+    try:
+        with track_ttl() as scope:
+            result = func(*args, **kwargs)
+        # the result only has to outlive the waiters, caching is up to the callers
+        cache.set(result_key, (token, result, scope.ttl), getattr(settings, 'SINGLEFLIGHT_RESULT_TTL', 5))
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    return result, scope.ttl, False
+
+
+def _call_local(func, args, kwargs):
+    with track_ttl() as scope:
+        result = func(*args, **kwargs)
+    return result, scope.ttl, False
+
+
+def coalesce(name):
+    """
+    Decorator which collapses concurrent calls of the tool with the same arguments into one upstream call,
+    callers which joined a call in flight get its result. With settings.SINGLEFLIGHT_SHARED calls are
+    also collapsed across workers by a lock in the settings.SINGLEFLIGHT_CACHE_ALIAS cache, a worker waits
+    for the lock or the result at most settings.SINGLEFLIGHT_WAIT seconds and calls the tool itself after that.
+    TTLs noted by the call are noted for every caller, so shared results are cached as long as own ones.
+    Example:
+        @track_tool('mx-lookup')
+        @coalesce('mx-lookup')
+        def get_mx_lookup_tool(domain):
+            ...
+    :param name: tool name, the same as keys of TOOLS
+    :type name: str
+    :return: decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = '\0'.join([force_text(arg) for arg in args] +
+                                   ['%s=%s' % (key, force_text(kwargs[key])) for key in sorted(kwargs)])
+            key = '%s:%s' % (name, hashlib.md5(arguments.encode('utf-8')).hexdigest())
+            if getattr(settings, 'SINGLEFLIGHT_SHARED', False):
+                (result, ttl, shared_by_worker), shared = _flight.do(key, _call_shared, key, func, args, kwargs)
+            else:
+                (result, ttl, shared_by_worker), shared = _flight.do(key, _call_local, func, args, kwargs)
+            if shared:
+                coalesced_calls.inc((name, 'process'))
+            elif shared_by_worker:
+                coalesced_calls.inc((name, 'shared'))
+            if ttl is not None and (shared or shared_by_worker):
+                note_ttl(ttl)
+            return result
+        return wrapper
+    return decorator
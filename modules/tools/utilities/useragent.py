@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from ua_parser import user_agent_parser
+
+from .caching import LRUCache
+
+_MISSING = object()
+
+_cache = LRUCache(getattr(settings, 'USER_AGENT_CACHE_SIZE', 2048), name='user-agent')
+
+
+def parse_user_agent(ua):
+    """
+    Parses User-Agent header with ua_parser, results are kept in a per-process LRU keyed by the raw header,
+    hit rate is reported in the 'user-agent' cache stats.
+    Returned dict is shared between callers and must not be modified.
+    :param ua: User-Agent header
+    :type ua: str
+    :return: dict with user_agent, os, device and string or None for an empty header
+    :rtype: dict or None
+    """
+    if not ua:
+        return None
+    result = _cache.get(ua, _MISSING)
+    if result is _MISSING:
+        result = user_agent_parser.Parse(ua)
+        # very long headers are not worth the memory, they are never repeated
+        if len(ua) <= getattr(settings, 'USER_AGENT_MAX_CACHED_LENGTH', 1024):
+            _cache.set(ua, result)
+    return result
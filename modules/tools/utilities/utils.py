@@ -2,19 +2,23 @@ import base64
 import hashlib
 import httplib
 import json
+import logging
 import re
 import socket
 import time
-import urllib2
-import zlib
+from functools import wraps
 from ssl import CertificateError
 
 from django.conf import settings
 from django.core.cache import caches
 
 from . import get_ip_from_request
+from .concurrency import PENDING, map_with_deadline
+from .httpclient import fetch, probe
 from .validators import is_valid_domain_name
 
+logger = logging.getLogger(__name__)
+
 _PERIODS = {
     's': 1,
     'm': 60,
@@ -58,47 +62,60 @@ def _split_rate(rate):
     return count, seconds
 
 
-def _get_window(value, period):
+# counter of a window keeps the final count of the previous window in its high bits,
+# so checking and incrementing the usage is a single atomic incr in the steady state
+_PREVIOUS_SHIFT = 32
+_COUNT_MASK = (1 << _PREVIOUS_SHIFT) - 1
+
+# values which can be used in cache keys as is, other values are hashed
+_safe_value_re = re.compile(r'^[\w.:-]{1,64}$')
+
+
+def _get_cache():
     """
-    I don't know wtf is this but it works.
-    So it's better to not touch this until we realize wtf is going on here.
-    :param value: user pk as a string or IP address
-    :type value: str
-    :param period: time in seconds
-    :type period: int
-    :return: something
+    Returns cache which stores rate limit counters.
+    Any Django cache backend with atomic incr works: local memory, memcached or a Redis-compatible store.
     """
-    ts = int(time.time())
-    if period == 1:
-        return ts
-    if not isinstance(value, bytes):
-        value = value.encode('utf-8')
-    w = ts - (ts % period) + (zlib.crc32(value) % period)
-    if w < ts:
-        return w + period
-    return w
-
-
-def _make_cache_key(rate, value):
+    return caches[getattr(settings, 'RATE_LIMIT_CACHE', 'default')]
+
+
+def _make_cache_key(limit, period, value, window):
     """
-    Saves rate to the cache with value as ID.
-    :param rate: rate limit
-    :type rate: str or tuple
+    Returns cache key of the counter for the window.
+    :param limit: count of requests
+    :type limit: int
+    :param period: time in seconds
+    :type period: int
     :param value: user pk as a string or IP address
     :type value: str
-    :return: unique string
+    :param window: index of the window
+    :type window: int
+    :return: cache key
     :rtype: str
     """
-    count, period = _split_rate(rate)
-    safe_rate = '%d/%ds' % (count, period)
-    window = _get_window(value, period)
-    parts = [safe_rate, value, str(window)]
-    return 'rl:' + hashlib.md5(u''.join(parts).encode('utf-8')).hexdigest()
+    if not _safe_value_re.match(value):
+        value = hashlib.md5(value.encode('utf-8')).hexdigest()
+    return 'rl:%d/%ds:%s:%d' % (limit, period, value, window)
+
+
+def _start_window(cache, key, previous_key, period, initial_value):
+    """
+    Creates counter of the window seeded with the count of the previous window.
+    """
+    previous = cache.get(previous_key) or 0
+    packed = ((previous & _COUNT_MASK) << _PREVIOUS_SHIFT) + initial_value
+    if not initial_value:
+        return packed
+    # the counter lives for two windows, the next window reads it as the previous one
+    if cache.add(key, packed, 2 * period):
+        return packed
+    return cache.incr(key)
 
 
 def is_rate_limited(request, rate=None, increment=False):
     """
     Checks if rate limited for current user.
+    Current usage is saved to request.rate_limit_usage.
     :param request: Http request
     :param rate: rate limit
     :type rate: str or tuple
@@ -114,6 +131,7 @@ def is_rate_limited(request, rate=None, increment=False):
         return False
 
     usage = get_usage_count(request, rate, increment)
+    request.rate_limit_usage = usage
 
     limited = usage.get('count') > usage.get('limit')
     if increment:
@@ -124,6 +142,8 @@ def is_rate_limited(request, rate=None, increment=False):
 def get_usage_count(request, rate=None, increment=False):
     """
     Returns count of available requests, current limit and time left for this limit.
+    Count is estimated over a sliding window: requests of the previous fixed window are weighted
+    by the part of it which still overlaps the sliding window.
     :param request: Http request
     :param rate: rate limit
     :param increment: increment count of requests
@@ -131,24 +151,26 @@ def get_usage_count(request, rate=None, increment=False):
     :rtype: dict
     """
     limit, period = _split_rate(rate)
-    cache = caches['default']
+    cache = _get_cache()
     value = user_or_ip(request)
 
-    cache_key = _make_cache_key(rate, value)
-    time_left = _get_window(value, period) - int(time.time())
-    initial_value = 1 if increment else 0
-    added = cache.add(cache_key, initial_value)
-    if added:
-        count = initial_value
+    now = time.time()
+    window = int(now // period)
+    elapsed = now - window * period
+    key = _make_cache_key(limit, period, value, window)
+    if increment:
+        try:
+            packed = cache.incr(key)
+        except ValueError:
+            packed = _start_window(cache, key, _make_cache_key(limit, period, value, window - 1), period, 1)
     else:
-        if increment:
-            try:
-                count = cache.incr(cache_key)
-            except ValueError:
-                count = initial_value
-        else:
-            count = cache.get(cache_key, initial_value)
-    return {'count': count, 'limit': limit, 'time_left': time_left}
+        packed = cache.get(key)
+        if packed is None:
+            packed = _start_window(cache, key, _make_cache_key(limit, period, value, window - 1), period, 0)
+
+    previous, current = packed >> _PREVIOUS_SHIFT, packed & _COUNT_MASK
+    count = current + int(previous * (period - elapsed) / period)
+    return {'count': count, 'limit': limit, 'time_left': int(period - elapsed) + 1}
 
 
 def is_local_address(url):
@@ -203,46 +225,62 @@ def pluralize(value, arg='s'):
     return singular_suffix
 
 
+def _get_controller_servers(address, service_id):
+    """
+    Returns dict with servers of the service from one controller.
+    """
+    status, body = fetch('http://%s/services/%s/' % (address, service_id),
+                         getattr(settings, 'CONTROLLERS_TIMEOUT', 2))
+    if status != 200:
+        return {}
+    return json.loads(base64.b64decode(body))
+
+
 def get_service_servers(service_id):
     """
     Get service id
     Return list choices with servers number and countries
+    Controllers are requested concurrently over keep-alive connections, controllers which did not answer
+    in settings.CONTROLLERS_TIMEOUT seconds are skipped. The merged list is cached for
+    settings.CONTROLLERS_CACHE_TTL seconds.
     """
-    # TODO: added multicontrolles
+    cache = caches[getattr(settings, 'CONTROLLERS_CACHE_ALIAS', 'default')]
+    key = 'service-servers:%s' % service_id
+    servers = cache.get(key)
+    if servers is not None:
+        return servers
+
     servers = [(0, u'Default')]
-    for address in settings.CONTROLLERS_SERVER:
-        try:
-            conn = httplib.HTTPConnection(address)
-            conn.request("GET", "/services/{}/".format(service_id))
-            response = conn.getresponse()
-        except Exception, e:
-            pass # if has not connection with controller
-        else:
-            if response.status == 200:
-                encoded_data = response.read()
-                try:
-                    decoded_data = json.loads(base64.b64decode(encoded_data))
-                    for index, value in decoded_data.items():
-                        servers.append((index, value))
-                except ValueError:
-                    pass # if cant parse response from controller
+    answered = False
+    results = map_with_deadline(lambda address: _get_controller_servers(address, service_id),
+                                settings.CONTROLLERS_SERVER, getattr(settings, 'CONTROLLERS_TIMEOUT', 2),
+                                pool_name='http')
+    for address, decoded_data, error in results:
+        # no connection with controller or cant parse its response
+        if decoded_data is PENDING or error is not None:
+            continue
+        answered = True
+        for index, value in decoded_data.items():
+            servers.append((index, value))
+    if answered:
+        cache.set(key, servers, getattr(settings, 'CONTROLLERS_CACHE_TTL', 30))
     return servers
 
 
 def timeit(method):
     """
-    Decorator for measuring function execution.
+    Decorator for measuring function execution, durations are logged with DEBUG level.
     :param method: function of method
     :return: decorated function
     """
 
+    @wraps(method)
     def timed(*args, **kw):
         ts = time.time()
         result = method(*args, **kw)
         te = time.time()
 
-        print '%r (%r, %r) %2.2f sec' % \
-              (method.__name__, args, kw, te-ts)
+        logger.debug('%r (%r, %r) %2.2f sec', method.__name__, args, kw, te - ts)
         return result
 
     return timed
@@ -273,8 +311,8 @@ def supports_https(domain):
     """
     if is_valid_domain_name(domain):
         try:
-            urllib2.urlopen('https://' + domain)
-        except (IOError, CertificateError):
+            probe('https://' + domain, max_redirects=0)
+        except (IOError, CertificateError, httplib.HTTPException):
             return False
         else:
             return True
@@ -0,0 +1,215 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import ipaddress
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_text
+from ipwhois import IPWhois
+
+from .caching import get_cache_stats, note_ttl
+from .cidr import get_index
+from .singleflight import SingleFlight
+
+# prefix lengths which are looked up in the cache for every address, shorter networks are stored under
+# the covering network of the shortest length, longer networks are not cached
+_PREFIX_RANGES = {
+    4: (8, 32),
+    6: (16, 64),
+}
+
+# concurrent lookups for addresses within the same block of this size share one upstream call
+_FLIGHT_PREFIXES = {
+    4: 24,
+    6: 48,
+}
+
+stats = get_cache_stats('whois')
+_flight = SingleFlight()
+_semaphore = None
+_semaphore_lock = threading.Lock()
+
+
+def _get_cache():
+    return caches[getattr(settings, 'WHOIS_CACHE_ALIAS', 'default')]
+
+
+def _get_semaphore():
+    """
+    Returns semaphore which limits count of concurrent upstream lookups in the process.
+    """
+    global _semaphore
+    if _semaphore is None:
+        with _semaphore_lock:
+            if _semaphore is None:
+                _semaphore = threading.BoundedSemaphore(getattr(settings, 'WHOIS_MAX_CONCURRENCY', 4))
+    return _semaphore
+
+
+def _supernet(ip, prefixlen):
+    return ipaddress.ip_network('%s/%d' % (ip, prefixlen), strict=False)
+
+
+def _make_cache_key(method, network):
+    # entries are (info, expires), the version in the prefix skips entries of the older format
+    return 'whois:v2:%s:%s' % (method, network.with_prefixlen)
+
+
+def _get_key_network(ip, network):
+    """
+    Returns network under which the result for network is stored in the cache or None if it is not cached.
+    Networks more specific than the longest looked up prefix are not cached, the covering network
+    of that prefix would answer neighbour addresses outside of them.
+    """
+    shortest, longest = _PREFIX_RANGES[ip.version]
+    if network.prefixlen > longest:
+        return None
+    if network.prefixlen < shortest:
+        return _supernet(ip, shortest)
+    return network
+
+
+def _get_cached(method, ip):
+    """
+    Returns cached result for the longest cached network which covers ip.
+    Networks known to the CIDR index are fetched with a single key, all supernets are tried otherwise.
+    """
+    cache = _get_cache()
+    known = get_index().lookup(force_text(ip))
+    key_network = _get_key_network(ip, ipaddress.ip_network(known[0])) if known is not None else None
+    entry = cache.get(_make_cache_key(method, key_network)) if key_network is not None else None
+    if entry is None:
+        shortest, longest = _PREFIX_RANGES[ip.version]
+        keys = [_make_cache_key(method, _supernet(ip, prefixlen)) for prefixlen in range(longest, shortest - 1, -1)]
+        cached = cache.get_many(keys)
+        entry = next((cached[key] for key in keys if key in cached), None)
+        if entry is None:
+            return None
+        # the result could be fetched by another worker
+        _remember(ip, entry[0])
+    info, expires = entry
+    note_ttl(max(int(expires - time.time()), 0))
+    result = dict(info)
+    result['query'] = force_text(ip)
+    return result
+
+
+def _parse_networks(value):
+    networks = []
+    for cidr in (value or '').split(','):
+        try:
+            networks.append(ipaddress.ip_network(cidr.strip(), strict=False))
+        except ValueError:
+            pass
+    return networks
+
+
+def get_covering_network(info, ip):
+    """
+    Returns the most specific network from lookup result which covers ip.
+    Network CIDR of RDAP result or the most specific net of WHOIS result is used, asn_cidr otherwise.
+    :param info: result of IPWhois lookup
+    :type info: dict
+    :param ip: IP address
+    :type ip: ipaddress.IPv4Address or ipaddress.IPv6Address
+    :return: network and its description (RDAP network or WHOIS net) or (None, None)
+    :rtype: tuple
+    """
+    candidates = [(info.get('network') or {})] + list(info.get('nets') or [])
+    networks = [
+        (network, candidate) for candidate in candidates
+        for network in _parse_networks(candidate.get('cidr')) if ip in network
+    ]
+    if not networks:
+        networks = [(network, {}) for network in _parse_networks(info.get('asn_cidr')) if ip in network]
+    if not networks:
+        return None, None
+    return max(networks, key=lambda item: item[0].prefixlen)
+
+
+def _describe(description):
+    """
+    Returns description of WHOIS net or RDAP network: address or description of WHOIS nets,
+    the first remark of RDAP networks, name if there is nothing else.
+    """
+    remarks = [remark.get('description') for remark in description.get('remarks') or [] if remark.get('description')]
+    for value in (description.get('address'), description.get('description'), remarks[0] if remarks else None,
+                  description.get('name')):
+        if value:
+            return value
+    return ''
+
+
+def get_attribution_value(info, ip):
+    """
+    Returns the most specific network from lookup result which covers ip with its attribution.
+    The same attribution is stored in the CIDR index, so answers are the same for known and new networks.
+    :param info: result of IPWhois lookup (RDAP or WHOIS)
+    :type info: dict
+    :param ip: IP address
+    :type ip: ipaddress.IPv4Address or ipaddress.IPv6Address
+    :return: network or None and (asn, name, description)
+    :rtype: tuple
+    """
+    network, description = get_covering_network(info, ip)
+    description = description or {}
+    return network, (info.get('asn'), description.get('name'), _describe(description))
+
+
+def _remember(ip, info):
+    """
+    Adds covering network of the lookup result to the CIDR index.
+    """
+    network, value = get_attribution_value(info, ip)
+    if network is not None:
+        get_index().add(network.with_prefixlen, value)
+    return network
+
+
+def _store(method, ip, info):
+    network = _remember(ip, info)
+    ttl = getattr(settings, 'WHOIS_CACHE_TTL', 24 * 60 * 60)
+    note_ttl(ttl)
+    key_network = _get_key_network(ip, network) if network is not None else None
+    if key_network is not None:
+        _get_cache().set(_make_cache_key(method, key_network), (info, time.time() + ttl), ttl)
+
+
+def _fetch(method, ip):
+    # a lookup which has just finished could already cover this address
+    result = _get_cached(method, ip)
+    if result is not None:
+        return result
+    with _get_semaphore():
+        info = getattr(IPWhois(force_text(ip)), method)()
+    _store(method, ip, info)
+    return info
+
+
+def whois_lookup(ip, method='lookup_rdap'):
+    """
+    Returns IPWhois lookup result for specified IP address.
+    Results are cached by covering network for settings.WHOIS_CACHE_TTL seconds, so any address inside
+    an already fetched network is answered from the cache. Concurrent lookups for nearby addresses wait
+    for one upstream call, count of upstream calls in progress is limited by settings.WHOIS_MAX_CONCURRENCY.
+    :param ip: IP address
+    :type ip: str
+    :param method: IPWhois method: lookup_rdap, lookup_whois or lookup
+    :type method: str
+    :return: lookup result
+    :rtype: dict
+    """
+    ip = ipaddress.ip_address(force_text(ip))
+    flight_key = '%s:%s' % (method, _supernet(ip, _FLIGHT_PREFIXES[ip.version]))
+    while True:
+        result = _get_cached(method, ip)
+        if result is not None:
+            stats.hit()
+            return result
+        stats.miss()
+        result, shared = _flight.do(flight_key, _fetch, method, ip)
+        # the shared result could be fetched for an address from another network
+        if not shared or result.get('query') == force_text(ip):
+            return result
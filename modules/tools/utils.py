@@ -2,20 +2,32 @@ from __future__ import unicode_literals
 
 import httplib
 import os
-import re
 import socket
-from email.errors import HeaderParseError
-from email.parser import HeaderParser
+import ssl
 from urlparse import urlparse
 
 import dns
+import dns.exception
+import dns.reversename
 import geoip2
+import ipaddress
 from django.conf import settings
-from django.contrib.gis.geoip2 import GeoIP2
+from django.utils.encoding import force_text
 from geoip2.errors import AddressNotFoundError
-from ipwhois import IPWhois
 from ipwhois.utils import get_countries
 
+from .utilities.cidr import get_attribution
+from .utilities.concurrency import get_pool
+from .utilities.dnsbl import check_black_lists
+from .utilities.dnscache import cached_query, cached_query_many, resolve_addresses
+from .utilities.dnssec import SECURE, validate_domain
+from .utilities.emailheaders import analyze_headers
+from .utilities.geoip import get_city
+from .utilities.httpclient import probe
+from .utilities.metrics import track_tool, upstream
+from .utilities.singleflight import coalesce
+from .utilities.whois import get_attribution_value, whois_lookup
+
 def get_domain_name(domain):
     """
     Returns domain name by parsing passed string by means of urlparse.
@@ -27,40 +39,25 @@ def get_domain_name(domain):
     return urlparse(domain).netloc or urlparse(domain).path
 
 
-def parse_email_header(header):
+@track_tool('email-headers')
+def parse_email_header(header, enrich=False):
     """
-    Parses email headers and returns it as ordered list.
+    Parses email headers, extracts chain of Received hops, IP addresses and domain names.
     :param header: headers
     :type header: str
-    :return: parsed headers
+    :param enrich: look up location and DNSBL listings of hop addresses
+    :type enrich: bool
+    :return: True and parsed headers or False and empty dict if no headers were found
     :rtype: tuple
     """
-    headers_order = {
-        'date': 1,
-        'from': 2,
-        'to': 3,
-        'subject': 4,
-        'return-path': 5,
-        'delivered-to': 6,
-        'in-reply-to': 7,
-        'message-id': 8,
-        'mime-version': 9,
-        'received': 10,
-        'x-mailer': 11
-    }
-    try:
-        parser = HeaderParser()
-        header = header.encode('utf-8')
-        parsed_headers = parser.parsestr(header)
-        if parsed_headers:
-            return True, [{'key': header[0], 'value': header[1], 'order': headers_order.get(header[0].lower()) or 100}
-                          for header in parsed_headers.items()]
-        else:
-            return False, {}
-    except (HeaderParseError, Exception):
+    result = analyze_headers(header or '', enrich)
+    if not result['headers']:
         return False, {}
+    return True, result
 
 
+@track_tool('email-abuse-info')
+@coalesce('email-abuse-info')
 def get_abuse_tool(domain):
     """
     Returns abuse email list for specified domain.
@@ -71,9 +68,10 @@ def get_abuse_tool(domain):
     """
     domain = get_domain_name(domain)
     try:
-        ip = socket.gethostbyname(domain)
-        obj = IPWhois(ip)
-        res = obj.lookup_whois()
+        with upstream('dns'):
+            ip = socket.gethostbyname(domain)
+        with upstream('whois'):
+            res = whois_lookup(ip, 'lookup_whois')
         emails = res['nets'][0]['emails'] or res['nets'][1]['emails']
     except (AddressNotFoundError, Exception):
         return False
@@ -84,9 +82,12 @@ def get_abuse_tool(domain):
             return ['Not found abuse contact info']
 
 
+@track_tool('mx-lookup')
+@coalesce('mx-lookup')
 def get_mx_lookup_tool(domain):
     """
     Returns MX entries for specified domain name.
+    A and AAAA records of all exchanges are resolved concurrently.
     :param domain: domain name
     :type domain: str
     :return: list with MX entries
@@ -94,62 +95,59 @@ def get_mx_lookup_tool(domain):
     """
     domain = get_domain_name(domain)
     try:
-        mx_look_up = [
-            {
-                'server': x.exchange,
-                'priority': x.preference,
-                'ip': socket.gethostbyname(domain)
-            } for x in dns.resolver.query(domain, 'MX')
-        ]
+        with upstream('dns'):
+            mx_records = list(cached_query(domain, 'MX'))
     except (dns.resolver.NXDOMAIN, Exception):
         return None
-    else:
-        return mx_look_up
+    with upstream('dns'):
+        addresses = resolve_addresses(x.exchange for x in mx_records)
+    return [
+        {
+            'server': x.exchange,
+            'priority': x.preference,
+            'ip': addresses[x.exchange][0] if addresses[x.exchange] else None,
+            'addresses': addresses[x.exchange]
+        } for x in mx_records
+    ]
 
 
+@track_tool('dns-black-list')
+@coalesce('dns-black-list')
 def get_dns_black_list_tool(ip):
     """
     Returns list of DNS servers with a mark if specified IP address listed there.
+    All zones are queried concurrently, zones which did not answer in time are marked with 'unknown' status.
     :param ip: IP address
     :type ip: str
     :return: list with DNS servers
     :rtype: list
     """
-    black_lists = [
-        'b.barracudacentral.org', 'bl.spamcannibal.org', 'bl.spamcop.net', 'blacklist.woody.ch', 'cbl.abuseat.org',
-        'cdl.anti-spam.org.cn', 'combined.abuse.ch', 'combined.rbl.msrbl.net', 'db.wpbl.info',
-        'dnsbl-1.uceprotect.net', 'dnsbl-2.uceprotect.net', 'dnsbl-3.uceprotect.net', 'dnsbl.cyberlogic.net',
-        'dnsbl.sorbs.net', 'drone.abuse.ch', 'drone.abuse.ch', 'duinv.aupads.org', 'dul.dnsbl.sorbs.net', 'dul.ru',
-        'dyna.spamrats.com', 'dynip.rothen.com', 'http.dnsbl.sorbs.net', 'images.rbl.msrbl.net',
-        'ips.backscatterer.org', 'ix.dnsbl.manitu.net', 'korea.services.net', 'misc.dnsbl.sorbs.net',
-        'noptr.spamrats.com', 'ohps.dnsbl.net.au', 'omrs.dnsbl.net.au', 'orvedb.aupads.org', 'osps.dnsbl.net.au',
-        'osrs.dnsbl.net.au', 'owfs.dnsbl.net.au', 'pbl.spamhaus.org', 'phishing.rbl.msrbl.net', 'probes.dnsbl.net.au',
-        'proxy.bl.gweep.ca', 'rbl.interserver.net', 'rdts.dnsbl.net.au', 'relays.bl.gweep.ca', 'relays.nether.net',
-        'residential.block.transip.nl', 'ricn.dnsbl.net.au', 'rmst.dnsbl.net.au', 'smtp.dnsbl.sorbs.net',
-        'socks.dnsbl.sorbs.net', 'spam.abuse.ch', 'spam.dnsbl.sorbs.net', 'spam.rbl.msrbl.net', 'spam.spamrats.com',
-        'spamrbl.imp.ch', 't3direct.dnsbl.net.au', 'tor.dnsbl.sectoor.de', 'torserver.tor.dnsbl.sectoor.de',
-        'ubl.lashback.com', 'ubl.unsubscore.com', 'virus.rbl.jp', 'virus.rbl.msrbl.net', 'web.dnsbl.sorbs.net',
-        'wormrbl.imp.ch', 'xbl.spamhaus.org', 'zen.spamhaus.org', 'zombie.dnsbl.sorbs.net', 'virbl.dnsbl.bit.nl',
-        'dnsbl.inps.de'
-    ]
+    try:
+        with upstream('dnsbl'):
+            return check_black_lists(ip)
+    except (ValueError, dns.exception.SyntaxError):
+        return None
 
-    black_list_look_up = []
-    for black_list in black_lists:
 
-        try:
-            resolver = dns.resolver.Resolver()
-            queue = '.'.join(reversed(str(ip).split('.'))) + '.' + black_list
-            resolver.query(queue, 'A')
-            resolver.query(queue, 'TXT')
-        except (dns.resolver.NoAnswer, dns.resolver.NoNameservers):
-            black_list_look_up.append({'ip': ip, 'address': black_list, 'is_present': None})
-        except dns.resolver.NXDOMAIN:
-            black_list_look_up.append({'ip': ip, 'address': black_list, 'is_present': False})
-        except Exception:
-            return None
-        else:
-            black_list_look_up.append({'ip': ip, 'address': black_list, 'is_present': True})
-    return black_list_look_up
+@track_tool('http-headers')
+@coalesce('http-headers')
+def get_http_probe(domain):
+    """
+    Returns HTTP headers of specified url together with its redirect chain.
+    Connections are kept alive in a per-process pool, HEAD falls back to GET if the server does not allow it.
+    :param domain: url or domain name
+    :type domain: str
+    :return: final headers, list of hops with timings and True if the final url is served over https
+    :rtype: dict
+    """
+    url = domain if urlparse(domain).scheme else 'http://' + domain
+    try:
+        with upstream('http'):
+            hops = probe(url)
+    except (IOError, ValueError, httplib.HTTPException, ssl.CertificateError):
+        return None
+    else:
+        return {'headers': hops[-1]['headers'], 'hops': hops, 'https': hops[-1]['url'].startswith('https://')}
 
 
 def get_http_headers(domain):
@@ -160,60 +158,27 @@ def get_http_headers(domain):
     :return: HTTP headers
     :rtype: dict
     """
-    try:
-        domain = get_domain_name(domain)
-        conn = httplib.HTTPConnection(domain, timeout=5)
-        conn.request('HEAD', '/index.html')
-        res = conn.getresponse()
-        headers = dict(res.getheaders())
-    except Exception:
-        return None
-    else:
-        return headers
+    result = get_http_probe(domain)
+    return result['headers'] if result else None
 
 
+@track_tool('dns-sec')
+@coalesce('dns-sec')
 def get_dnssec_tool(domain):
     """
-    Returns something.
+    Validates the chain of trust of specified domain name from the root zone.
     :param domain: domain name
     :type domain: str
-    :return: dns info
-    :rtype: str
+    :return: True if the domain is secure and validation result with status, reason and checked zones
+    :rtype: tuple
     """
-    domain = get_domain_name(domain)
-    dns_sec_fail = "dns.dnssec.ValidationFailure"
-    dns_sec_no_name_serv = "IN NS: Server 127.0.0.1 UDP port 53 answered SERVFAIL"
-    handl_fail = 'HANDLE QUERY FAILED (SERVER ERROR OR NO DNSKEY RECORD)'
-    fail = 'No DNSKEY records found'
-    try:
-        response = dns.resolver.query(domain, dns.rdatatype.NS)
-        nsname = response.rrset[0]
-        response = dns.resolver.query(str(nsname), dns.rdatatype.A)
-        nsaddr = response.rrset[0].to_text()
-        request = dns.message.make_query(domain,
-                                         dns.rdatatype.DNSKEY,
-                                         want_dnssec=True)
-        response = dns.query.udp(request, nsaddr)
-        if response.rcode() != 0:
-            return False, handl_fail
-        answer = response.answer
-
-        if len(answer) != 2:
-            return False, fail
-
-        name = dns.name.from_text(domain)
-        try:
-            dns.dnssec.validate(answer[0], answer[1], {name: answer[0]})
-        except dns.dnssec.ValidationFailure:
-            return False, dns_sec_fail
-        else:
-            dns_sec_good = str(response.answer[0])
-            w = re.search('(\w*.\w*.\s\d*\s\w*\s\w*\s\d*\s\d\s\d)(\s)(.*)', dns_sec_good)
-            return True, w.group(1)
-    except (dns.resolver.NoNameservers, Exception):
-        return False, dns_sec_no_name_serv
+    with upstream('dnssec'):
+        result = validate_domain(get_domain_name(domain))
+    return result['status'] == SECURE, result
 
 
+@track_tool('ip-lookup')
+@coalesce('ip-lookup')
 def get_ip_info(ip):
     """
     Returns some basic information about specified IP address.
@@ -224,9 +189,15 @@ def get_ip_info(ip):
     """
 
     try:
-        reader = GeoIP2()
-        location = reader.city(ip)
-        whois = IPWhois(ip).lookup()
+        with upstream('geoip'):
+            location = get_city(ip)
+        attribution = get_attribution(ip)
+        if attribution is None or not attribution['name']:
+            # the network is not known yet, the lookup adds it to the CIDR index
+            with upstream('whois'):
+                whois = whois_lookup(ip, 'lookup')
+            _, (_, name, description) = get_attribution_value(whois, ipaddress.ip_address(force_text(ip)))
+            attribution = {'name': name, 'description': description}
 
         data = {
             'country': location['country_name'],  # Country
@@ -234,14 +205,16 @@ def get_ip_info(ip):
             'region': location['region'],  # Region
             'lat': location['latitude'],  # Latitude
             'long': location['longitude'],  # Longitude    #
-            'provider': whois['nets'][0]['name'],  # Provider
-            'provider_info': whois['nets'][0]['address']  # Provider Info
+            'provider': attribution['name'],  # Provider
+            'provider_info': attribution['description']  # Provider Info
         }
     except Exception:
         return None
     else:
         return data
 
+@track_tool('who-is')
+@coalesce('who-is')
 def get_who_is(hostname):
     """
     Returns some information about hostname.
@@ -253,7 +226,10 @@ def get_who_is(hostname):
 
     try:
         domain = get_domain_name(hostname)
-        info = IPWhois(socket.gethostbyname(domain)).lookup_rdap()
+        with upstream('dns'):
+            ip = socket.gethostbyname(domain)
+        with upstream('whois'):
+            info = whois_lookup(ip, 'lookup_rdap')
         data = {
             'country_code': info.get('asn_country_code'),  # Country code
             'date': info.get('asn_date'),  # Date
@@ -279,6 +255,8 @@ def get_who_is(hostname):
     else:
         return data
 
+@track_tool('ns-lookup')
+@coalesce('ns-lookup')
 def get_ns_tool(domain):
     """
     Returns domain NS entries.
@@ -289,12 +267,76 @@ def get_ns_tool(domain):
     """
     try:
         domain = get_domain_name(domain)
-        data_nx = [server.to_text() for server in dns.resolver.query(domain, 'NS')]
+        with upstream('dns'):
+            data_nx = [server.to_text() for server in cached_query(domain, 'NS')]
     except Exception:
         return None
     else:
         return data_nx
 
+def _report_section(qname, rdtype, answer):
+    section = {'name': force_text(qname), 'type': rdtype, 'ttl': None, 'records': [], 'error': None}
+    if isinstance(answer, dns.resolver.NXDOMAIN):
+        section['error'] = 'Domain does not exist'
+    elif isinstance(answer, dns.resolver.NoAnswer):
+        section['error'] = 'No records'
+    elif isinstance(answer, Exception):
+        section['error'] = force_text(answer) or 'Lookup failed'
+    else:
+        section['ttl'] = answer.ttl
+        section['records'] = [rdata.to_text() for rdata in answer]
+    return section
+
+
+@track_tool('dns-report')
+@coalesce('dns-report')
+def get_dns_report(target):
+    """
+    Returns DNS report for specified domain name or IP address.
+    All record types of a domain (settings.DNS_REPORT_TYPES and SRV records of settings.DNS_REPORT_SRV_SERVICES)
+    are resolved in one batch, PTR records of its addresses in the second one.
+    Only PTR records are resolved for an IP address.
+    :param target: domain name or IP address
+    :type target: str
+    :return: dict with target and list of sections with name, type, ttl, records and error
+    :rtype: dict
+    """
+    target = get_domain_name(target)
+    try:
+        queries = [(dns.reversename.from_address(ipaddress.ip_address(force_text(target)).compressed), 'PTR')]
+    except ValueError:
+        types = getattr(settings, 'DNS_REPORT_TYPES', ('A', 'AAAA', 'CNAME', 'MX', 'NS', 'TXT', 'SOA', 'CAA'))
+        services = getattr(settings, 'DNS_REPORT_SRV_SERVICES', (
+            '_sip._tcp', '_sip._udp', '_sips._tcp', '_xmpp-client._tcp', '_xmpp-server._tcp',
+            '_autodiscover._tcp', '_caldav._tcp', '_carddav._tcp', '_imaps._tcp', '_submission._tcp'))
+        queries = [(target, rdtype) for rdtype in types] + \
+                  [('%s.%s' % (service, target), 'SRV') for service in services]
+    try:
+        with upstream('dns'):
+            answers = cached_query_many(queries)
+    except dns.exception.SyntaxError:
+        return None
+
+    sections = []
+    addresses = []
+    for (qname, rdtype), answer in zip(queries, answers):
+        if rdtype == 'SRV' and isinstance(answer, Exception):
+            # only existing services are reported
+            continue
+        sections.append(_report_section(qname, rdtype, answer))
+        if rdtype in ('A', 'AAAA') and not isinstance(answer, Exception):
+            addresses.extend(rdata.address for rdata in answer)
+    if all(section['error'] for section in sections):
+        return None
+
+    queries = [(dns.reversename.from_address(address), 'PTR') for address in addresses]
+    with upstream('dns'):
+        answers = cached_query_many(queries)
+    for (qname, rdtype), answer in zip(queries, answers):
+        sections.append(_report_section(qname, rdtype, answer))
+    return {'target': target, 'sections': sections}
+
+
 def get_client_ip(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
@@ -304,3 +346,38 @@ def get_client_ip(request):
     else:
         ip = request.META.get('REMOTE_ADDR')
     return ip
+
+
+# tools available for batch lookups and jobs, keys are the same as url names of the tool views,
+# dns-black-list has no view and is only available from the API
+TOOLS = {
+    'email-headers': parse_email_header,
+    'email-abuse-info': get_abuse_tool,
+    'mx-lookup': get_mx_lookup_tool,
+    'dns-black-list': get_dns_black_list_tool,
+    'http-headers': get_http_headers,
+    'dns-sec': get_dnssec_tool,
+    'ip-lookup': get_ip_info,
+    'who-is': get_who_is,
+    'ns-lookup': get_ns_tool,
+    'dns-report': get_dns_report,
+}
+
+
+def run_batch(tool, targets):
+    """
+    Runs tool for every target concurrently and yields results as soon as they are ready.
+    :param tool: tool function
+    :type tool: callable
+    :param targets: unique targets
+    :type targets: list
+    :return: generator of (target, result, error)
+    :rtype: generator
+    """
+    def run(target):
+        try:
+            return target, tool(target), None
+        except Exception as error:
+            return target, None, force_text(error)
+
+    return get_pool('batch').imap_unordered(run, targets)
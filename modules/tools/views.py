@@ -1,18 +1,31 @@
 from __future__ import unicode_literals
-from ua_parser import user_agent_parser
+
+import json
+from collections import OrderedDict
 
 from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, render_to_response
 from django.template import RequestContext
+from django.utils.decorators import method_decorator
+from django.utils.encoding import force_text
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import FormView, TemplateView
 
-from utilities.mixins import FormInvalidRenderMixin, RateLimitMixin
-from .forms import DomainForm, IPForm, HeadersForm, IPorDomainForm
+from utilities import get_user_agent_from_request
+from utilities.jobs import DONE, FAILED, enqueue, get_job
+from utilities.metrics import CONTENT_TYPE, render as render_metrics
+from utilities.mixins import FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin
+from utilities.dnssec import BOGUS, INSECURE, SECURE
+from utilities.ptrsweep import sweep
+from utilities.utils import is_rate_limited
+from .forms import CIDRForm, DomainForm, IPForm, HeadersForm, IPorDomainForm, clean_target
 from .utils import (parse_email_header, get_abuse_tool, get_mx_lookup_tool, get_dns_black_list_tool,
-                    get_http_headers, get_dnssec_tool, get_ip_info, get_who_is, get_ns_tool, get_client_ip )
+                    get_http_probe, get_dnssec_tool, get_ip_info, get_who_is, get_ns_tool, get_dns_report, get_client_ip,
+                    TOOLS, run_batch)
 
 
 class HomePage(View):
@@ -24,11 +37,7 @@ class HomePage(View):
         template_name = 'home.html'
         ip = get_client_ip(self.request)
         info = get_ip_info(ip)
-        ua = request.META.get('HTTP_USER_AGENT', None)
-        if ua is not None and ua != "":
-            parsed_string_ua = user_agent_parser.Parse(ua)
-        else:
-            parsed_string_ua = "Unknown"
+        parsed_string_ua = get_user_agent_from_request(request) or "Unknown"
 
         return render(request, 'home.html', {"user_ip": ip , 'user_info': info, 'user_agent': parsed_string_ua})
 
@@ -43,7 +52,8 @@ class EmailHeadersView(FormInvalidRenderMixin, RateLimitMixin, FormView):
     rate_limit = '100/d'
 
     def form_valid(self, form):
-        is_valid, parsed_headers = parse_email_header(self.request.POST.get('headers'))
+        is_valid, parsed_headers = parse_email_header(form.cleaned_data.get('headers'),
+                                                      form.cleaned_data.get('enrich'))
         if not is_valid:
             messages.add_message(self.request, messages.ERROR, 'Headers is invalid')
         context = self.get_context_data()
@@ -75,7 +85,7 @@ class AbuseEmailView(FormInvalidRenderMixin, RateLimitMixin, FormView):
         return self.render_to_response(context)
 
 
-class MXLookupView(FormInvalidRenderMixin, RateLimitMixin, FormView):
+class MXLookupView(FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin, FormView):
     """
     Looking for mx entries for specified domain.
     """
@@ -83,14 +93,16 @@ class MXLookupView(FormInvalidRenderMixin, RateLimitMixin, FormView):
     form_class = DomainForm
     template_name = 'email_tools/mx_look_up.html'
     rate_limit = '100/d'
+    tool_name = 'mx-lookup'
+    target_field = 'domain'
 
-    def form_valid(self, form):
-        mx_info = get_mx_lookup_tool(form.cleaned_data.get('domain'))
-        if not mx_info:
+    def lookup(self, target):
+        return get_mx_lookup_tool(target)
+
+    def get_result_context(self, result):
+        if not result:
             messages.add_message(self.request, messages.ERROR, 'No MX entries were found for specified domain')
-        context = self.get_context_data()
-        context['result'] = mx_info
-        return self.render_to_response(context)
+        return {'result': result}
 
 
 class HTTPHeadersView(FormInvalidRenderMixin, RateLimitMixin, FormView):
@@ -100,76 +112,264 @@ class HTTPHeadersView(FormInvalidRenderMixin, RateLimitMixin, FormView):
     rate_limit = '100/d'
 
     def form_valid(self, form):
-        headers = get_http_headers(form.cleaned_data.get('domain'))
-        if not headers:
+        info = get_http_probe(form.cleaned_data.get('domain'))
+        if not info:
             messages.add_message(self.request, messages.ERROR, 'Nothing found for this domain')
         context = self.get_context_data()
-        context['result'] = headers
+        context['result'] = info and info['headers']
+        context['hops'] = info and info['hops']
+        context['https'] = info and info['https']
         return self.render_to_response(context)
 
 
-class DNSSecView(FormInvalidRenderMixin, RateLimitMixin, FormView):
+class DNSSecView(FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin, FormView):
     http_method_names = ('get', 'post')
     form_class = DomainForm
     template_name = 'ip_tools/dnssec_tool.html'
     rate_limit = '100/d'
+    tool_name = 'dns-sec'
+    target_field = 'domain'
 
-    def form_valid(self, form):
-        status, info = get_dnssec_tool(form.cleaned_data.get('domain'))
+    def lookup(self, target):
+        return get_dnssec_tool(target)
+
+    def is_cacheable(self, result):
+        # indeterminate results are caused by unreachable servers and are retried on the next request
+        return result[1]['status'] in (SECURE, INSECURE, BOGUS)
+
+    def get_result_context(self, result):
+        status, info = result
         if not info:
             messages.add_message(self.request, messages.ERROR, 'Nothing found for this domain')
-        context = self.get_context_data()
-        context['status'] = status
-        context['result'] = info
-        return self.render_to_response(context)
+        return {'status': status, 'result': info}
 
 
-class IPLookupView(FormInvalidRenderMixin, RateLimitMixin, FormView):
+class IPLookupView(FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin, FormView):
     http_method_names = ('get', 'post')
     form_class = IPForm
     template_name = 'ip_tools/ip_lookup.html'
     rate_limit = '100/d'
+    tool_name = 'ip-lookup'
+    target_field = 'ip'
 
-    def form_valid(self, form):
-        info = get_ip_info(form.cleaned_data.get('ip'))
-        if not info:
+    def lookup(self, target):
+        return get_ip_info(target)
+
+    def get_result_context(self, result):
+        if not result:
             messages.add_message(self.request, messages.ERROR, 'Nothing found for this IP address')
-        context = self.get_context_data()
-        context['result'] = info
-        return self.render_to_response(context)
+        return {'result': result}
 
 
-class WhoIsView(FormInvalidRenderMixin, RateLimitMixin, FormView):
+class WhoIsView(FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin, FormView):
     http_method_names = ('get', 'post')
     form_class = IPorDomainForm
     template_name = 'ip_tools/who_is.html'
     rate_limit = '100/d'
+    tool_name = 'who-is'
+    target_field = 'ip_or_domain'
 
-    def form_valid(self, form):
-        print(form.cleaned_data.get('ip_or_domain'))
-        info = get_who_is(form.cleaned_data.get('ip_or_domain'))
-        if not info:
+    def lookup(self, target):
+        return get_who_is(target)
+
+    def get_result_context(self, result):
+        if not result:
             messages.add_message(self.request, messages.ERROR, 'Nothing found for specified domain')
-        context = self.get_context_data()
-        context['result'] = info
-        return self.render_to_response(context)
+        return {'result': result}
 
 
-class NSLookupView(FormInvalidRenderMixin, RateLimitMixin, FormView):
+class NSLookupView(FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin, FormView):
     http_method_names = ('get', 'post')
     form_class = DomainForm
     template_name = 'ip_tools/ns_lookup.html'
     rate_limit = '100/d'
+    tool_name = 'ns-lookup'
+    target_field = 'domain'
 
-    def form_valid(self, form):
-        info = get_ns_tool(form.cleaned_data.get('domain'))
-        if not info:
+    def lookup(self, target):
+        return get_ns_tool(target)
+
+    def get_result_context(self, result):
+        if not result:
             messages.add_message(self.request, messages.ERROR, 'No NS found for specified domain')
+        return {'result': result}
+
+
+class DNSReportView(FormInvalidRenderMixin, RateLimitMixin, ResultCacheMixin, FormView):
+    """
+    Shows all common DNS records of specified domain or PTR records of specified IP address.
+    """
+    http_method_names = ('get', 'post')
+    form_class = IPorDomainForm
+    template_name = 'ip_tools/dns_report.html'
+    rate_limit = '100/d'
+    tool_name = 'dns-report'
+    target_field = 'ip_or_domain'
+
+    def lookup(self, target):
+        return get_dns_report(target)
+
+    def get_result_context(self, result):
+        if not result:
+            messages.add_message(self.request, messages.ERROR, 'No DNS records found for specified domain')
+        return {'result': result}
+
+
+class PTRSweepView(FormInvalidRenderMixin, FormView):
+    """
+    Page of the PTR sweep tool, results are loaded from PTRSweepStreamView while they are resolved.
+    """
+    http_method_names = ('get', 'post')
+    form_class = CIDRForm
+    template_name = 'ip_tools/ptr_sweep.html'
+
+    def form_valid(self, form):
         context = self.get_context_data()
-        context['result'] = info
+        context['cidr'] = form.cleaned_data.get('cidr').with_prefixlen
         return self.render_to_response(context)
 
 
+class PTRSweepStreamView(RateLimitMixin, View):
+    """
+    Streams PTR records of every address of a network as NDJSON.
+    Example:
+        GET /api/ptr-sweep/?cidr=192.0.2.0/24
+    """
+    http_method_names = ('get',)
+    rate_limit = '20/d'
+
+    def get(self, request):
+        form = CIDRForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'error': form.errors.get('cidr', ['Invalid network'])[0]}, status=400)
+        lines = (json.dumps(result) + '\n' for result in sweep(form.cleaned_data.get('cidr')))
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+class BatchLookupView(View):
+    """
+    Runs a tool for a JSON list of targets and streams results back as NDJSON as soon as they are ready.
+    Example:
+        POST /api/batch/mx-lookup/ with body {"targets": ["http://example.com", "http://example.org"]}
+    Targets are validated by the form of the tool view, invalid targets are answered with an error.
+    Duplicated targets are looked up once, every valid target is counted against the rate limit of the tool views.
+    """
+    http_method_names = ('post',)
+    rate_limit = '100/d'
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(BatchLookupView, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request, tool):
+        if tool not in TOOLS:
+            raise Http404()
+        try:
+            data = json.loads(request.body)
+            targets = data['targets'] if isinstance(data, dict) else data
+            if not isinstance(targets, list):
+                raise ValueError()
+        except (ValueError, KeyError):
+            return JsonResponse({'error': 'Expected JSON list of targets'}, status=400)
+
+        max_targets = getattr(settings, 'BATCH_MAX_TARGETS', 1000)
+        unique = list(OrderedDict.fromkeys(target for target in targets if isinstance(target, basestring)))
+        if len(unique) > max_targets:
+            return JsonResponse({'error': 'Too many targets, maximum is %d' % max_targets}, status=400)
+
+        # cleaned targets with the targets they were entered as
+        allowed, failed = OrderedDict(), []
+        for target in unique:
+            cleaned, error = clean_target(tool, target)
+            if error is not None:
+                failed.append((target, error))
+            elif cleaned in allowed:
+                continue
+            elif is_rate_limited(request, self.rate_limit, True):
+                failed.append((target, 'Rate limited'))
+            else:
+                allowed[cleaned] = target
+        return StreamingHttpResponse(self.stream(TOOLS[tool], allowed, failed),
+                                     content_type='application/x-ndjson')
+
+    def stream(self, tool, targets, failed):
+        for target, error in failed:
+            yield json.dumps({'target': target, 'error': error}) + '\n'
+        for cleaned, result, error in run_batch(tool, list(targets)):
+            target = targets[cleaned]
+            line = {'target': target, 'error': error} if error else {'target': target, 'result': result}
+            yield json.dumps(line, default=force_text) + '\n'
+
+
+class JobCreateView(View):
+    """
+    Queues a lookup and returns its job id right away, the result is collected from JobStatusView.
+    Example:
+        POST /api/jobs/dns-sec/ with body {"target": "http://example.com"}
+    """
+    http_method_names = ('post',)
+    rate_limit = '100/d'
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        return super(JobCreateView, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request, tool):
+        if tool not in TOOLS:
+            raise Http404()
+        try:
+            target = json.loads(request.body)['target']
+            if not isinstance(target, basestring):
+                raise ValueError()
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Expected JSON object with target'}, status=400)
+        target, error = clean_target(tool, target)
+        if error is not None:
+            return JsonResponse({'error': error}, status=400)
+        if is_rate_limited(request, self.rate_limit, True):
+            return JsonResponse({'error': 'Rate limited'}, status=429)
+
+        job = enqueue(tool, target)
+        if job['status'] == FAILED:
+            return JsonResponse({'id': job['id'], 'error': job['error']}, status=503)
+        url = reverse('job-status', kwargs={'job_id': job['id']})
+        response = JsonResponse({'id': job['id'], 'status': job['status'], 'url': url}, status=202)
+        response['Location'] = url
+        return response
+
+
+class JobStatusView(View):
+    """
+    Returns status of a queued lookup with its result or error once it is finished.
+    Unfinished jobs are answered with 202 and Retry-After header.
+    """
+    http_method_names = ('get',)
+
+    def get(self, request, job_id):
+        job = get_job(job_id)
+        if job is None:
+            raise Http404()
+        response = HttpResponse(json.dumps(job, default=force_text), content_type='application/json',
+                                status=200 if job['status'] in (DONE, FAILED) else 202)
+        if response.status_code == 202:
+            response['Retry-After'] = getattr(settings, 'JOBS_POLL_INTERVAL', 1)
+        return response
+
+
+class MetricsView(View):
+    """
+    Exposes metrics of all workers in Prometheus text format to settings.METRICS_ALLOWED_IPS.
+    The peer address is checked, X-Forwarded-For and X-Real-IP are set by clients and are not trusted.
+    """
+    http_method_names = ('get',)
+
+    def get(self, request):
+        allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+        if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+            raise Http404()
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
 def handler404(request):
     response = render_to_response('404.html', {}, RequestContext(request))
     response.status_code = 404
@@ -20,7 +20,8 @@ from django.conf.urls.static import static
 from django.conf.urls import include, url
 from django.contrib import admin
 from modules.tools.views import ( HomePage, EmailHeadersView, AbuseEmailView, MXLookupView,
-HTTPHeadersView,DNSSecView, IPLookupView, WhoIsView, NSLookupView, handler404, handler500 )
+HTTPHeadersView,DNSSecView, IPLookupView, WhoIsView, NSLookupView, DNSReportView, PTRSweepView, PTRSweepStreamView,
+BatchLookupView, JobCreateView, JobStatusView, MetricsView, handler404, handler500 )
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
@@ -28,12 +29,25 @@ urlpatterns = [
     url(r'^email-headers/$', EmailHeadersView.as_view(), name='email-headers'),
     url(r'^email-abuse-info/$', AbuseEmailView.as_view(), name='email-abuse-info'),
     url(r'^mx-lookup/$', MXLookupView.as_view(), name='mx-lookup'),
+    url(r'^mx-lookup/(?P<target>[^/]+)/$', MXLookupView.as_view(), name='mx-lookup-result'),
 
     url(r'^http-headers/$', HTTPHeadersView.as_view(), name='http-headers'),
     url(r'^dns-sec/$', DNSSecView.as_view(), name='dns-sec'),
+    url(r'^dns-sec/(?P<target>[^/]+)/$', DNSSecView.as_view(), name='dns-sec-result'),
     url(r'^ip-lookup/$', IPLookupView.as_view(), name='ip-lookup'),
+    url(r'^ip-lookup/(?P<target>[^/]+)/$', IPLookupView.as_view(), name='ip-lookup-result'),
     url(r'^who-is/$', WhoIsView.as_view(), name='who-is'),
+    url(r'^who-is/(?P<target>[^/]+)/$', WhoIsView.as_view(), name='who-is-result'),
     url(r'^ns-lookup/$', NSLookupView.as_view(), name='ns-lookup'),
+    url(r'^ns-lookup/(?P<target>[^/]+)/$', NSLookupView.as_view(), name='ns-lookup-result'),
+    url(r'^dns-report/$', DNSReportView.as_view(), name='dns-report'),
+    url(r'^dns-report/(?P<target>[^/]+)/$', DNSReportView.as_view(), name='dns-report-result'),
+    url(r'^ptr-sweep/$', PTRSweepView.as_view(), name='ptr-sweep'),
+    url(r'^api/ptr-sweep/$', PTRSweepStreamView.as_view(), name='ptr-sweep-stream'),
+    url(r'^api/batch/(?P<tool>[\w-]+)/$', BatchLookupView.as_view(), name='batch-lookup'),
+    url(r'^api/jobs/(?P<job_id>[0-9a-f]{32})/$', JobStatusView.as_view(), name='job-status'),
+    url(r'^api/jobs/(?P<tool>[\w-]+)/$', JobCreateView.as_view(), name='job-create'),
+    url(r'^metrics$', MetricsView.as_view(), name='metrics'),
     url(r'^seo/', include('modules.seo.urls', namespace='seo')),
 
 ]